@@ -7,9 +7,11 @@ import pytest
 from click.testing import CliRunner
 
 import upload_rest_api.__main__
+from upload_rest_api.models.directory_size_entry import DirectorySizeEntry
 from upload_rest_api.models.file_entry import FileEntry
 from upload_rest_api.models.project import Project, ProjectExistsError
 from upload_rest_api.models.token import Token, TokenEntry
+from upload_rest_api.models.trash_entry import TrashEntry, TrashedFileEntry
 from upload_rest_api.models.user import User, UserExistsError
 
 
@@ -45,6 +47,9 @@ def test_cleanup(mocker, command, command_runner):
     """
     mock_clean_mongo = mocker.patch('upload_rest_api.__main__.clean_mongo')
     mock_clean_disk = mocker.patch('upload_rest_api.__main__.clean_disk')
+    mock_clean_trash = mocker.patch('upload_rest_api.__main__.clean_trash')
+    mock_clean_file_tree_snapshots \
+        = mocker.patch('upload_rest_api.__main__.clean_file_tree_snapshots')
     mock_clean_tus_uploads \
         = mocker.patch('upload_rest_api.__main__.clean_tus_uploads')
     mock_clean_other_uploads \
@@ -55,15 +60,17 @@ def test_cleanup(mocker, command, command_runner):
     funcs_to_call = []
 
     if command == "files":
-        funcs_to_call = [mock_clean_disk]
+        funcs_to_call = [
+            mock_clean_trash, mock_clean_disk, mock_clean_file_tree_snapshots
+        ]
     elif command == "mongo":
         funcs_to_call = [mock_clean_mongo]
     elif command == "uploads":
         funcs_to_call = [mock_clean_tus_uploads, mock_clean_other_uploads]
 
     all_cli_funcs = (
-        mock_clean_disk, mock_clean_mongo, mock_clean_tus_uploads,
-        mock_clean_other_uploads
+        mock_clean_disk, mock_clean_trash, mock_clean_file_tree_snapshots,
+        mock_clean_mongo, mock_clean_tus_uploads, mock_clean_other_uploads
     )
 
     for cli_func in all_cli_funcs:
@@ -425,6 +432,52 @@ def test_modify_project_fail(command_runner):
     assert result.output == "Project 'test_project' does not exist.\n"
 
 
+def test_update_used_quota(command_runner, mock_config):
+    """Test recalculating used quota of a project."""
+    project = Project.create(identifier="test_project", quota=2048)
+    (project.directory / "test.txt").write_bytes(b"foo")
+    Project.create(identifier="test_project2", quota=2048)
+
+    result = command_runner(["projects", "update-used-quota"])
+
+    assert result.output == (
+        "Used quota of project 'test_project': 3\n"
+        "Used quota of project 'test_project2': 0\n"
+    )
+    assert Project.get(id="test_project").used_quota == 3
+
+
+def test_create_file_indexes(command_runner):
+    """Test creating the database indexes of files."""
+    result = command_runner(["files", "create-indexes"])
+
+    assert result.output == "Created database indexes\n"
+    assert "trash_1" \
+        in TrashedFileEntry._get_collection().index_information()
+    assert "project_1" in TrashEntry._get_collection().index_information()
+
+
+def test_update_file_index(command_runner, mock_config):
+    """Test indexing the files of a project."""
+    project = Project.create(identifier="test_project", quota=2048)
+    (project.directory / "test").mkdir()
+    (project.directory / "test" / "test.txt").write_bytes(b"foo")
+    FileEntry(
+        path=str(project.directory / "test" / "test.txt"),
+        checksum="foo",
+        identifier="urn:uuid:1"
+    ).save()
+
+    result = command_runner(["files", "update-index", "test_project"])
+
+    assert result.output \
+        == "Indexed 1 directories and 1 files of project 'test_project'\n"
+    assert FileEntry.objects.get(identifier="urn:uuid:1").size == 3
+    # The database indexes were created
+    assert "project_1" \
+        in DirectorySizeEntry._get_collection().index_information()
+
+
 @pytest.mark.usefixtures('app')  # Initialize database
 def test_get_file_by_path(command_runner):
     """Test displaying information of file specified by path."""
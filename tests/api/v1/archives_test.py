@@ -101,6 +101,78 @@ def test_upload_archive(
     assert metadata['filename'] == 'test.txt'
 
 
+def test_upload_archive_stream(
+    app, test_auth, test_mongo, background_job_runner, requests_mock
+):
+    """Test uploading tar archive that is extracted while it is uploaded.
+
+    The archive should not be saved to disk, and the background job
+    should only store the extracted files.
+    """
+    # Mock metax
+    metax_files_api = requests_mock.post('/v3/files/post-many?include_nulls=True', json={})
+    requests_mock.get('/v3/files', json={'next': None, 'results': []})
+
+    test_client = app.test_client()
+
+    response = _upload_file(test_client,
+                            "/v1/archives/test_project?stream=true",
+                            test_auth,
+                            "tests/data/test.tar.gz")
+    assert response.status_code == 202
+
+    # Archive has already been extracted, and it was not saved to disk
+    upload_tmp_path = pathlib.Path(app.config.get("UPLOAD_TMP_PATH"))
+    tmp_dirs = [path for path in upload_tmp_path.iterdir() if path.is_dir()]
+    assert len(tmp_dirs) == 1
+    assert not (tmp_dirs[0] / "source").exists()
+    assert (tmp_dirs[0] / "tmp_storage" / "test" / "test.txt").is_file()
+
+    response = background_job_runner(test_client, "upload", response)
+    assert response.json['status'] == 'done'
+
+    text_file = pathlib.Path(app.config.get("UPLOAD_PROJECTS_PATH")) \
+        / "test_project" / "test" / "test.txt"
+    assert text_file.is_file()
+    assert not any(upload_tmp_path.iterdir())
+
+    document = test_mongo.upload.files.find_one({"_id": str(text_file)})
+    assert document['checksum'] == "150b62e4e7d58c70503bd5fc8a26463c"
+    metadata = metax_files_api.last_request.json()[0]
+    assert metadata['pathname'] == '/test/test.txt'
+
+
+@pytest.mark.parametrize(
+    ["archive", "checksum", "error"],
+    [
+        ("tests/data/test.zip", None,
+         "Uploaded file is not a supported tar archive"),
+        ("tests/data/symlink.tar.gz", None,
+         "File 'test/link' has unsupported type: SYM"),
+        ("tests/data/test.tar.gz", "foo",
+         "Checksum of uploaded file does not match provided checksum."),
+    ]
+)
+def test_upload_archive_stream_invalid(
+        archive, checksum, error, app, test_auth):
+    """Test that invalid streamed archives are rejected immediately."""
+    url = "/v1/archives/test_project?stream=true"
+    if checksum:
+        url += f"&md5={checksum}"
+
+    response = _upload_file(app.test_client(), url, test_auth, archive)
+
+    assert response.status_code == 400
+    assert response.json["error"] == error
+
+    # Nothing is left in the temporary directory or the project
+    upload_tmp_path = pathlib.Path(app.config.get("UPLOAD_TMP_PATH"))
+    assert not any(upload_tmp_path.iterdir())
+    project_path = pathlib.Path(app.config.get("UPLOAD_PROJECTS_PATH")) \
+        / "test_project"
+    assert not any(project_path.iterdir())
+
+
 @pytest.mark.parametrize(
     "dirpath",
     [
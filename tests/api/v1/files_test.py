@@ -1,4 +1,5 @@
 """Tests for ``upload_rest_api.api.v1.files`` module."""
+import json
 import os
 import pathlib
 import shutil
@@ -8,9 +9,11 @@ import pymongo
 from metax_access import (DS_STATE_TECHNICAL_METADATA_GENERATED,
                           DS_STATE_IN_DIGITAL_PRESERVATION)
 
+from upload_rest_api.api.v1.files import _open_dir_tree_snapshot
 from upload_rest_api.models.file_entry import FileEntry
-from upload_rest_api.models.project import ProjectEntry
-from upload_rest_api.lock import ProjectLockManager, LockAlreadyTaken
+from upload_rest_api.models.project import Project, ProjectEntry
+from upload_rest_api.models.resource import Directory
+from upload_rest_api.lock import ProjectLockManager
 from tests.metax_data.utils import TEMPLATE_FILE, TEMPLATE_DATASET, update_nested_dict
 
 
@@ -517,6 +520,160 @@ def test_get_files(app, test_auth, path, expected_data, requests_mock):
             or set(response.json[key]) == set(expected_data[key])
 
 
+@pytest.mark.parametrize("file_tree_cache", [True, False])
+def test_get_all_files_etag(app, test_auth, mock_config, file_tree_cache):
+    """Test revalidating the file tree of a project.
+
+    The file tree should not be sent again if it has not changed since
+    the previous request. Changing the tree should change the ETag.
+
+    :param app: Flask app
+    :param test_auth: authentication headers
+    :param mock_config: Configuration
+    :param file_tree_cache: Whether file tree snapshots are enabled
+    """
+    mock_config["FILE_TREE_CACHE"] = file_tree_cache
+    test_client = app.test_client()
+
+    response = test_client.get(
+        "/v1/files/test_project?all=true", headers=test_auth
+    )
+    assert response.status_code == 200
+    assert response.json == {"/": []}
+    etag = response.headers["ETag"]
+
+    # The tree has not changed
+    response = test_client.get(
+        "/v1/files/test_project?all=true",
+        headers={**test_auth, "If-None-Match": etag}
+    )
+    assert response.status_code == 304
+
+    # Adding a directory invalidates the tree
+    Directory.create("test_project", "new_dir")
+    response = test_client.get(
+        "/v1/files/test_project?all=true",
+        headers={**test_auth, "If-None-Match": etag}
+    )
+    assert response.status_code == 200
+    assert response.json == {"/": [], "/new_dir": []}
+    assert response.headers["ETag"] != etag
+
+
+def test_get_all_files_etag_recreated_project(app, test_auth, mock_config):
+    """Test revalidating the file tree of a recreated project.
+
+    A project that is deleted and created again starts from the same
+    file tree version, but the ETag and the snapshot of the deleted
+    project should not be used for it.
+
+    :param app: Flask app
+    :param test_auth: authentication headers
+    :param mock_config: Configuration
+    """
+    mock_config["FILE_TREE_CACHE"] = True
+    test_client = app.test_client()
+
+    Directory.create("test_project", "old_dir")
+    response = test_client.get(
+        "/v1/files/test_project?all=true", headers=test_auth
+    )
+    assert response.json == {"/": [], "/old_dir": []}
+    etag = response.headers["ETag"]
+
+    # Delete the project and create it again
+    project = Project.get(id="test_project")
+    project.delete()
+    shutil.rmtree(project.directory)
+    Project.create("test_project")
+    Directory.create("test_project", "new_dir")
+
+    response = test_client.get(
+        "/v1/files/test_project?all=true",
+        headers={**test_auth, "If-None-Match": etag}
+    )
+    assert response.status_code == 200
+    assert response.json == {"/": [], "/new_dir": []}
+    assert response.headers["ETag"] != etag
+
+
+@pytest.mark.usefixtures("app")
+def test_dir_tree_snapshot_replaced():
+    """Test replacing the file tree snapshot while it is being read.
+
+    A snapshot that was opened before it was replaced by a newer
+    snapshot should remain readable.
+    """
+    project = Project.get(id="test_project")
+    old_snapshot = _open_dir_tree_snapshot(project, "1")
+
+    Directory.create("test_project", "new_dir")
+    with _open_dir_tree_snapshot(project, "2") as new_snapshot:
+        assert json.loads(new_snapshot.read()) \
+            == {"/": [], "/new_dir": []}
+
+    with old_snapshot:
+        assert json.loads(old_snapshot.read()) == {"/": []}
+
+    # Only the newest snapshot is kept
+    snapshot_dir = pathlib.Path(old_snapshot.name).parent
+    assert [path.name for path in snapshot_dir.iterdir()] == ["2.json"]
+
+
+def test_get_files_paginated(app, test_auth):
+    """Test listing a directory one page at a time.
+
+    The entries should be returned in order of name, and the cursor of
+    each page should point to the next page.
+
+    :param app: Flask app
+    :param test_auth: authentication headers
+    """
+    project_path = pathlib.Path(app.config.get("UPLOAD_PROJECTS_PATH")) \
+        / "test_project"
+    (project_path / "dir_b").mkdir(parents=True)
+    for name in ("file_a", "file_c", "file_d"):
+        (project_path / name).write_text("foo")
+
+    test_client = app.test_client()
+    pages = []
+    cursor = None
+    while True:
+        query = {"limit": 2, "details": "true"}
+        if cursor:
+            query["cursor"] = cursor
+        response = test_client.get(
+            "/v1/files/test_project/", query_string=query, headers=test_auth
+        )
+        assert response.status_code == 200
+        pages.append(response.json)
+        cursor = response.json["next_cursor"]
+        if cursor is None:
+            break
+
+    assert pages == [
+        {
+            "directories": [{"name": "dir_b"}],
+            "files": [{"name": "file_a", "size": 3}],
+            "next_cursor": "file_a"
+        },
+        {
+            "directories": [],
+            "files": [
+                {"name": "file_c", "size": 3},
+                {"name": "file_d", "size": 3}
+            ],
+            "next_cursor": None
+        }
+    ]
+
+    # Invalid limit
+    response = test_client.get(
+        "/v1/files/test_project/?limit=0", headers=test_auth
+    )
+    assert response.status_code == 400
+
+
 @pytest.mark.parametrize(
     'target,files_to_delete',
     [
@@ -563,15 +720,18 @@ def test_delete_directory(
             f'/v1/files/test_project/{file}', headers=test_auth
         ).json['identifier']
 
-    # Delete a directory. Deletion taks should be created and directory
-    # should be locked
+    # Delete a directory. Deletion task should be created. The
+    # directory should be moved to trash at once, but it should be
+    # locked until the task has moved its database entries to trash.
     response = test_client.delete(
         f"/v1/files/test_project{target}", headers=test_auth
     )
     assert response.status_code == 202
     assert response.json['message'] == 'Deleting metadata'
     assert response.json['status'] == 'pending'
-    with pytest.raises(LockAlreadyTaken):
+    assert not (project_directory / 'test').exists()
+    assert project_directory.exists()
+    with pytest.raises(ValueError):
         ProjectLockManager().acquire(
             'test_project', project_directory / target.strip('/')
         )
@@ -582,6 +742,12 @@ def test_delete_directory(
     assert response.status_code == 200
     assert response.json["message"] \
         == f'Deleted files and metadata: /{target.strip("/")}'
+    ProjectLockManager().acquire(
+        'test_project', project_directory / target.strip('/')
+    )
+    ProjectLockManager().release(
+        'test_project', project_directory / target.strip('/')
+    )
 
     # The files in target directory should be deleted. Other files
     # should still exist.
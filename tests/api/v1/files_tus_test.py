@@ -1,14 +1,18 @@
 """Tests for `upload_rest_api.api.v1.files_tus` module."""
 
 import pathlib
+import time
 import urllib
 import re
+from collections import OrderedDict
 from io import BytesIO
 
 import pytest
 from flask_tus_io.resource import encode_tus_meta
 
+from upload_rest_api.api.v1 import files_tus
 from upload_rest_api.jobs.utils import get_job_queue
+from upload_rest_api.lock import DEFAULT_LOCK_TTL
 from upload_rest_api.models.project import ProjectEntry
 
 
@@ -266,6 +270,139 @@ def test_upload_file_checksum_iterative(
     )
 
 
+@pytest.mark.usefixtures("project")
+def test_upload_file_checksum_incremental(
+        app, test_client, test_auth, test_mongo, mock_config, requests_mock
+):
+    """Test that checksum is calculated while the file is uploaded.
+
+    The upload exceeds the threshold for asynchronous checksum
+    calculation, but only the last chunk has not been hashed when the
+    upload is completed, so the upload is finished without a background
+    job.
+    """
+    mock_config["UPLOAD_ASYNC_THRESHOLD_BYTES"] = 10
+
+    # Mock Metax
+    requests_mock.post('/v3/files/post-many?include_nulls=True', json={})
+    requests_mock.get('/v3/files?pathname=%2Ftest.txt&csc_project=test_project&include_nulls=True',
+                      json={'results': [], 'next': None})
+    upload_metadata = {
+        "type": "file",
+        "project_id": "test_project",
+        "filename": "test.txt",
+        "upload_path": "test.txt",
+        "checksum": (
+            "sha256:d134cfd960e025a14b65c8ab3ff61"
+            "2d40957c9af0025ded4810d8f2d312455a8"
+        )
+    }
+
+    resp = test_client.post(
+        "/v1/files_tus",
+        headers={
+            **{
+                "Tus-Resumable": "1.0.0",
+                "Upload-Length": "25",
+                "Upload-Metadata": encode_tus_meta(upload_metadata)
+            },
+            **test_auth
+        }
+    )
+    assert resp.status_code == 201  # CREATED
+    location = resp.location
+
+    # Upload 'XyzzyXyzzyXyzzyXyzzyXyzzy' in 5 chunks
+    for i in range(0, 5):
+        resp = test_client.patch(
+            location,
+            content_type="application/offset+octet-stream",
+            headers={
+                **{
+                    "Content-Type": "application/offset+octet-stream",
+                    "Tus-Resumable": "1.0.0",
+                    "Upload-Offset": str(i*5)
+                },
+                **test_auth
+            },
+            input_stream=BytesIO(b"Xyzzy")
+        )
+        assert resp.status_code == 204
+
+    # No background job was needed to calculate the checksum
+    assert not get_job_queue('upload').job_ids
+
+    upload_path = pathlib.Path(app.config.get("UPLOAD_PROJECTS_PATH"))
+    assert test_mongo.upload.files.find_one(
+        {
+            "_id": str(upload_path / "test_project" / "test.txt"),
+            "checksum": "71680afeb1ac710d2cc230b96c9cc894"
+        }
+    )
+
+
+@pytest.mark.usefixtures("project")
+def test_upload_file_checksum_without_hasher(
+        app, test_client, test_auth, test_mongo, requests_mock
+):
+    """Test completing an upload whose checksums were not tracked.
+
+    If the upload was resumed in a process that does not have its
+    hasher, the checksums should be calculated from the whole file.
+    """
+    requests_mock.post('/v3/files/post-many?include_nulls=True', json={})
+    requests_mock.get('/v3/files?pathname=%2Ftest.txt&csc_project=test_project&include_nulls=True',
+                      json={'results': [], 'next': None})
+    upload_metadata = {
+        "type": "file",
+        "project_id": "test_project",
+        "filename": "test.txt",
+        "upload_path": "test.txt",
+        "checksum": "md5:a5d1741953bf0c12b7a097f58944e474"
+    }
+
+    resp = test_client.post(
+        "/v1/files_tus",
+        headers={
+            **{
+                "Tus-Resumable": "1.0.0",
+                "Upload-Length": "10",
+                "Upload-Metadata": encode_tus_meta(upload_metadata)
+            },
+            **test_auth
+        }
+    )
+    assert resp.status_code == 201  # CREATED
+    location = resp.location
+
+    # Upload 'XyzzyXyzzy' in 2 chunks. The hashers are lost between the
+    # chunks, as if the second chunk was handled by another process.
+    for i in range(0, 2):
+        files_tus._UPLOAD_HASHERS.clear()
+        resp = test_client.patch(
+            location,
+            content_type="application/offset+octet-stream",
+            headers={
+                **{
+                    "Content-Type": "application/offset+octet-stream",
+                    "Tus-Resumable": "1.0.0",
+                    "Upload-Offset": str(i*5)
+                },
+                **test_auth
+            },
+            input_stream=BytesIO(b"Xyzzy")
+        )
+        assert resp.status_code == 204
+
+    upload_path = pathlib.Path(app.config.get("UPLOAD_PROJECTS_PATH"))
+    assert test_mongo.upload.files.find_one(
+        {
+            "_id": str(upload_path / "test_project" / "test.txt"),
+            "checksum": "a5d1741953bf0c12b7a097f58944e474"
+        }
+    )
+
+
 @pytest.mark.usefixtures("project", "mock_redis")
 def test_upload_file_checksum_incorrect_syntax(test_client, test_auth):
     """Test uploading a file with a checksum using incorrect syntax."""
@@ -824,3 +961,20 @@ def test_compute_checksum_once(app, test_auth, requests_mock,
     assert metax_files_api.last_request.json()[0]['checksum'] \
         == 'md5:912ec803b2ce49e4a541068d495ab570'
     mock_get_file_checksum.assert_not_called()
+
+
+def test_discard_idle_hashers(monkeypatch):
+    """Test that hashers of abandoned uploads are discarded.
+
+    The default lock TTL should be used if UPLOAD_LOCK_TTL is not
+    configured.
+    """
+    monkeypatch.delitem(files_tus.CONFIG, "UPLOAD_LOCK_TTL", raising=False)
+    monkeypatch.setattr(files_tus, "_UPLOAD_HASHERS", OrderedDict())
+    now = time.monotonic()
+    files_tus._UPLOAD_HASHERS["idle"] = (None, now - DEFAULT_LOCK_TTL - 1)
+    files_tus._UPLOAD_HASHERS["active"] = (None, now)
+
+    files_tus._discard_idle_hashers()
+
+    assert list(files_tus._UPLOAD_HASHERS) == ["active"]
@@ -0,0 +1,121 @@
+"""Tests for ``upload_rest_api.archive`` module."""
+import io
+import tarfile
+
+import pytest
+from archive_helpers.extract import (ExtractError, MemberNameError,
+                                     MemberOverwriteError, MemberTypeError)
+
+from upload_rest_api.archive import (ArchiveIndex, ExtractedFile,
+                                     UnsupportedArchiveError, extract,
+                                     extract_tar_stream)
+
+
+@pytest.mark.parametrize(
+    ["archive", "format_", "directories"],
+    [
+        ("tests/data/test.tar.gz", "tar", ["test"]),
+        ("tests/data/test.zip", "zip", ["test/"]),
+    ]
+)
+def test_archive_index(archive, format_, directories):
+    """Test indexing an archive."""
+    with ArchiveIndex.open(archive) as index:
+        assert index.format == format_
+        assert index.files == ["test/test.txt"]
+        assert index.directories == directories
+        assert index.size == 31
+
+
+def test_archive_index_unsupported_file():
+    """Test that regular files can not be indexed."""
+    with pytest.raises(UnsupportedArchiveError):
+        ArchiveIndex.open("tests/data/test.txt")
+
+
+@pytest.mark.parametrize(
+    "archive", ["tests/data/test.tar.gz", "tests/data/test.zip"]
+)
+def test_extract(archive, tmp_path):
+    """Test that checksums of files are calculated during extraction."""
+    manifest = extract(archive, tmp_path)
+
+    extracted_file = tmp_path / "test" / "test.txt"
+    assert extracted_file.read_text().startswith(
+        "test file for REST file upload"
+    )
+    assert manifest == {
+        str(extracted_file): ExtractedFile(
+            size=31, checksum="150b62e4e7d58c70503bd5fc8a26463c"
+        )
+    }
+
+
+@pytest.mark.parametrize(
+    "archive", ["tests/data/symlink.tar.gz", "tests/data/symlink.zip"]
+)
+def test_extract_unsupported_type(archive, tmp_path):
+    """Test that nothing is extracted if archive contains symlinks."""
+    with pytest.raises(MemberTypeError) as error:
+        extract(archive, tmp_path)
+
+    assert str(error.value) == "File 'test/link' has unsupported type: SYM"
+    assert not any(tmp_path.iterdir())
+
+
+def test_extract_invalid_path(tmp_path):
+    """Test that members can not be extracted outside target directory."""
+    archive = tmp_path / "archive.tar"
+    with tarfile.open(archive, "w") as tar:
+        member = tarfile.TarInfo("../evil")
+        member.size = 1
+        tar.addfile(member, io.BytesIO(b"a"))
+
+    with pytest.raises(MemberNameError):
+        extract(archive, tmp_path / "extract")
+
+    assert not (tmp_path / "evil").exists()
+
+
+def test_extract_overwrite(tmp_path):
+    """Test that existing files are not overwritten."""
+    (tmp_path / "test").mkdir()
+    (tmp_path / "test" / "test.txt").write_text("foo")
+
+    with pytest.raises(MemberOverwriteError):
+        extract("tests/data/test.tar.gz", tmp_path)
+
+    assert (tmp_path / "test" / "test.txt").read_text() == "foo"
+
+
+def test_extract_blank_tar(tmp_path):
+    """Test that blank tar archives are not extracted."""
+    with pytest.raises(ExtractError) as error:
+        extract("tests/data/blank_tar.tar", tmp_path)
+
+    assert str(error.value) == "Blank tar archives are not supported."
+
+
+def test_extract_tar_stream(tmp_path):
+    """Test extracting tar archive from a non-seekable stream."""
+    checked_members = []
+    with open("tests/data/test.tar.gz", "rb") as file_:
+        stream = io.BufferedReader(io.BytesIO(file_.read()))
+        manifest = extract_tar_stream(
+            stream, tmp_path,
+            check_member=lambda member: checked_members.append(member.name)
+        )
+
+    assert checked_members == ["test", "test/test.txt"]
+    assert manifest == {
+        str(tmp_path / "test" / "test.txt"): ExtractedFile(
+            size=31, checksum="150b62e4e7d58c70503bd5fc8a26463c"
+        )
+    }
+
+
+def test_extract_tar_stream_zip(tmp_path):
+    """Test that zip archives can not be extracted from a stream."""
+    with open("tests/data/test.zip", "rb") as file_, \
+            pytest.raises(UnsupportedArchiveError):
+        extract_tar_stream(file_, tmp_path)
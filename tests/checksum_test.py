@@ -1,6 +1,7 @@
 import pytest
 
-from upload_rest_api.checksum import get_file_checksum
+from upload_rest_api.checksum import (get_file_checksum, get_file_checksums,
+                                      get_multiple_file_checksums)
 
 
 @pytest.mark.parametrize(
@@ -21,3 +22,39 @@ def test_get_file_checksum(algorithm, expected_checksum):
     )
 
     assert checksum == expected_checksum
+
+
+@pytest.mark.parametrize("chunk_size", (1, 7, 1024 * 1024))
+def test_get_file_checksums(chunk_size):
+    """Test calculating checksums with multiple algorithms.
+
+    Each algorithm is run in its own thread, and the result should not
+    depend on the chunk size.
+    """
+    checksums = get_file_checksums(
+        algorithms=["md5", "sha1", "sha256"],
+        path="tests/data/test.txt",
+        chunk_size=chunk_size
+    )
+
+    assert checksums == {
+        "md5": "150b62e4e7d58c70503bd5fc8a26463c",
+        "sha1": "db69c10bd3151e701d147051c8ee0171183d74b9",
+        "sha256":
+            "fa9b19e73084b8c459fd0c4ddc521c252b93ae20eb6068d342495fa3eb209609"
+    }
+
+
+def test_get_multiple_file_checksums(tmp_path):
+    """Test calculating checksums of multiple files concurrently."""
+    paths = []
+    for i in range(10):
+        path = tmp_path / f"file{i}"
+        path.write_bytes(b"a" * i)
+        paths.append(path)
+
+    checksums = get_multiple_file_checksums("md5", paths, max_workers=3)
+
+    assert checksums == {
+        str(path): get_file_checksum("md5", path) for path in paths
+    }
@@ -15,7 +15,11 @@ from metax_access.metax import (DS_STATE_INITIALIZED,
 
 from upload_rest_api.models.project import Project
 import upload_rest_api.cleanup as clean
+from upload_rest_api.jobs.utils import FILES_QUEUE, enqueue_background_job
 from upload_rest_api.lock import ProjectLockManager
+from upload_rest_api.models.file_entry import FileEntry
+from upload_rest_api.models.resource import Directory
+from upload_rest_api.models.trash_entry import TrashEntry
 from upload_rest_api.models.upload import UploadEntry
 from tests.metax_data.utils import TEMPLATE_DATASET
 
@@ -407,3 +411,70 @@ def test_cleanup_other_uploads(mock_config, monkeypatch):
 
     assert UploadEntry.objects.filter(path="/fake/path0").count() == 1
     assert UploadEntry.objects.filter(path="/fake/path49").count() == 0
+
+
+@pytest.mark.usefixtures("app")
+def test_clean_trash(mock_config, requests_mock):
+    """Test that directories left in trash are deleted.
+
+    Directories whose deletion job does not exist should be deleted
+    once they have been in trash long enough. Directories that are
+    still waiting for their job should be left as they are.
+    """
+    requests_mock.post("/v3/files/datasets", json={})
+    delete_files_api = requests_mock.post("/v3/files/delete-many", json={})
+
+    project = Project.get(id="test_project")
+    trash_paths = {}
+    for name in ("queued", "orphaned", "recent"):
+        (project.directory / name).mkdir()
+        (project.directory / name / "file").write_bytes(b"foo")
+        FileEntry(
+            path=str(project.directory / name / "file"),
+            checksum="foo",
+            identifier=f"urn:uuid:{name}"
+        ).save()
+        trash_paths[name] = Directory("test_project", name).move_to_trash()
+    project.increase_used_quota(9)
+
+    enqueue_background_job(
+        task_func="upload_rest_api.jobs.files.delete_directory",
+        queue_name=FILES_QUEUE,
+        project_id="test_project",
+        job_kwargs={
+            "project_id": "test_project",
+            "path": "/queued",
+            "trash_path": str(trash_paths["queued"])
+        },
+        task_id=trash_paths["queued"].name
+    )
+
+    TrashEntry.objects.filter(
+        id__in=[trash_paths["queued"].name, trash_paths["orphaned"].name]
+    ).update(set__created_at=datetime.now(timezone.utc) - timedelta(days=1))
+
+    assert clean.clean_trash() == 1
+
+    assert not trash_paths["orphaned"].exists()
+    assert trash_paths["queued"].exists()
+    assert trash_paths["recent"].exists()
+    assert sorted(entry.id for entry in TrashEntry.objects) \
+        == sorted([trash_paths["queued"].name, trash_paths["recent"].name])
+    assert delete_files_api.last_request.json() == [
+        {"storage_identifier": "urn:uuid:orphaned", "storage_service": "pas"}
+    ]
+    assert Project.get(id="test_project").used_quota == 6
+
+
+@pytest.mark.usefixtures("app")  # Creates test_project
+def test_clean_file_tree_snapshots(mock_config):
+    """Test that file tree snapshots of deleted projects are deleted."""
+    snapshot_path = pathlib.Path(mock_config["UPLOAD_TMP_PATH"]) / "file_trees"
+    for project_id in ("test_project", "deleted_project"):
+        (snapshot_path / project_id).mkdir(parents=True)
+        (snapshot_path / project_id / "1.json").write_text("{}")
+
+    assert clean.clean_file_tree_snapshots() == 1
+
+    assert (snapshot_path / "test_project" / "1.json").exists()
+    assert not (snapshot_path / "deleted_project").exists()
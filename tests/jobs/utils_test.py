@@ -146,6 +146,47 @@ def test_enqueue_background_job_failing_out_of_sync(mock_redis):
     assert task.status == TaskStatus.ERROR
 
 
+@pytest.mark.usefixtures("app")
+def test_enqueue_background_job_retry(mock_redis, mock_config):
+    """Test enqueuing a failing job that is retried.
+
+    The task should stay pending until the job has failed on every
+    attempt.
+    """
+    mock_config["RQ_JOB_RETRIES"] = 2
+    mock_config["RQ_JOB_RETRY_INTERVAL"] = 0
+
+    job_id = enqueue_background_job(
+        task_func="tests.jobs.utils_test.failing_task",
+        queue_name="upload",
+        project_id="test_project",
+        job_kwargs={},
+        retry=True
+    )
+
+    upload_queue = get_job_queue("upload")
+    worker = SimpleWorker([upload_queue], connection=mock_redis)
+
+    # The first attempt fails, and the job is requeued
+    worker.work(burst=True, max_jobs=1)
+    rq_job = upload_queue.fetch_job(job_id)
+    assert not rq_job.is_failed
+    assert rq_job.retries_left == 1
+
+    task = Task.get(id=job_id)
+    assert task.status == TaskStatus.PENDING
+    assert task.message == "Task failed, retrying"
+
+    # The job fails on the remaining attempts
+    worker.work(burst=True)
+    rq_job = upload_queue.fetch_job(job_id)
+    assert rq_job.is_failed
+
+    task = Task.get(id=job_id)
+    assert task.status == TaskStatus.ERROR
+    assert task.message == "Internal server error"
+
+
 @pytest.mark.usefixtures("app", "mock_redis")
 def test_enqueue_background_job_custom_timeout(mock_config, monkeypatch):
     """Test enqueueing a background job with custom timeout in effect
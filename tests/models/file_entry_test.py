@@ -1,5 +1,5 @@
 """Tests for file_entry module."""
-from mongoengine import ValidationError
+from mongoengine import NotUniqueError, ValidationError
 import pytest
 
 from upload_rest_api.config import CONFIG
@@ -66,3 +66,50 @@ def test_path_validation(path, error, monkeypatch):
         file_entry = FileEntry(path=path, checksum='foo', identifier='bar')
         file_entry.save()
     assert exception_info.value.errors['path'].message == error
+
+
+def test_bulk_insert(files_col):
+    """Test inserting files in chunks."""
+    entries = [
+        {
+            "path": f"/upload_projects_path/project/file{i}",
+            "checksum": "6d48b69215369ecd27c1add71746989c",
+            "identifier": f"urn:uuid:{i}"
+        }
+        for i in range(10)
+    ]
+
+    assert FileEntry.bulk_insert(iter(entries), chunk_size=3) == 10
+
+    docs = sorted(files_col.find(), key=lambda doc: doc["identifier"])
+    assert docs == [
+        {
+            "_id": entry["path"],
+            "checksum": entry["checksum"],
+            "identifier": entry["identifier"]
+        }
+        for entry in entries
+    ]
+
+
+def test_bulk_insert_duplicate(files_col):
+    """Test that duplicate files are reported after other files are
+    inserted.
+    """
+    FileEntry.bulk_insert([{
+        "path": "/upload_projects_path/project/file1",
+        "checksum": "foo",
+        "identifier": "urn:uuid:1"
+    }])
+
+    with pytest.raises(NotUniqueError):
+        FileEntry.bulk_insert([
+            {
+                "path": f"/upload_projects_path/project/file{i}",
+                "checksum": "foo",
+                "identifier": f"urn:uuid:{i}"
+            }
+            for i in range(3)
+        ])
+
+    assert files_col.count_documents({}) == 3
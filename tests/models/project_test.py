@@ -1,9 +1,17 @@
 from pathlib import Path
+import datetime
 import os
 
 import pytest
 
-from upload_rest_api.models.project import Project, ProjectEntry, _get_dir_size
+from upload_rest_api.models.directory_entry import DirectoryEntry
+from upload_rest_api.models.directory_size_entry import DirectorySizeEntry
+from upload_rest_api.models.file_entry import FileEntry
+from upload_rest_api.models.project import (Project, ProjectEntry,
+                                            _DirectorySizeCache,
+                                            _get_dir_size)
+from upload_rest_api.models.trash_entry import TrashEntry
+from upload_rest_api.models.upload_entry import UploadEntry, UploadStage
 
 
 def test_correct_document_structure(projects_col):
@@ -39,6 +47,54 @@ def test_dir_size():
     assert _get_dir_size("tests/data/test") == 0
 
 
+def test_dir_size_cache(test_mongo, tmp_path):
+    """Test that unchanged directories are not listed again.
+
+    The size of a directory should be read from the cache until its
+    modification time changes, and the cache entries of removed
+    directories should be deleted.
+    """
+    for path in ("a/b", "c"):
+        (tmp_path / path).mkdir(parents=True)
+    (tmp_path / "a" / "b" / "file1").write_bytes(b"foo")
+    (tmp_path / "c" / "file2").write_bytes(b"bar")
+
+    def _set_old_mtimes(mtime):
+        # Directories modified very recently are not cached
+        for path in (tmp_path, tmp_path / "a", tmp_path / "a" / "b",
+                     tmp_path / "c"):
+            if path.exists():
+                os.utime(path, ns=(mtime, mtime))
+
+    def _get_size():
+        cache = _DirectorySizeCache("test_project")
+        size = _get_dir_size(tmp_path, cache)
+        cache.save()
+        return size
+
+    _set_old_mtimes(0)
+    assert _get_size() == 6
+    assert DirectorySizeEntry.objects.count() == 4
+
+    # The cached size is used as long as the directory is not changed
+    DirectorySizeEntry.objects.filter(path=str(tmp_path / "c")).update(
+        set__size=100
+    )
+    assert _get_size() == 103
+
+    # Adding a file changes the modification time of the directory
+    (tmp_path / "c" / "file3").write_bytes(b"bazz")
+    assert _get_size() == 10
+
+    # Entries of removed directories are deleted
+    (tmp_path / "a" / "b" / "file1").unlink()
+    (tmp_path / "a" / "b").rmdir()
+    _set_old_mtimes(10**9)
+    assert _get_size() == 7
+    assert {entry.path for entry in DirectorySizeEntry.objects} \
+        == {str(tmp_path), str(tmp_path / "a"), str(tmp_path / "c")}
+
+
 def test_create_project(test_mongo, mock_config):
     """Test creating new project."""
     project = Project.create("test_project")
@@ -78,3 +134,160 @@ def test_creating_project_with_invalid_identifier(mock_config, identifier):
     # No projects or project directories should exist
     assert not next(Project.list_all(), None)
     assert not os.listdir(mock_config["UPLOAD_PROJECTS_PATH"])
+
+
+def test_update_file_index(test_mongo, mock_config):
+    """Test indexing the files and directories of a project.
+
+    Existing file entries should be updated, and entries of removed
+    directories should be deleted.
+    """
+    project = Project.create("test_project")
+    (project.directory / "a" / "b").mkdir(parents=True)
+    for path in ("file1", "a/b/file2"):
+        (project.directory / path).write_bytes(b"foo")
+        FileEntry(
+            path=str(project.directory / path),
+            checksum="foo",
+            identifier=f"urn:uuid:{path}"
+        ).save()
+    os.utime(project.directory / "a" / "b" / "file2", (0, 1577836800))
+    # File without database entry is not indexed
+    (project.directory / "a" / "file3").write_bytes(b"foo")
+    DirectoryEntry(
+        path=str(project.directory / "removed"),
+        project="test_project",
+        parent=str(project.directory)
+    ).save()
+
+    assert project.update_file_index() == (2, 2)
+
+    assert {
+        (entry.path, entry.parent) for entry in DirectoryEntry.objects
+    } == {
+        (str(project.directory / "a"), str(project.directory)),
+        (str(project.directory / "a" / "b"), str(project.directory / "a"))
+    }
+    file_entry = FileEntry.objects.get(
+        path=str(project.directory / "a" / "b" / "file2")
+    )
+    assert file_entry.project == "test_project"
+    assert file_entry.parent == str(project.directory / "a" / "b")
+    assert file_entry.size == 3
+    # The modification time is used as the timestamp
+    assert file_entry.timestamp.replace(tzinfo=None) \
+        == datetime.datetime(2020, 1, 1)
+
+
+def test_increase_used_quota(test_mongo, mock_config):
+    """Test that used quota is increased atomically.
+
+    Changes made through different Project instances should not
+    overwrite each other.
+    """
+    Project.create("test_project")
+    project1 = Project.get(id="test_project")
+    project2 = Project.get(id="test_project")
+
+    project1.increase_used_quota(100)
+    project2.increase_used_quota(20)
+    project1.decrease_used_quota(5)
+
+    assert project1.used_quota == 115
+    assert test_mongo.upload.projects.find_one(
+        {"_id": "test_project"}
+    )["used_quota"] == 115
+
+
+def test_update_used_quota_with_trash(test_mongo, mock_config):
+    """Test that directories in trash are included in used quota.
+
+    The used quota is decreased as the files in trash are deleted, so
+    they should be counted until then.
+    """
+    project = Project.create("test_project")
+    (project.directory / "file1").write_bytes(b"foo")
+
+    trash_path = Path(mock_config["UPLOAD_TRASH_PATH"])
+    (trash_path / "trash1").mkdir()
+    (trash_path / "trash1" / "file2").write_bytes(b"barbaz")
+    TrashEntry(id="trash1", project="test_project", path="/foo").save()
+    # Directory of another project is not counted
+    (trash_path / "trash2").mkdir()
+    (trash_path / "trash2" / "file3").write_bytes(b"foobar")
+    TrashEntry(id="trash2", project="other_project", path="/bar").save()
+    # Directory that has already been removed from disk is ignored
+    TrashEntry(id="trash3", project="test_project", path="/baz").save()
+
+    project.update_used_quota()
+    assert project.used_quota == 9
+
+
+def test_update_used_quota_with_uploads(test_mongo, mock_config):
+    """Test that unfinished uploads are included in used quota.
+
+    The files of uploads whose metadata has been created are counted
+    where they currently are, so that the files that were already
+    moved to the project directory are not counted twice.
+    """
+    project = Project.create("test_project")
+    (project.directory / "file1").write_bytes(b"foo")
+
+    UploadEntry(
+        id="upload1", path="/upload1", project="test_project", size=10,
+        allocated_size=10
+    ).save()
+
+    # The first file of the second upload has been moved to the project
+    # directory, and the second file is still in temporary directory
+    (project.directory / "file2").write_bytes(b"foobar")
+    tmp_project_directory \
+        = Path(mock_config["UPLOAD_TMP_PATH"]) / "upload2" / "tmp_storage"
+    tmp_project_directory.mkdir(parents=True)
+    (tmp_project_directory / "file3").write_bytes(b"barbaz")
+    UploadEntry(
+        id="upload2", path="/upload2", project="test_project", size=12,
+        allocated_size=12, stage=UploadStage.METADATA_CREATED
+    ).save()
+
+    project.update_used_quota()
+    assert project.used_quota == 3 + 10 + 6 + 6
+
+
+def test_update_used_quota_concurrent_change(
+        test_mongo, mock_config, monkeypatch):
+    """Test that used quota changed during recalculation is kept."""
+    project = Project.create("test_project")
+    (project.directory / "file1").write_bytes(b"foo")
+    project.increase_used_quota(100)
+
+    def _get_dir_size_and_upload(*args, **kwargs):
+        # Another upload adds a file while the files are being read
+        Project.get(id="test_project").increase_used_quota(5)
+        return _get_dir_size(*args, **kwargs)
+
+    monkeypatch.setattr(
+        "upload_rest_api.models.project._get_dir_size",
+        _get_dir_size_and_upload
+    )
+
+    project.update_used_quota()
+    assert project.used_quota == 8
+    assert Project.get(id="test_project").used_quota == 8
+
+
+def test_reserve_quota(test_mongo, mock_config):
+    """Test that quota can not be reserved beyond the project quota."""
+    Project.create("test_project", quota=100)
+    project1 = Project.get(id="test_project")
+    project2 = Project.get(id="test_project")
+
+    assert project1.reserve_quota(60)
+    # The first reservation is taken into account even though project2
+    # was retrieved before it
+    assert not project2.reserve_quota(60)
+    assert project2.reserve_quota(40)
+
+    assert test_mongo.upload.projects.find_one(
+        {"_id": "test_project"}
+    )["used_quota"] == 100
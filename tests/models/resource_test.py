@@ -1,10 +1,18 @@
 """Unit tests for resource module."""
 import io
+from pathlib import Path
 
 import pytest
 
-from upload_rest_api.models.resource import (File, InvalidPathError,
+from upload_rest_api.lock import ProjectLockManager
+from upload_rest_api.models.file_entry import FileEntry
+from upload_rest_api.models.project import Project
+from upload_rest_api.models.resource import (Directory, File, FileGroup,
+                                             HasPendingDatasetError,
+                                             InvalidPathError,
+                                             delete_trashed_directory,
                                              get_resource)
+from upload_rest_api.models.trash_entry import TrashEntry, TrashedFileEntry
 from upload_rest_api.models.upload import Upload
 from tests.metax_data.utils import TEMPLATE_FILE, TEMPLATE_DATASET, update_nested_dict
 
@@ -40,6 +48,324 @@ def test_parse_relative_user_path(path, result):
             File('test_project', path)
 
 
+@pytest.mark.usefixtures('app')  # Initialize database
+def test_get_files_preload(monkeypatch):
+    """Test that listing a directory retrieves file entries in bulk.
+
+    The database entries of the files should be attached to the listed
+    files, and the project should not be retrieved again for each file.
+    """
+    storage_path = Project.get(id='test_project').directory / 'testdir'
+    (storage_path / 'subdir').mkdir(parents=True)
+    for name in ('file1', 'file2', 'file3'):
+        (storage_path / name).write_bytes(b'foo')
+        FileEntry(
+            path=str(storage_path / name),
+            checksum='foo',
+            identifier=f'urn:uuid:{name}'
+        ).save()
+    # File without database entry
+    (storage_path / 'file4').write_bytes(b'foo')
+
+    directory = Directory('test_project', 'testdir')
+
+    def _get_project(**_kwargs):
+        raise AssertionError('Project should not be retrieved again')
+    monkeypatch.setattr(Project, 'get', _get_project)
+
+    files = sorted(directory.get_files(), key=lambda file: file.path.name)
+    assert [file._db_file_.identifier for file in files[:3]] \
+        == ['urn:uuid:file1', 'urn:uuid:file2', 'urn:uuid:file3']
+    assert files[3]._db_file_ is None
+    assert all(file.project is directory.project for file in files)
+
+    directories = directory.get_directories()
+    assert [dir_.path.name for dir_ in directories] == ['subdir']
+    assert directories[0].project is directory.project
+
+
+@pytest.mark.usefixtures('app')  # Initialize database
+def test_get_all_files(monkeypatch):
+    """Test listing all files of a directory tree.
+
+    The files should be created without retrieving the project again,
+    and their database entries should be preloaded.
+    """
+    project_directory = Project.get(id='test_project').directory
+    (project_directory / 'a' / 'b').mkdir(parents=True)
+    for path in ('file1', 'a/file2', 'a/b/file3'):
+        (project_directory / path).write_bytes(b'foo')
+        FileEntry(
+            path=str(project_directory / path),
+            checksum='foo',
+            identifier=f'urn:uuid:{path}'
+        ).save()
+
+    directory = Directory('test_project', '/')
+
+    def _get_project(**_kwargs):
+        raise AssertionError('Project should not be retrieved again')
+    monkeypatch.setattr(Project, 'get', _get_project)
+
+    files = sorted(directory.get_all_files(), key=lambda file: file.path)
+    assert [(str(file.path), file._db_file_.identifier) for file in files] \
+        == [
+            ('/a/b/file3', 'urn:uuid:a/b/file3'),
+            ('/a/file2', 'urn:uuid:a/file2'),
+            ('/file1', 'urn:uuid:file1')
+        ]
+    assert all(file.exists for file in files)
+
+
+@pytest.mark.usefixtures('app')  # Initialize database
+def test_delete_trashed_directory(mock_config, requests_mock):
+    """Test deleting a directory through trash.
+
+    The directory should disappear from the project when it is moved to
+    trash, and its path should stay locked until its database entries
+    have been moved to trash. The files should then be deleted in
+    batches, and only files of the deleted directory should be removed
+    from the database, even if a new file is added to the original path
+    of the directory.
+    """
+    mock_config["FILE_DELETE_BATCH_SIZE"] = 2
+    mock_config["TRASH_DELETE_INTERVAL"] = 0
+    requests_mock.post('/v3/files/datasets', json={})
+    delete_files_api = requests_mock.post('/v3/files/delete-many', json={})
+
+    project = Project.get(id='test_project')
+    (project.directory / 'testdir' / 'subdir').mkdir(parents=True)
+    paths = ['testdir/file1', 'testdir/subdir/file2',
+             'testdir/subdir/file3', 'file4']
+    for path in paths:
+        (project.directory / path).write_bytes(b'foo')
+        FileEntry(
+            path=str(project.directory / path),
+            checksum='foo',
+            identifier=f'urn:uuid:{path}'
+        ).save()
+    project.increase_used_quota(12)
+
+    directory = Directory('test_project', 'testdir')
+    trash_path = directory.move_to_trash()
+    assert not directory.storage_path.exists()
+    assert (trash_path / 'subdir' / 'file2').is_file()
+    trash_entry = TrashEntry.objects.get(id=trash_path.name)
+    assert trash_entry.project == 'test_project'
+    assert trash_entry.path == str(directory.storage_path)
+    assert FileEntry.objects.count() == 4
+    with pytest.raises(ValueError):
+        ProjectLockManager().acquire('test_project', directory.storage_path)
+
+    def _upload_new_file(deleted_count):
+        """Upload a new file to the original path of a trashed file."""
+        progress.append(deleted_count)
+        if deleted_count == 2:
+            (project.directory / 'testdir').mkdir()
+            (project.directory / 'testdir' / 'file1').write_bytes(b'bar')
+            FileEntry(
+                path=str(project.directory / 'testdir' / 'file1'),
+                checksum='bar',
+                identifier='urn:uuid:new'
+            ).save()
+
+    progress = []
+    assert delete_trashed_directory(
+        project, trash_path, _upload_new_file
+    ) == 3
+    assert progress == [2, 3]
+    assert not trash_path.exists()
+    assert len(delete_files_api.request_history) == 2
+    assert sorted(entry.identifier for entry in FileEntry.objects) \
+        == ['urn:uuid:file4', 'urn:uuid:new']
+    assert not TrashEntry.objects
+    assert not TrashedFileEntry.objects
+    assert Project.get(id='test_project').used_quota \
+        == project.used_quota == 3
+    ProjectLockManager().acquire('test_project', directory.storage_path)
+    ProjectLockManager().release('test_project', directory.storage_path)
+
+
+@pytest.mark.usefixtures('app')  # Initialize database
+def test_delete_directory_not_moved_to_trash(mock_config):
+    """Test deleting a directory whose move to trash was interrupted.
+
+    If the TrashEntry was saved, but the directory was not renamed,
+    the directory should be left as it is, and the TrashEntry should be
+    deleted and the directory unlocked.
+    """
+    project = Project.get(id='test_project')
+    (project.directory / 'testdir').mkdir()
+    (project.directory / 'testdir' / 'file1').write_bytes(b'foo')
+    FileEntry(
+        path=str(project.directory / 'testdir' / 'file1'),
+        checksum='foo',
+        identifier='urn:uuid:file1'
+    ).save()
+
+    directory = Directory('test_project', 'testdir')
+    ProjectLockManager().acquire('test_project', directory.storage_path)
+    TrashEntry(
+        id='trash1', project='test_project', path=str(directory.storage_path)
+    ).save()
+
+    trash_path = Path(mock_config["UPLOAD_TRASH_PATH"]) / 'trash1'
+    assert delete_trashed_directory(project, trash_path) == 0
+
+    assert (project.directory / 'testdir' / 'file1').is_file()
+    assert [entry.identifier for entry in FileEntry.objects] \
+        == ['urn:uuid:file1']
+    assert not TrashEntry.objects
+    ProjectLockManager().acquire('test_project', directory.storage_path)
+    ProjectLockManager().release('test_project', directory.storage_path)
+
+
+@pytest.mark.usefixtures('app')  # Initialize database
+def test_restore_from_trash():
+    """Test restoring a directory from trash.
+
+    The files should be restored, and the directory should be unlocked.
+    """
+    project = Project.get(id='test_project')
+    (project.directory / 'testdir').mkdir()
+    (project.directory / 'testdir' / 'file1').write_bytes(b'foo')
+    FileEntry(
+        path=str(project.directory / 'testdir' / 'file1'),
+        checksum='foo',
+        identifier='urn:uuid:file1'
+    ).save()
+
+    directory = Directory('test_project', 'testdir')
+    trash_path = directory.move_to_trash()
+    assert not (project.directory / 'testdir').exists()
+
+    directory.restore_from_trash(trash_path)
+    assert (project.directory / 'testdir' / 'file1').is_file()
+    assert [entry.identifier for entry in FileEntry.objects] \
+        == ['urn:uuid:file1']
+    assert not TrashEntry.objects
+    assert not TrashedFileEntry.objects
+    ProjectLockManager().acquire('test_project', directory.storage_path)
+    ProjectLockManager().release('test_project', directory.storage_path)
+
+
+@pytest.mark.usefixtures('app')  # Initialize database
+def test_delete_file_group_in_batches(mock_config, requests_mock):
+    """Test that files of a group are deleted in batches.
+
+    Each batch should be checked and deleted in Metax with separate
+    requests.
+    """
+    mock_config["FILE_DELETE_BATCH_SIZE"] = 2
+    file2dataset_api = requests_mock.post('/v3/files/datasets', json={})
+    delete_files_api = requests_mock.post('/v3/files/delete-many', json={})
+
+    project = Project.get(id='test_project')
+    files = []
+    for i in range(3):
+        (project.directory / f'file{i}').write_bytes(b'foo')
+        FileEntry(
+            path=str(project.directory / f'file{i}'),
+            checksum='foo',
+            identifier=f'urn:uuid:{i}'
+        ).save()
+        files.append(File('test_project', f'file{i}'))
+
+    assert FileGroup(files).delete() == 9
+
+    # Dataset links are checked once before deleting, and once for each
+    # deleted batch
+    assert [request.json() for request in file2dataset_api.request_history] \
+        == 2 * [['urn:uuid:0', 'urn:uuid:1'], ['urn:uuid:2']]
+    assert [
+        [file['storage_identifier'] for file in request.json()]
+        for request in delete_files_api.request_history
+    ] == [['urn:uuid:0', 'urn:uuid:1'], ['urn:uuid:2']]
+    assert FileEntry.objects.count() == 0
+    assert not any(project.directory.iterdir())
+
+
+@pytest.mark.usefixtures('app')  # Initialize database
+def test_delete_file_group_pending_dataset(mock_config, requests_mock):
+    """Test deleting a group whose last batch has a pending dataset.
+
+    No file should be deleted, although the pending dataset is found
+    only when the last batch is checked.
+    """
+    mock_config["FILE_DELETE_BATCH_SIZE"] = 2
+    requests_mock.post('/v3/files/datasets', json={})
+    requests_mock.post(
+        '/v3/files/datasets',
+        additional_matcher=lambda request: request.json() == ['urn:uuid:2'],
+        json={'urn:uuid:2': ['urn:uuid:dataset1']}
+    )
+    requests_mock.get(
+        "/v3/datasets/urn:uuid:dataset1?include_nulls=True",
+        json=update_nested_dict(
+            TEMPLATE_DATASET,
+            {
+                "id": "urn:uuid:dataset1",
+                "title": "foo",
+                "fileset": {"csc_project": "bar"},
+                "preservation": {"state": 10}
+            }
+        )
+    )
+    delete_files_api = requests_mock.post('/v3/files/delete-many', json={})
+
+    project = Project.get(id='test_project')
+    files = []
+    for i in range(3):
+        (project.directory / f'file{i}').write_bytes(b'foo')
+        FileEntry(
+            path=str(project.directory / f'file{i}'),
+            checksum='foo',
+            identifier=f'urn:uuid:{i}'
+        ).save()
+        files.append(File('test_project', f'file{i}'))
+
+    with pytest.raises(HasPendingDatasetError):
+        FileGroup(files).delete()
+
+    assert not delete_files_api.called
+    assert FileEntry.objects.count() == 3
+    assert all(file.storage_path.is_file() for file in files)
+
+
+@pytest.mark.usefixtures('app')  # Initialize database
+def test_check_directory_in_batches(mock_config, requests_mock):
+    """Test that files of a directory are checked in batches.
+
+    The dataset links of each batch of files should be retrieved with a
+    separate request, without building a group of all files.
+    """
+    mock_config["FILE_DELETE_BATCH_SIZE"] = 2
+    file2dataset_api = requests_mock.post('/v3/files/datasets', json={})
+
+    project = Project.get(id='test_project')
+    (project.directory / 'testdir' / 'subdir').mkdir(parents=True)
+    for i, path in enumerate(['testdir/file1', 'testdir/subdir/file2',
+                              'testdir/subdir/file3']):
+        (project.directory / path).write_bytes(b'foo')
+        FileEntry(
+            path=str(project.directory / path),
+            checksum='foo',
+            identifier=f'urn:uuid:{i}'
+        ).save()
+
+    directory = Directory('test_project', 'testdir')
+    assert not directory.has_pending_dataset()
+    assert directory.get_datasets() == []
+
+    requests = [
+        request.json() for request in file2dataset_api.request_history
+    ]
+    assert sorted(len(identifiers) for identifiers in requests) \
+        == [1, 1, 2, 2]
+    assert sorted(sum(requests, [])) \
+        == 2 * ['urn:uuid:0', 'urn:uuid:1', 'urn:uuid:2']
+
+
 @pytest.mark.usefixtures('app')  # Initialize db
 def test_get_many_datasets(requests_mock):
     """Test that get_datasets method handles paging in Metax."""
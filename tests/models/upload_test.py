@@ -1,14 +1,25 @@
 """Unit tests for upload module."""
 import hashlib
+import io
+import os
 import pathlib
+import tarfile
+import tracemalloc
+import unittest.mock
 import urllib
 
 import pytest
+import requests
 
 from upload_rest_api.lock import ProjectLockManager
+from upload_rest_api.models.directory_entry import DirectoryEntry
+from upload_rest_api.models.file_entry import FileEntry
 from upload_rest_api.models.resource import File, Directory
 from upload_rest_api.models.upload import (Upload, UploadConflictError,
-                                           UploadError)
+                                           UploadError, _DirectoryListings,
+                                           _is_conflict, _merge_directory,
+                                           _post_metadata,
+                                           _scan_staged_files)
 from tests.metax_data.utils import TEMPLATE_FILE, TEMPLATE_DATASET, update_nested_dict
 
 
@@ -96,11 +107,115 @@ def test_file_metadata_conflict(mock_config, requests_mock):
     assert not any(tmp_dir.iterdir())
 
 
+@pytest.mark.usefixtures('app')
+def test_metadata_post_failed(requests_mock):
+    """Test storing a file when Metax fails to save its metadata.
+
+    The file should not be saved to the database, and the error should
+    list the files that failed.
+    """
+    requests_mock.get('/v3/files', json={'next': None, 'results': []})
+    requests_mock.post(
+        '/v3/files/post-many?include_nulls=True',
+        json={
+            'success': [],
+            'failed': [
+                {
+                    'object': {'pathname': '/path/file1'},
+                    'errors': {'checksum': ['Invalid checksum']}
+                }
+            ]
+        }
+    )
+
+    upload = Upload.create(File('test_project', 'path/file1'), 123)
+    with open('tests/data/test.txt', 'rb') as file:
+        upload.add_source(file, None)
+
+    with pytest.raises(UploadError) as error:
+        upload.store_files(verify_source=False)
+    assert str(error.value) == 'Metadata could not be created for some files'
+    assert error.value.files == ['/path/file1']
+
+    assert not FileEntry.objects.count()
+    assert upload.project.used_quota == 0
+    assert not (upload.project.directory / 'path' / 'file1').exists()
+
+
+@pytest.mark.usefixtures('app')  # Creates test_project
+def test_metadata_post_partially_failed(mock_config, requests_mock, tmp_path):
+    """Test storing files when Metax fails to save some of them.
+
+    The second of three batches partially fails. The files whose
+    metadata was created should be stored, and the failed files should
+    be removed and listed in the error.
+    """
+    mock_config["METAX_POST_BATCH_SIZE"] = 2
+    mock_config["METAX_POST_MIN_BATCH_SIZE"] = 2
+    mock_config["METAX_POST_MAX_BATCH_SIZE"] = 2
+    mock_config["METAX_POST_WORKERS"] = 1
+
+    archive = tmp_path / "archive.tar"
+    names = ("file1", "file2", "file3", "file4", "file5", "file6")
+    with tarfile.open(archive, "w") as tar:
+        for name in names:
+            member = tarfile.TarInfo(f"test/{name}")
+            member.size = 3
+            tar.addfile(member, io.BytesIO(b"foo"))
+
+    requests_mock.get('/v3/files', json={'next': None, 'results': []})
+    metax_files_api = requests_mock.post(
+        '/v3/files/post-many?include_nulls=True',
+        [
+            {'json': {}},
+            {
+                'json': {
+                    'failed': [
+                        {
+                            'object': {'pathname': '/test/file3'},
+                            'errors': {'checksum': ['Invalid checksum']}
+                        }
+                    ]
+                }
+            },
+            {'json': {}}
+        ]
+    )
+
+    upload = Upload.create(Directory('test_project', '/'), 123)
+    with open(archive, 'rb') as source_file:
+        upload.add_source(source_file, checksum=None)
+    with pytest.raises(UploadError) as error:
+        upload.store_files(verify_source=False, resumable=True)
+
+    assert str(error.value) == 'Metadata could not be created for some files'
+    assert error.value.files == ['/test/file3']
+    assert metax_files_api.call_count == 3
+
+    stored_names = [name for name in names if name != "file3"]
+    assert sorted(
+        os.path.basename(entry.path) for entry in FileEntry.objects
+    ) == stored_names
+    assert sorted(
+        path.name for path in (upload.project.directory / 'test').iterdir()
+    ) == stored_names
+    assert upload.project.used_quota == 15
+
+    # The upload was finished and the lock released
+    with pytest.raises(Upload.DoesNotExist):
+        Upload.get(id=upload.id)
+    tmp_dir = pathlib.Path(mock_config['UPLOAD_TMP_PATH'])
+    assert not any(tmp_dir.iterdir())
+    ProjectLockManager().acquire('test_project', upload.storage_path)
+    ProjectLockManager().release('test_project', upload.storage_path)
+
+
 @pytest.mark.usefixtures('app')
 def test_add_source():
     """Test add_source method.
 
-    Test that checksum is saved to database.
+    Test that checksum is saved to database, and that the checksum of
+    the stream is calculated while it is written.
     """
     new_upload = Upload.create(File('test_project', 'path/file1'), 123)
     with open('tests/data/test.txt', 'rb') as source_file:
@@ -108,6 +223,8 @@ def test_add_source():
 
     upload_from_database = Upload.get(id=new_upload.id)
     assert upload_from_database.source_checksum == 'foobar'
+    assert upload_from_database.calculated_checksum \
+        == "150b62e4e7d58c70503bd5fc8a26463c"
 
     # Release the file lock
     lock_manager = ProjectLockManager()
@@ -118,30 +235,35 @@ def test_add_source():
 @pytest.mark.parametrize(
     ['checksum', 'verify'],
     (
-        ['foo', True],
+        ['150b62e4e7d58c70503bd5fc8a26463c', True],
         ['foo', False],
         [None, False],
         ['wrong-checksum', False]
     )
 )
 def test_checksum(checksum, verify, requests_mock, mock_get_file_checksum):
-    """Test that checksum is not computed needlessly."""
+    """Test that checksum is not computed needlessly.
+
+    The checksum is calculated while the source is written, so the
+    source file should never be read again.
+    """
     # Mock metax.
-    requests_mock.post('/v3/files/post-many?include_nulls=True', json={})
+    metax_files_api = requests_mock.post(
+        '/v3/files/post-many?include_nulls=True', json={}
+    )
     requests_mock.get('/v3/files?pathname=%2Fpath%2Ffile1&csc_project=test_project&include_nulls=True',
                       json={'next': None, 'results': []})
 
-    # Upload a file. Checksum should be computed only if it must be
-    # verified.
     upload = Upload.create(File('test_project', 'path/file1'), 123)
     with open('tests/data/test.txt', 'rb') as source_file:
         upload.add_source(source_file, checksum=checksum)
     upload.store_files(verify_source=verify)
 
-    if verify or not checksum:
-        mock_get_file_checksum.assert_called_once()
-    else:
-        mock_get_file_checksum.assert_not_called()
+    mock_get_file_checksum.assert_not_called()
+
+    # The calculated checksum is posted to Metax
+    assert metax_files_api.last_request.json()[0]["checksum"] \
+        == "md5:150b62e4e7d58c70503bd5fc8a26463c"
 
 
 @pytest.mark.usefixtures('app')
@@ -157,6 +279,9 @@ def test_invalid_checksum():
     ):
         upload.store_files(verify_source=True)
 
+    # The quota reserved for the upload is released
+    assert upload.project.used_quota == 0
+
 
 @pytest.mark.usefixtures('app')  # Creates test_project
 @pytest.mark.parametrize(
@@ -235,3 +360,560 @@ def test_upload_file_as_archive():
         upload.store_files(verify_source=False)
 
     assert str(error.value) == 'Uploaded file is not a supported archive'
+
+
+def test_scan_staged_files(tmp_path):
+    """Test scanning the files of an upload.
+
+    Each file should be found once with a path relative to the scanned
+    directory in the order of the paths, and its size should be read.
+    """
+    (tmp_path / "dir1" / "dir2").mkdir(parents=True)
+    (tmp_path / "dir1" / "empty1" / "empty2").mkdir(parents=True)
+    (tmp_path / "file1").write_bytes(b"1")
+    (tmp_path / "dir1.txt").write_bytes(b"1")
+    (tmp_path / "dir1" / "file2").write_bytes(b"22")
+    (tmp_path / "dir1" / "dir2" / "file3").write_bytes(b"333")
+
+    empty_directories = []
+    files = {
+        file.relative_path: file for file in _scan_staged_files(
+            tmp_path, empty_directories=empty_directories
+        )
+    }
+
+    assert list(files) \
+        == ["dir1.txt", "dir1/dir2/file3", "dir1/file2", "file1"]
+    assert empty_directories == ["dir1/empty1/empty2", "dir1/empty1"]
+    assert files["dir1/dir2/file3"].name == "file3"
+    assert files["dir1/dir2/file3"].size == 3
+    assert files["dir1/dir2/file3"].checksum is None
+
+
+def test_merge_directory(tmp_path):
+    """Test moving directory contents into existing directory.
+
+    New directory trees should be moved as is, and existing directories
+    should be merged.
+    """
+    source = tmp_path / "source"
+    target = tmp_path / "target"
+    (source / "existing").mkdir(parents=True)
+    (source / "existing" / "file1").write_text("1")
+    (source / "new" / "subdir").mkdir(parents=True)
+    (source / "new" / "subdir" / "file2").write_text("2")
+    (target / "existing").mkdir(parents=True)
+    (target / "existing" / "file3").write_text("3")
+
+    _merge_directory(str(source), str(target))
+
+    assert sorted(
+        str(path.relative_to(target)) for path in target.rglob("*")
+        if path.is_file()
+    ) == ["existing/file1", "existing/file3", "new/subdir/file2"]
+    assert not [path for path in source.rglob("*") if path.is_file()]
+
+
+def test_merge_directory_created_concurrently(tmp_path, monkeypatch):
+    """Test merging a directory created after it was checked.
+
+    If another upload creates the same new directory between the check
+    and the rename, the directory should be merged instead of failing.
+    """
+    source = tmp_path / "source"
+    target = tmp_path / "target"
+    (source / "new").mkdir(parents=True)
+    (source / "new" / "file1").write_text("1")
+    (target / "new").mkdir(parents=True)
+    (target / "new" / "file2").write_text("2")
+
+    # The directory does not exist yet when it is checked
+    with monkeypatch.context() as context:
+        context.setattr(
+            "upload_rest_api.models.upload.os.path.isdir",
+            lambda path: False
+        )
+        _merge_directory(str(source), str(target))
+
+    assert sorted(
+        str(path.relative_to(target)) for path in target.rglob("*")
+        if path.is_file()
+    ) == ["new/file1", "new/file2"]
+    assert not [path for path in source.rglob("*") if path.is_file()]
+
+
+@pytest.mark.parametrize(
+    ["name", "is_file", "conflict"],
+    [
+        # File in place of existing file
+        ("dir1/file1", True, True),
+        # File in place of existing directory
+        ("dir1/dir2", True, True),
+        # Directory in place of existing file
+        ("dir1/file1", False, True),
+        # Directory in place of existing directory
+        ("dir1/dir2/", False, False),
+        # New file in existing directory
+        ("dir1/file2", True, False),
+        # New file in new directory
+        ("new/file1", True, False),
+        # New file below existing file
+        ("dir1/file1/file2", True, False),
+    ]
+)
+def test_is_conflict(tmp_path, monkeypatch, name, is_file, conflict):
+    """Test checking archive members against existing files.
+
+    Conflicts should be detected, and each directory should be listed
+    only once no matter how many members are checked.
+    """
+    (tmp_path / "dir1" / "dir2").mkdir(parents=True)
+    (tmp_path / "dir1" / "file1").write_text("1")
+
+    scanned_directories = []
+    original_scandir = os.scandir
+
+    def _scandir(path):
+        scanned_directories.append(path)
+        return original_scandir(path)
+
+    monkeypatch.setattr("upload_rest_api.models.upload.os.scandir",
+                        _scandir)
+
+    member = unittest.mock.Mock(
+        is_file=is_file, is_dir=not is_file
+    )
+    member.name = name
+
+    listings = _DirectoryListings(tmp_path)
+    assert _is_conflict(member, listings) is conflict
+    assert _is_conflict(member, listings) is conflict
+    assert len(scanned_directories) == 1
+
+
+def test_post_metadata_batches(mock_config, monkeypatch):
+    """Test that metadata is posted to Metax in concurrent batches.
+
+    Every file should be posted exactly once, and the responses of all
+    batches should be merged.
+    """
+    mock_config["METAX_POST_BATCH_SIZE"] = 3
+    mock_config["METAX_POST_MIN_BATCH_SIZE"] = 1
+    mock_config["METAX_POST_WORKERS"] = 2
+
+    posted_batches = []
+
+    def _post_files(metadata):
+        posted_batches.append(metadata)
+        return {
+            "success": [
+                {
+                    "object": {
+                        "id": file["storage_identifier"],
+                        "pathname": file["pathname"],
+                        "checksum": "md5:foo"
+                    }
+                }
+                for file in metadata if file["pathname"] != "/file7"
+            ],
+            "failed": [
+                {"object": file, "errors": "foo"}
+                for file in metadata if file["pathname"] == "/file7"
+            ]
+        }
+
+    mock_client = unittest.mock.Mock()
+    mock_client.post_files.side_effect = _post_files
+    monkeypatch.setattr(
+        "upload_rest_api.models.upload.get_metax_client",
+        lambda: mock_client
+    )
+
+    metadata_dicts = [
+        {"storage_identifier": f"id{i}", "pathname": f"/file{i}"}
+        for i in range(20)
+    ]
+    response = _post_metadata(iter(metadata_dicts))
+
+    assert len(posted_batches) > 1
+    assert sorted(
+        file["pathname"] for batch in posted_batches for file in batch
+    ) == sorted(file["pathname"] for file in metadata_dicts)
+
+    assert len(response["success"]) == 19
+    assert [file["object"]["pathname"] for file in response["failed"]] \
+        == ["/file7"]
+
+
+def test_post_metadata_memory(mock_config, monkeypatch):
+    """Test that posting metadata from a generator uses bounded memory.
+
+    When a callback is given, the memory used while posting should
+    depend on the batch size, not on the number of files.
+    """
+    mock_config["METAX_POST_BATCH_SIZE"] = 100
+    mock_config["METAX_POST_MAX_BATCH_SIZE"] = 100
+
+    class _MockMetaxClient:
+        """Metax client that does not keep the posted metadata."""
+        def post_files(self, _metadata):
+            return {"success": [], "failed": []}
+
+    monkeypatch.setattr(
+        "upload_rest_api.models.upload.get_metax_client",
+        _MockMetaxClient
+    )
+
+    def _generate_metadata(count):
+        for i in range(count):
+            yield {
+                "storage_identifier": f"urn:uuid:{i:032}",
+                "pathname": f"/dir/file{i}",
+                "checksum": "md5:150b62e4e7d58c70503bd5fc8a26463c"
+            }
+
+    posted_files = []
+
+    def _callback(batch, _response):
+        posted_files.append(len(batch))
+
+    # Memory required to keep all metadata in memory at once
+    tracemalloc.start()
+    all_metadata = list(_generate_metadata(20000))
+    list_size = tracemalloc.get_traced_memory()[0]
+    del all_metadata
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    _post_metadata(_generate_metadata(20000), callback=_callback)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    assert sum(posted_files) == 20000
+    assert peak < list_size / 5
+
+
+@pytest.mark.usefixtures('app')  # Creates test_project
+def test_store_files_memory(mock_config, monkeypatch, tmp_path):
+    """Test that storing extracted files uses bounded memory.
+
+    The memory used by the whole store_files run should not grow with
+    the number of files.
+    """
+    mock_config["METAX_POST_BATCH_SIZE"] = 100
+    mock_config["METAX_POST_MAX_BATCH_SIZE"] = 100
+
+    class _MockMetaxClient:
+        """Metax client that does not keep the posted metadata."""
+        def get_files_dict(self, _project):
+            return {}
+
+        def post_files(self, _metadata):
+            return {"success": [], "failed": []}
+
+    monkeypatch.setattr(
+        "upload_rest_api.models.upload.get_metax_client",
+        _MockMetaxClient
+    )
+
+    def _get_peak_memory(name, file_count):
+        archive = tmp_path / f"{name}.tar"
+        with tarfile.open(archive, "w") as tar:
+            for i in range(file_count):
+                member = tarfile.TarInfo(f"{name}/dir{i // 100}/file{i}")
+                member.size = 3
+                tar.addfile(member, io.BytesIO(b"foo"))
+
+        upload = Upload.create(
+            Directory('test_project', '/'), 3 * file_count
+        )
+        with open(archive, 'rb') as source_file:
+            upload.extract_stream(source_file, checksum=None)
+
+        tracemalloc.start()
+        upload.store_files(verify_source=False)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        return peak
+
+    small_peak = _get_peak_memory("small", 1000)
+    large_peak = _get_peak_memory("large", 4000)
+
+    assert FileEntry.objects.count() == 5000
+    assert large_peak < 1.5 * small_peak
+
+
+@pytest.mark.usefixtures('app')  # Creates test_project
+@pytest.mark.parametrize("path_query_limit", (100, 1))
+def test_archive_metadata_conflict(
+        path_query_limit, mock_config, requests_mock, tmp_path):
+    """Test uploading archive when some files already have metadata.
+
+    Small archives are checked by querying only the paths of the
+    uploaded files from Metax, while larger archives retrieve all files
+    of the project.
+    """
+    mock_config["METAX_PATH_QUERY_LIMIT"] = path_query_limit
+
+    archive = tmp_path / "archive.tar"
+    with tarfile.open(archive, "w") as tar:
+        for name in ("file1", "file2"):
+            member = tarfile.TarInfo(f"test/{name}")
+            member.size = 3
+            tar.addfile(member, io.BytesIO(b"foo"))
+
+    # Mock metax. Only /test/file2 has metadata.
+    metax_files_api = requests_mock.post(
+        '/v3/files/post-many?include_nulls=True', json={}
+    )
+    old_file = update_nested_dict(
+        TEMPLATE_FILE,
+        {'id': 2, 'pathname': '/test/file2', 'storage_identifier': 'foo'}
+    )
+    project_files_api = requests_mock.get(
+        '/v3/files', json={'next': None, 'results': [old_file]}
+    )
+    file1_api = requests_mock.get(
+        '/v3/files?pathname=%2Ftest%2Ffile1&csc_project=test_project',
+        json={'next': None, 'results': []}
+    )
+    file2_api = requests_mock.get(
+        '/v3/files?pathname=%2Ftest%2Ffile2&csc_project=test_project',
+        json={'next': None, 'results': [old_file]}
+    )
+
+    upload = Upload.create(Directory('test_project', '/'), 123)
+    with open(archive, 'rb') as source_file:
+        upload.add_source(source_file, checksum=None)
+    with pytest.raises(UploadConflictError) as error:
+        upload.store_files(verify_source=False)
+
+    assert str(error.value) == ('Metadata could not be created because some'
+                                ' files already have metadata')
+    assert error.value.files == ['test/file2']
+    assert not metax_files_api.called
+
+    if path_query_limit == 100:
+        assert file1_api.called and file2_api.called
+        assert not project_files_api.called
+    else:
+        assert project_files_api.called
+
+
+@pytest.mark.usefixtures('app')  # Creates test_project
+def test_resume_store_files(mock_config, requests_mock, tmp_path):
+    """Test resuming storing files after posting metadata fails.
+
+    The files whose metadata was posted before the failure should not
+    be posted again, and the lock should be kept until storing the
+    files is finished.
+    """
+    mock_config["METAX_POST_BATCH_SIZE"] = 1
+    mock_config["METAX_POST_MIN_BATCH_SIZE"] = 1
+    mock_config["METAX_POST_MAX_BATCH_SIZE"] = 1
+    mock_config["METAX_POST_WORKERS"] = 1
+    mock_config["METAX_PATH_QUERY_LIMIT"] = 1
+
+    archive = tmp_path / "archive.tar"
+    with tarfile.open(archive, "w") as tar:
+        for name in ("file1", "file2", "file3", "file4"):
+            member = tarfile.TarInfo(f"test/{name}")
+            member.size = 3
+            tar.addfile(member, io.BytesIO(b"foo"))
+
+    requests_mock.get('/v3/files', json={'next': None, 'results': []})
+    # Metax fails when the second file is posted
+    metax_files_api = requests_mock.post(
+        '/v3/files/post-many?include_nulls=True',
+        [{'json': {}}, {'exc': requests.exceptions.ConnectionError}]
+    )
+
+    upload = Upload.create(Directory('test_project', '/'), 123)
+    with open(archive, 'rb') as source_file:
+        upload.add_source(source_file, checksum=None)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        upload.store_files(verify_source=False, resumable=True)
+
+    first_file = metax_files_api.request_history[0].json()[0]
+    assert FileEntry.objects.count() == 1
+    # The lock is still held
+    with pytest.raises(ValueError):
+        ProjectLockManager().acquire('test_project', upload.storage_path)
+
+    # Resume storing the files
+    metax_files_api = requests_mock.post(
+        '/v3/files/post-many?include_nulls=True', json={}
+    )
+    upload = Upload.get(id=upload.id)
+    upload.store_files(verify_source=False)
+
+    posted_files = [
+        request.json()[0] for request in metax_files_api.request_history
+    ]
+    assert sorted(file["pathname"] for file in posted_files) \
+        == ["/test/file2", "/test/file3", "/test/file4"]
+    assert first_file["pathname"] == "/test/file1"
+    assert FileEntry.objects.count() == 4
+    # The files and directories were added to the namespace index
+    test_directory = str(upload.project.directory / "test")
+    assert FileEntry.objects.filter(
+        project="test_project", parent=test_directory, size=3
+    ).count() == 4
+    assert [entry.path for entry in DirectoryEntry.objects] \
+        == [test_directory]
+    assert all(
+        (upload.project.directory / "test" / name).is_file()
+        for name in ("file1", "file2", "file3", "file4")
+    )
+
+    # The lock was released when the files were stored
+    ProjectLockManager().acquire('test_project', upload.storage_path)
+    ProjectLockManager().release('test_project', upload.storage_path)
+
+
+@pytest.mark.usefixtures('app')  # Creates test_project
+@pytest.mark.parametrize("path_query_limit", (100, 1))
+def test_resume_store_files_unrecorded_batch(
+        path_query_limit, mock_config, requests_mock, tmp_path):
+    """Test resuming when Metax created metadata of an unrecorded batch.
+
+    If storing the files is interrupted after Metax has created the
+    metadata of a batch, but before the batch is recorded as posted,
+    the metadata should not be posted again when storing the files is
+    resumed.
+    """
+    mock_config["METAX_POST_BATCH_SIZE"] = 1
+    mock_config["METAX_POST_MIN_BATCH_SIZE"] = 1
+    mock_config["METAX_POST_MAX_BATCH_SIZE"] = 1
+    mock_config["METAX_POST_WORKERS"] = 1
+    mock_config["METAX_PATH_QUERY_LIMIT"] = path_query_limit
+
+    archive = tmp_path / "archive.tar"
+    with tarfile.open(archive, "w") as tar:
+        for name in ("file1", "file2", "file3"):
+            member = tarfile.TarInfo(f"test/{name}")
+            member.size = 3
+            tar.addfile(member, io.BytesIO(b"foo"))
+
+    requests_mock.get('/v3/files', json={'next': None, 'results': []})
+    # The response to the second batch is lost
+    metax_files_api = requests_mock.post(
+        '/v3/files/post-many?include_nulls=True',
+        [{'json': {}}, {'exc': requests.exceptions.ConnectionError}]
+    )
+
+    upload = Upload.create(Directory('test_project', '/'), 123)
+    with open(archive, 'rb') as source_file:
+        upload.add_source(source_file, checksum=None)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        upload.store_files(verify_source=False, resumable=True)
+    assert FileEntry.objects.count() == 1
+
+    # Metax created the metadata of the second batch anyway
+    second_file = metax_files_api.request_history[1].json()[0]
+    assert second_file["pathname"] == "/test/file2"
+    old_file = update_nested_dict(
+        TEMPLATE_FILE,
+        {
+            'id': 2,
+            'pathname': second_file['pathname'],
+            'storage_identifier': second_file['storage_identifier']
+        }
+    )
+    requests_mock.get('/v3/files', json={'next': None, 'results': [old_file]})
+    requests_mock.get(
+        '/v3/files?pathname=%2Ftest%2Ffile2&csc_project=test_project',
+        json={'next': None, 'results': [old_file]}
+    )
+    requests_mock.get(
+        '/v3/files?pathname=%2Ftest%2Ffile3&csc_project=test_project',
+        json={'next': None, 'results': []}
+    )
+    metax_files_api = requests_mock.post(
+        '/v3/files/post-many?include_nulls=True', json={}
+    )
+
+    upload = Upload.get(id=upload.id)
+    upload.store_files(verify_source=False)
+
+    # Only the third file was posted
+    assert [
+        file["pathname"]
+        for request in metax_files_api.request_history
+        for file in request.json()
+    ] == ["/test/file3"]
+    assert FileEntry.objects.count() == 3
+    assert FileEntry.objects.get(
+        path=str(upload.project.directory / "test" / "file2")
+    ).identifier == second_file["storage_identifier"]
+    assert all(
+        (upload.project.directory / "test" / name).is_file()
+        for name in ("file1", "file2", "file3")
+    )
+
+
+@pytest.mark.usefixtures('app')  # Creates test_project
+def test_resume_store_files_after_cleanup(mock_config, requests_mock):
+    """Test resuming storing files after the temporary files were removed.
+
+    If an earlier attempt was interrupted after the files were moved
+    and the temporary directory was removed, resuming should only
+    finish the upload.
+    """
+    requests_mock.get('/v3/files', json={'next': None, 'results': []})
+    requests_mock.post('/v3/files/post-many?include_nulls=True', json={})
+
+    upload = Upload.create(File('test_project', 'path/file1'), 123)
+    with open('tests/data/test.txt', 'rb') as source_file:
+        upload.add_source(source_file, checksum=None)
+
+    # Interrupt storing the files right after the temporary directory
+    # is removed
+    with unittest.mock.patch.object(
+        Upload, '_finish_storing', side_effect=SystemExit
+    ), pytest.raises(SystemExit):
+        upload.store_files(verify_source=False, resumable=True)
+    # The directories should be indexed again even if the interrupted
+    # attempt did not index them
+    DirectoryEntry.objects.delete()
+    file_tree_version = upload.project.file_tree_version
+
+    upload = Upload.get(id=upload.id)
+    upload.store_files(verify_source=False, resumable=True)
+
+    assert (upload.project.directory / 'path' / 'file1').is_file()
+    assert FileEntry.objects.count() == 1
+    assert [entry.path for entry in DirectoryEntry.objects] \
+        == [str(upload.project.directory / 'path')]
+    assert upload.project.file_tree_version > file_tree_version
+    with pytest.raises(Upload.DoesNotExist):
+        Upload.get(id=upload.id)
+    ProjectLockManager().acquire('test_project', upload.storage_path)
+    ProjectLockManager().release('test_project', upload.storage_path)
+
+
+@pytest.mark.usefixtures('app')  # Creates test_project
+def test_store_files_not_resumable(mock_config, requests_mock):
+    """Test that failed upload is released if it will not be resumed.
+
+    The reserved quota, the lock and the temporary files should be
+    released.
+    """
+    requests_mock.get('/v3/files', json={'next': None, 'results': []})
+    requests_mock.post(
+        '/v3/files/post-many?include_nulls=True',
+        exc=requests.exceptions.ConnectionError
+    )
+
+    upload = Upload.create(File('test_project', 'path/file1'), 123)
+    with open('tests/data/test.txt', 'rb') as source_file:
+        upload.add_source(source_file, checksum=None)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        upload.store_files(verify_source=False)
+
+    assert upload.project.used_quota == 0
+    tmp_dir = pathlib.Path(mock_config['UPLOAD_TMP_PATH'])
+    assert not any(tmp_dir.iterdir())
+    ProjectLockManager().acquire('test_project', upload.storage_path)
+    ProjectLockManager().release('test_project', upload.storage_path)
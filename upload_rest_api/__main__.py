@@ -6,11 +6,16 @@ import pathlib
 import click
 
 import upload_rest_api.config
-from upload_rest_api.cleanup import (clean_disk, clean_mongo,
-                                     clean_other_uploads, clean_tus_uploads)
+from upload_rest_api.cleanup import (clean_disk, clean_file_tree_snapshots,
+                                     clean_mongo, clean_other_uploads,
+                                     clean_trash, clean_tus_uploads)
+from upload_rest_api.models.directory_entry import DirectoryEntry
+from upload_rest_api.models.directory_size_entry import DirectorySizeEntry
+from upload_rest_api.models.file_entry import FileEntry
 from upload_rest_api.models.resource import File, get_resource
 from upload_rest_api.models.project import Project
 from upload_rest_api.models.token import Token
+from upload_rest_api.models.trash_entry import TrashEntry, TrashedFileEntry
 from upload_rest_api.models.user import User
 
 
@@ -67,9 +72,17 @@ def cleanup_tokens():
 @cleanup.command("files")
 def cleanup_files():
     """Clean files from the disk."""
+    deleted_count = clean_trash()
+    click.echo(f"Cleaned {deleted_count} directory(s) left in trash")
+
     deleted_count = clean_disk()
     click.echo(f"Cleaned {deleted_count} file(s)")
 
+    deleted_count = clean_file_tree_snapshots()
+    click.echo(
+        f"Cleaned file tree snapshots of {deleted_count} deleted project(s)"
+    )
+
 
 @cleanup.command("mongo")
 def cleanup_mongo():
@@ -240,6 +253,31 @@ def modify_project(project, quota):
                 'remaining_quota': project_.remaining_quota})
 
 
+@projects.command("update-used-quota")
+@click.argument("projects_", metavar="PROJECTS", nargs=-1)
+def update_used_quota(projects_):
+    """Recalculate used quota of PROJECTS from the files on disk.
+
+    Used quota is normally updated incrementally. This command
+    reconciles it with the files on disk. If no projects are given, the
+    used quota of every project is recalculated.
+    """
+    if projects_:
+        try:
+            projects_ = [Project.get(id=project) for project in projects_]
+        except Project.DoesNotExist:
+            click.echo("Some of the projects do not exist.")
+            return
+    else:
+        projects_ = Project.list_all()
+
+    for project in projects_:
+        project.update_used_quota()
+        click.echo(
+            f"Used quota of project '{project.id}': {project.used_quota}"
+        )
+
+
 @projects.command("delete")
 @click.argument("project")
 def delete_project(project):
@@ -321,6 +359,56 @@ def get_file_by_identifier(identifier):
         click.echo(f"File '{identifier}' not found")
 
 
+def _ensure_file_indexes():
+    """Create the indexes of the file collections if they do not exist.
+
+    The indexes are not created automatically, see FileEntry.
+    """
+    FileEntry.ensure_indexes()
+    DirectoryEntry.ensure_indexes()
+    DirectorySizeEntry.ensure_indexes()
+    TrashEntry.ensure_indexes()
+    TrashedFileEntry.ensure_indexes()
+
+
+@files.command("create-indexes")
+def create_file_indexes():
+    """Create the database indexes of files if they do not exist.
+
+    This should be run after installing or upgrading the service.
+    """
+    _ensure_file_indexes()
+    click.echo("Created database indexes")
+
+
+@files.command("update-index")
+@click.argument("projects_", metavar="PROJECTS", nargs=-1)
+def update_file_index(projects_):
+    """Index the files and directories of PROJECTS in the database.
+
+    The database indexes are created if they do not exist, and the
+    index of files and directories is updated from the files on disk.
+    If no projects are given, every project is indexed.
+    """
+    if projects_:
+        try:
+            projects_ = [Project.get(id=project) for project in projects_]
+        except Project.DoesNotExist:
+            click.echo("Some of the projects do not exist.")
+            return
+    else:
+        projects_ = Project.list_all()
+
+    _ensure_file_indexes()
+
+    for project in projects_:
+        directory_count, file_count = project.update_file_index()
+        click.echo(
+            f"Indexed {directory_count} directories and {file_count} "
+            f"files of project '{project.id}'"
+        )
+
+
 @files.command("list")
 @click.option("--identifiers-only", is_flag=True)
 @click.option("--checksums-only", is_flag=True)
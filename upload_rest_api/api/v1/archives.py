@@ -21,6 +21,10 @@ ARCHIVES_API_V1 = Blueprint("archives_v1", __name__, url_prefix="/v1/archives")
 def upload_archive(project_id):
     """Upload and extract the archive at <UPLOAD_PROJECTS_PATH>/project.
 
+    If ``stream=true`` query parameter is given, a tar archive is
+    extracted while it is uploaded, instead of saving it to disk and
+    extracting it in the background job.
+
     :returns: HTTP Response
     """
     if not current_user.is_allowed_to_access_project(project_id):
@@ -39,7 +43,13 @@ def upload_archive(project_id):
     directory = Directory(project_id, request.args.get('dir', default='/'))
     upload = Upload.create(directory, size=request.content_length)
     checksum = request.args.get("md5", None)
-    upload.add_source(file=request.stream, checksum=checksum)
+    if request.args.get("stream", None) == "true":
+        # The checksum is verified during extraction
+        upload.extract_stream(stream=request.stream, checksum=checksum)
+        verify_source = False
+    else:
+        upload.add_source(file=request.stream, checksum=checksum)
+        verify_source = bool(checksum)
     try:
         task_id = enqueue_background_job(
             task_func="upload_rest_api.jobs.upload.store_files",
@@ -48,8 +58,9 @@ def upload_archive(project_id):
             project_id=upload.project.id,
             job_kwargs={
                 "identifier": upload.id,
-                "verify_source": bool(checksum)
-            }
+                "verify_source": verify_source
+            },
+            retry=True
         )
     except Exception:
         # If we couldn't enqueue background job, release the lock
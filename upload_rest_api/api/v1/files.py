@@ -3,11 +3,15 @@
 Functionality for uploading, querying and deleting files from the
 server.
 """
+import json
 import os
+import tempfile
 from pathlib import Path
 
 import werkzeug
-from flask import Blueprint, abort, jsonify, request
+from flask import (Blueprint, Response, abort, jsonify, request,
+                   stream_with_context)
+from werkzeug.wsgi import wrap_file
 
 from upload_rest_api.api.v1.tasks import get_polling_url
 from upload_rest_api.authentication import current_user
@@ -15,23 +19,115 @@ from upload_rest_api.models.upload import Upload
 from upload_rest_api.models.resource import get_resource, File
 from upload_rest_api.config import CONFIG
 from upload_rest_api.jobs import FILES_QUEUE, enqueue_background_job
-from upload_rest_api.lock import ProjectLockManager
 
 FILES_API_V1 = Blueprint("files_v1", __name__, url_prefix="/v1/files")
 
+# Serve the dir trees of projects from snapshots that are created only
+# when the tree changes
+DEFAULT_FILE_TREE_CACHE = False
 
-def _get_dir_tree(project):
-    """Return with dir tree from project directory."""
-    file_dict = {}
-    for dirpath, _, files in os.walk(project.directory):
 
+def _iter_dir_tree(project):
+    """Iterate over the directories of project directory.
+
+    :param project: Project instance
+    :returns: Generator of (path, file names) tuples, where path is
+              relative to the project directory, e.g. "/foo"
+    """
+    for dirpath, _, files in os.walk(project.directory):
         path = Path(dirpath).relative_to(project.directory)
-        file_dict[f'/{path}'] = files
+        yield ("/" if path == Path(".") else f"/{path}"), files
+
+
+def _iter_dir_tree_json(project):
+    """Serialize dir tree of project directory as JSON incrementally.
+
+    Each directory is serialized as soon as it has been listed, so the
+    whole tree is never kept in memory.
+
+    :param project: Project instance
+    :returns: Generator of JSON fragments
+    """
+    yield "{"
+    separator = ""
+    for path, files in _iter_dir_tree(project):
+        yield f"{separator}{json.dumps(path)}: {json.dumps(files)}"
+        separator = ", "
+    yield "}"
 
-    if "/." in file_dict:
-        file_dict["/"] = file_dict.pop("/.")
 
-    return file_dict
+def _open_dir_tree_snapshot(project, version):
+    """Open JSON snapshot of dir tree of project directory.
+
+    The snapshot is created if it does not exist yet, and snapshots of
+    older versions of the tree are removed. The snapshot is opened
+    before the old snapshots are removed, so a snapshot that is being
+    served to another client remains readable even if it is removed.
+
+    :param project: Project instance
+    :param version: ETag that identifies the file tree version
+    :returns: Binary file object of the snapshot
+    """
+    cache_dir = Path(CONFIG["UPLOAD_TMP_PATH"]) / "file_trees" / project.id
+    snapshot_path = cache_dir / f"{version}.json"
+    try:
+        return open(snapshot_path, "rb")
+    except FileNotFoundError:
+        pass
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as snapshot:
+            snapshot.writelines(_iter_dir_tree_json(project))
+        snapshot = open(tmp_path, "rb")
+        os.replace(tmp_path, snapshot_path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+    for path in cache_dir.glob("*.json"):
+        if path != snapshot_path:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                # Removed by another request
+                pass
+
+    return snapshot
+
+
+def _get_dir_tree_response(project):
+    """Return dir tree of project directory as JSON response.
+
+    The ETag of the response is the file tree version of the project,
+    which changes whenever files are added or removed, so clients can
+    revalidate the tree using If-None-Match. The version starts again
+    from zero if a project is deleted and created again, so the ETag
+    also identifies the instance of the project.
+
+    :param project: Project instance
+    :returns: HTTP Response
+    """
+    etag = f"{project.instance_id or 0}-{project.file_tree_version}"
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    elif CONFIG.get("FILE_TREE_CACHE", DEFAULT_FILE_TREE_CACHE):
+        snapshot = _open_dir_tree_snapshot(project, etag)
+        response = Response(
+            wrap_file(request.environ, snapshot),
+            mimetype="application/json",
+            direct_passthrough=True
+        )
+        response.content_length = os.fstat(snapshot.fileno()).st_size
+    else:
+        response = Response(
+            stream_with_context(_iter_dir_tree_json(project)),
+            mimetype="application/json"
+        )
+
+    response.set_etag(etag)
+    return response
 
 
 @FILES_API_V1.route("/<string:project_id>/<path:fpath>", methods=["POST"])
@@ -89,7 +185,7 @@ def get_path(project_id, fpath):
         abort(404, "File not found")
 
     if request.args.get("all", None) == "true" and fpath.strip("/") == "":
-        return jsonify(_get_dir_tree(resource.project))
+        return _get_dir_tree_response(resource.project)
 
     if resource.storage_path.is_file():
         response = {
@@ -99,11 +195,53 @@ def get_path(project_id, fpath):
             "timestamp": resource.timestamp
         }
     elif resource.storage_path.is_dir():
-        response = {
-            'directories': [dir_.path.name for
-                            dir_ in resource.get_directories()],
-            'files':  [file.path.name for file in resource.get_files()]
-        }
+        response = _get_directory_listing(resource)
+
+    return response
+
+
+def _get_directory_listing(directory):
+    """Return the contents of a directory for a GET request.
+
+    If the ``limit`` parameter is given, at most that many entries are
+    returned in order of name, and the response contains the cursor of
+    the next page, which is passed back in the ``cursor`` parameter.
+    If ``details=true``, each entry is an object that also contains
+    the size of the file.
+
+    :param directory: Directory instance
+    :returns: Response dict
+    """
+    limit = request.args.get("limit", None)
+    if limit is not None:
+        if not limit.isdigit() or int(limit) < 1:
+            abort(400, "'limit' must be a positive integer")
+        limit = int(limit)
+
+    details = request.args.get("details", None) == "true"
+    entries, next_cursor = directory.list_entries(
+        limit=limit, cursor=request.args.get("cursor", None), stat=details
+    )
+
+    directories = []
+    files = []
+    for entry, stat in entries:
+        if entry.is_dir():
+            directories.append(
+                {"name": entry.name} if details else entry.name
+            )
+        elif entry.is_file():
+            files.append(
+                {"name": entry.name, "size": stat.st_size}
+                if details else entry.name
+            )
+
+    response = {
+        "directories": directories,
+        "files": files
+    }
+    if limit is not None:
+        response["next_cursor"] = next_cursor
 
     return response
 
@@ -153,11 +291,12 @@ def delete_path(project_id, fpath):
             # Trying to delete empty project directory
             abort(404, "No files found")
 
-        # Acquire a lock *and* keep it alive even after this HTTP
-        # request. It will be released by the 'delete_directory'
-        # background job once it finishes.
-        lock_manager = ProjectLockManager()
-        lock_manager.acquire(resource.project.id, resource.storage_path)
+        # Move the directory to trash, so that it disappears from the
+        # project at once. The files and metadata are deleted by the
+        # 'delete_directory' background job. The job is identified by
+        # the name of the directory in trash, so that directories whose
+        # job has failed can be found and deleted later.
+        trash_path = resource.move_to_trash()
 
         try:
             task_id = enqueue_background_job(
@@ -167,11 +306,15 @@ def delete_path(project_id, fpath):
                 job_kwargs={
                     "project_id": resource.project.id,
                     "path": str(resource.path),
-                }
+                    "trash_path": str(trash_path)
+                },
+                task_id=trash_path.name,
+                retry=True
             )
         except Exception:
-            # If we couldn't enqueue background job, release the lock
-            lock_manager.release(resource.project.id, resource.storage_path)
+            # If we couldn't enqueue background job, restore the
+            # directory
+            resource.restore_from_trash(trash_path)
             raise
 
         polling_url = get_polling_url(task_id)
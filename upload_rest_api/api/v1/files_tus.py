@@ -1,13 +1,20 @@
 """Event handler for the /files_tus/v1 endpoint."""
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
 import flask_tus_io
 import werkzeug
-from flask import Blueprint, abort
+from flask import Blueprint, abort, request
+from flask_tus_io.workspace import Workspace
 
 from upload_rest_api.authentication import current_user
-from upload_rest_api.checksum import HASH_FUNCTION_ALIASES, get_file_checksums
+from upload_rest_api.checksum import (HASH_FUNCTION_ALIASES,
+                                      IncrementalHasher, get_file_checksums)
 from upload_rest_api.config import CONFIG
 from upload_rest_api.jobs import UPLOAD_QUEUE, enqueue_background_job
-from upload_rest_api.lock import lock_manager
+from upload_rest_api.lock import DEFAULT_LOCK_TTL, lock_manager
 from upload_rest_api.models.resource import Directory, File
 from upload_rest_api.models.upload import Upload
 
@@ -15,6 +22,26 @@ FILES_TUS_API_V1 = Blueprint(
     "files_tus_v1", __name__, url_prefix="/v1/files_tus"
 )
 
+# Checksums of the tus uploads in progress, keyed by upload identifier.
+# The values are (IncrementalHasher, time of last use) tuples, least
+# recently used first. The hash state is advanced after each PATCH
+# request, so that the checksums are already known when the upload is
+# completed.
+#
+# The cache is an optimization only: hashlib objects can not be
+# serialized, so the hash state can not be stored in the database and
+# lives in the memory of the process handling the requests. If the
+# upload is completed in a process that does not have its hasher (e.g.
+# the PATCH requests were served by another worker, or the service was
+# restarted), the checksums are calculated from the whole file when the
+# upload is completed, exactly as if the cache did not exist.
+_UPLOAD_HASHERS = OrderedDict()
+_UPLOAD_HASHERS_LOCK = threading.Lock()
+
+# Maximum number of uploads whose checksums are tracked by one process.
+# The least recently used hashers are discarded once this is exceeded.
+MAX_TRACKED_UPLOADS = 1000
+
 
 def register_blueprint(app):
     """
@@ -44,6 +71,90 @@ def _delete_workspace(workspace):
     workspace.remove()
 
 
+def _start_upload_hasher(resource):
+    """Start calculating checksums of the upload incrementally."""
+    algorithms = {"md5"}
+
+    checksum = resource.upload_metadata.get("checksum", None)
+    if checksum:
+        # Invalid checksums are rejected when the upload is completed
+        algorithm = checksum.split(":")[0].lower()
+        if algorithm not in HASH_FUNCTION_ALIASES:
+            return
+        algorithms.add(algorithm)
+
+    with _UPLOAD_HASHERS_LOCK:
+        _UPLOAD_HASHERS[resource.identifier] = (
+            IncrementalHasher(algorithms), time.monotonic()
+        )
+        _discard_idle_hashers()
+
+
+def _discard_idle_hashers():
+    """Stop tracking the checksums of abandoned uploads.
+
+    Hashers that have not been used within the lock TTL belong to
+    uploads that can not be completed anymore, because their locks
+    have expired. Hashers in excess of ``MAX_TRACKED_UPLOADS`` are
+    discarded as well. ``_UPLOAD_HASHERS_LOCK`` must be held by the
+    caller.
+    """
+    cutoff = time.monotonic() \
+        - CONFIG.get("UPLOAD_LOCK_TTL", DEFAULT_LOCK_TTL)
+    while _UPLOAD_HASHERS:
+        _, last_used = next(iter(_UPLOAD_HASHERS.values()))
+        if len(_UPLOAD_HASHERS) <= MAX_TRACKED_UPLOADS \
+                and last_used >= cutoff:
+            break
+        _UPLOAD_HASHERS.popitem(last=False)
+
+
+def _pop_upload_hasher(identifier):
+    """Stop tracking the checksums of upload and return its hasher.
+
+    :returns: IncrementalHasher instance, or ``None`` if the checksums
+              of the upload are not tracked by this process
+    """
+    with _UPLOAD_HASHERS_LOCK:
+        hasher, _ = _UPLOAD_HASHERS.pop(identifier, (None, None))
+    return hasher
+
+
+@FILES_TUS_API_V1.after_app_request
+def _advance_upload_hasher(response):
+    """Feed the chunk received in a tus PATCH request to the hasher."""
+    is_tus_patch = (
+        request.method == "PATCH"
+        and request.path.startswith(f"{FILES_TUS_API_V1.url_prefix}/")
+        and response.status_code == 204
+    )
+    if not is_tus_patch:
+        return response
+
+    identifier = request.path.rstrip("/").split("/")[-1]
+    with _UPLOAD_HASHERS_LOCK:
+        hasher, _ = _UPLOAD_HASHERS.pop(identifier, (None, None))
+        if hasher is not None:
+            # Mark the hasher as the most recently used one
+            _UPLOAD_HASHERS[identifier] = (hasher, time.monotonic())
+        _discard_idle_hashers()
+    if hasher is None:
+        return response
+
+    try:
+        workspace = Workspace(
+            str(Path(CONFIG["TUS_API_SPOOL_PATH"]) / identifier)
+        )
+        resource = workspace.get_resource()
+        hasher.advance(resource.upload_file_path, resource.bytes_uploaded)
+    except OSError:
+        # The workspace was removed or can not be read. The checksums
+        # will be calculated from the whole file instead.
+        _pop_upload_hasher(identifier)
+
+    return response
+
+
 def _upload_started(workspace, resource):
     """Callback function called when a new upload is started."""
     try:
@@ -69,6 +180,7 @@ def _upload_started(workspace, resource):
                       size=resource.upload_length,
                       identifier=resource.identifier,
                       is_tus_upload=True)
+        _start_upload_hasher(resource)
     except Exception:
         # Remove the workspace to prevent filling up disk space with
         # bogus requests
@@ -95,7 +207,8 @@ def _store_files(workspace, resource, upload_type, calculated_algorithm=None,
                 job_kwargs={
                     "identifier": upload.id,
                     "verify_source": False
-                }
+                },
+                retry=True
             )
         except Exception:
             # If we couldn't enqueue background job, release the lock
@@ -125,11 +238,14 @@ def _get_checksum_tuple(checksum):
     return algorithm, expected_checksum
 
 
-def _calculate_upload_checksum(resource, workspace, checksum):
+def _calculate_upload_checksum(resource, workspace, checksum, hasher=None):
     """
     Calculate the MD5 checksum and save it. If user also provided their own
     checksum, check the integrity of an upload by comparing the user provided
     checksum against the calculated checksum.
+
+    If ``hasher`` is provided, only the part of the upload that it has
+    not yet hashed is read.
     """
     algorithms = set(["md5"])
     try:
@@ -137,12 +253,19 @@ def _calculate_upload_checksum(resource, workspace, checksum):
 
         source_algorithm, expected_checksum = _get_checksum_tuple(checksum)
         if source_algorithm:
-            algorithms.add(source_algorithm.lower())
+            source_algorithm = source_algorithm.lower()
+            algorithms.add(source_algorithm)
 
-        calculated_checksums = get_file_checksums(
-            algorithms=algorithms,
-            path=resource.upload_file_path
-        )
+        if hasher and algorithms <= set(hasher.algorithms):
+            hasher.advance(
+                resource.upload_file_path, resource.bytes_uploaded
+            )
+            calculated_checksums = hasher.hexdigests()
+        else:
+            calculated_checksums = get_file_checksums(
+                algorithms=algorithms,
+                path=resource.upload_file_path
+            )
 
         checksum_correct = (
             not source_algorithm
@@ -173,7 +296,12 @@ def _upload_completed(workspace, resource):
             f"Unknown upload type '{upload_type}'"
         )
 
-    if resource.bytes_uploaded >= CONFIG["UPLOAD_ASYNC_THRESHOLD_BYTES"]:
+    # Checksums of the upload may have been calculated already while it
+    # was being uploaded. Only the remaining part needs to be hashed.
+    hasher = _pop_upload_hasher(resource.identifier)
+    bytes_to_hash = resource.bytes_uploaded - (hasher.offset if hasher else 0)
+
+    if bytes_to_hash >= CONFIG["UPLOAD_ASYNC_THRESHOLD_BYTES"]:
         # Perform checksum calculation asynchronously
         try:
             source_checksum_algorithm, source_checksum = _get_checksum_tuple(
@@ -191,7 +319,8 @@ def _upload_completed(workspace, resource):
                     "path": workspace.path,
                     "source_checksum_algorithm": source_checksum_algorithm,
                     "source_checksum": source_checksum,
-                }
+                },
+                retry=True
             )
         except Exception:
             # If we couldn't enqueue background job, release the lock
@@ -200,7 +329,8 @@ def _upload_completed(workspace, resource):
     else:
         # Perform checksum calculation synchronously
         _calculate_upload_checksum(
-            resource=resource, workspace=workspace, checksum=checksum
+            resource=resource, workspace=workspace, checksum=checksum,
+            hasher=hasher
         )
 
         _store_files(workspace, resource, upload_type)
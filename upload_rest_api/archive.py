@@ -0,0 +1,365 @@
+"""Module for indexing and extracting archives.
+
+The members of an archive are indexed in one pass, and the same index
+is used for checking the archive and extracting it. Each file is
+hashed while it is extracted, so that the extracted files do not have
+to be read again to create their metadata.
+"""
+import os
+import stat
+import tarfile
+import zipfile
+from pathlib import Path
+from typing import NamedTuple, Union
+
+from archive_helpers.extract import (ExtractError, MemberNameError,
+                                     MemberOverwriteError, MemberTypeError)
+
+from upload_rest_api.checksum import MultiHasher, get_chunk_size
+
+TAR_TYPE_NAMES = {
+    tarfile.SYMTYPE: "SYM",
+    tarfile.LNKTYPE: "LNK",
+    tarfile.CHRTYPE: "CHR",
+    tarfile.BLKTYPE: "BLK",
+    tarfile.FIFOTYPE: "FIFO"
+}
+
+ZIP_TYPE_NAMES = {
+    stat.S_IFLNK: "SYM",
+    stat.S_IFCHR: "CHR",
+    stat.S_IFBLK: "BLK",
+    stat.S_IFIFO: "FIFO",
+    stat.S_IFSOCK: "SOCK"
+}
+
+
+class UnsupportedArchiveError(Exception):
+    """Exception raised when file is not a tar or zip archive."""
+
+
+class ExtractedFile(NamedTuple):
+    """Size and MD5 checksum of an extracted file."""
+    size: int
+    checksum: str
+
+
+class ArchiveMember(NamedTuple):
+    """Member of an archive."""
+    # Name of the member in the archive
+    name: str
+    # "FILE", "DIR", or the name of an unsupported type
+    type_name: str
+    # Size of the extracted member in bytes
+    size: int
+    # TarInfo or ZipInfo object of the member
+    info: Union[tarfile.TarInfo, zipfile.ZipInfo]
+
+    @property
+    def is_file(self):
+        """Return True if member is a regular file."""
+        return self.type_name == "FILE"
+
+    @property
+    def is_dir(self):
+        """Return True if member is a directory."""
+        return self.type_name == "DIR"
+
+
+def _tar_member(info):
+    """Create ArchiveMember from TarInfo."""
+    if info.isfile():
+        type_name = "FILE"
+    elif info.isdir():
+        type_name = "DIR"
+    else:
+        type_name = TAR_TYPE_NAMES.get(info.type, "UNKNOWN")
+
+    return ArchiveMember(
+        name=info.name, type_name=type_name, size=info.size, info=info
+    )
+
+
+def _zip_member(info):
+    """Create ArchiveMember from ZipInfo."""
+    file_type = stat.S_IFMT(info.external_attr >> 16)
+    if file_type in ZIP_TYPE_NAMES:
+        type_name = ZIP_TYPE_NAMES[file_type]
+    elif info.is_dir():
+        type_name = "DIR"
+    else:
+        type_name = "FILE"
+
+    return ArchiveMember(
+        name=info.filename, type_name=type_name, size=info.file_size,
+        info=info
+    )
+
+
+def _get_member_path(extract_path, name):
+    """Return the path where archive member would be extracted.
+
+    :param extract_path: Directory where the archive is extracted
+    :param name: Name of the member
+    :raises MemberNameError: If the member would be extracted outside
+                             the extraction directory
+    """
+    extract_path = os.path.abspath(extract_path)
+    member_path = os.path.normpath(os.path.join(extract_path, name))
+
+    if os.path.commonpath([extract_path, member_path]) != extract_path:
+        raise MemberNameError(f"Invalid file path: '{name}'")
+
+    return Path(member_path)
+
+
+def _check_member(member, extract_path):
+    """Check that archive member can be extracted.
+
+    :raises MemberNameError: If member has invalid path
+    :raises MemberTypeError: If member is not a file or directory
+    :raises MemberOverwriteError: If member would overwrite a file
+    """
+    if not (member.is_file or member.is_dir):
+        raise MemberTypeError(
+            f"File '{member.name}' has unsupported type: {member.type_name}"
+        )
+
+    member_path = _get_member_path(extract_path, member.name)
+    if member.is_file and member_path.exists():
+        raise MemberOverwriteError(f"File '{member.name}' already exists")
+
+
+def _write_member(stream, member_path):
+    """Write member to disk while calculating its MD5 checksum.
+
+    :param stream: Readable binary stream of the member
+    :param member_path: Path where the member is extracted
+    :returns: ExtractedFile
+    """
+    hasher = MultiHasher(["md5"])
+    buffer = memoryview(bytearray(get_chunk_size()))
+    size = 0
+
+    member_path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        file_ = open(member_path, "xb")
+    except FileExistsError as error:
+        # The archive contains the same file more than once
+        raise MemberOverwriteError(
+            f"File '{member_path}' already exists"
+        ) from error
+
+    with file_:
+        while True:
+            chunk_size = stream.readinto(buffer)
+            if not chunk_size:
+                break
+            chunk = buffer[:chunk_size]
+            file_.write(chunk)
+            hasher.update(chunk)
+            size += chunk_size
+
+    return ExtractedFile(size=size, checksum=hasher.hexdigests()["md5"])
+
+
+class ArchiveIndex:
+    """Index of the members of a tar or zip archive.
+
+    The index is built in one pass when the archive is opened: the
+    central directory is read from zip archives, and tar archives are
+    read through once. The archive is kept open, so that it can be
+    extracted without scanning it again.
+    """
+
+    def __init__(self, archive):
+        """Index an open archive.
+
+        :param archive: Open TarFile or ZipFile
+        """
+        self._archive = archive
+
+        if isinstance(archive, zipfile.ZipFile):
+            self.format = "zip"
+            self.members = [_zip_member(info) for info in archive.infolist()]
+        else:
+            self.format = "tar"
+            self.members = [
+                _tar_member(info) for info in archive.getmembers()
+            ]
+
+    @classmethod
+    def open(cls, path):
+        """Open and index an archive.
+
+        :param path: Path to the archive
+        :raises UnsupportedArchiveError: If file is not a tar or zip
+                                         archive
+        :raises ExtractError: If the archive can not be read
+        :returns: ArchiveIndex instance
+        """
+        if zipfile.is_zipfile(path):
+            open_archive = zipfile.ZipFile
+        else:
+            open_archive = tarfile.open
+
+        try:
+            archive = open_archive(path)
+        except (tarfile.ReadError, zipfile.BadZipFile) as error:
+            raise UnsupportedArchiveError(
+                "File is not a supported archive"
+            ) from error
+
+        try:
+            return cls(archive)
+        except (tarfile.TarError, zipfile.BadZipFile, EOFError) as error:
+            archive.close()
+            raise ExtractError(f"Could not read archive: {error}") from error
+        except Exception:
+            archive.close()
+            raise
+
+    def close(self):
+        """Close the archive."""
+        self._archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def files(self):
+        """Names of the regular files in the archive."""
+        return [member.name for member in self.members if member.is_file]
+
+    @property
+    def directories(self):
+        """Names of the directories in the archive."""
+        return [member.name for member in self.members if member.is_dir]
+
+    @property
+    def size(self):
+        """Total size of the archive members in bytes."""
+        return sum(member.size for member in self.members)
+
+    def _open_member(self, member):
+        """Return readable binary stream of a file member."""
+        if self.format == "zip":
+            return self._archive.open(member.info)
+
+        return self._archive.extractfile(member.info)
+
+    def extract(self, extract_path):
+        """Extract the archive and calculate checksums of its files.
+
+        All members are checked before anything is extracted. Each file
+        is hashed while it is streamed out of the archive.
+
+        :param extract_path: Directory where the archive is extracted
+        :raises MemberNameError: If some member has invalid path
+        :raises MemberTypeError: If some member is not a file or
+                                 directory
+        :raises MemberOverwriteError: If some member would overwrite a
+                                      file
+        :raises ExtractError: If the archive can not be extracted
+        :returns: Manifest of extracted files as a {path: ExtractedFile}
+                  dict, where path is the absolute path of extracted file
+        """
+        if self.format == "tar" and not self.members:
+            raise ExtractError("Blank tar archives are not supported.")
+
+        for member in self.members:
+            _check_member(member, extract_path)
+
+        manifest = {}
+        try:
+            for member in self.members:
+                member_path = _get_member_path(extract_path, member.name)
+                if member.is_dir:
+                    member_path.mkdir(parents=True, exist_ok=True)
+                    continue
+
+                with self._open_member(member) as stream:
+                    manifest[str(member_path)] \
+                        = _write_member(stream, member_path)
+        except (tarfile.TarError, zipfile.BadZipFile, EOFError) as error:
+            raise ExtractError(
+                f"Could not extract archive: {error}"
+            ) from error
+
+        return manifest
+
+
+def extract(archive_path, extract_path):
+    """Extract tar or zip archive and calculate checksums of its files.
+
+    :param archive_path: Path to the archive
+    :param extract_path: Directory where the archive is extracted
+    :raises UnsupportedArchiveError: If file is not a tar or zip archive
+    :returns: Manifest of extracted files. See
+              :meth:`ArchiveIndex.extract`.
+    """
+    with ArchiveIndex.open(archive_path) as index:
+        return index.extract(extract_path)
+
+
+def extract_tar_stream(stream, extract_path, check_member=None):
+    """Extract tar archive from a stream and calculate checksums of files.
+
+    The archive is read sequentially, so it does not have to be saved
+    to disk first. Unlike :meth:`ArchiveIndex.extract`, each member is
+    checked just before it is extracted, so some members may already
+    have been extracted when an invalid member is found.
+
+    :param stream: Readable binary stream of optionally compressed tar
+                   archive
+    :param extract_path: Directory where the archive is extracted
+    :param check_member: Optional function called with each
+                         ArchiveMember before it is extracted. The
+                         function may raise an exception to abort the
+                         extraction.
+    :raises UnsupportedArchiveError: If stream is not a tar archive
+    :raises MemberNameError: If some member has invalid path
+    :raises MemberTypeError: If some member is not a file or directory
+    :raises MemberOverwriteError: If some member would overwrite a file
+    :raises ExtractError: If the archive can not be extracted
+    :returns: Manifest of extracted files. See
+              :meth:`ArchiveIndex.extract`.
+    """
+    try:
+        archive = tarfile.open(fileobj=stream, mode="r|*")
+    except tarfile.ReadError as error:
+        raise UnsupportedArchiveError(
+            "File is not a supported tar archive"
+        ) from error
+
+    manifest = {}
+    is_blank = True
+    with archive:
+        try:
+            for info in archive:
+                is_blank = False
+                member = _tar_member(info)
+                if check_member:
+                    check_member(member)
+                _check_member(member, extract_path)
+
+                member_path = _get_member_path(extract_path, member.name)
+                if member.is_dir:
+                    member_path.mkdir(parents=True, exist_ok=True)
+                    continue
+
+                with archive.extractfile(info) as member_stream:
+                    manifest[str(member_path)] \
+                        = _write_member(member_stream, member_path)
+        except (tarfile.TarError, EOFError) as error:
+            raise ExtractError(
+                f"Could not extract archive: {error}"
+            ) from error
+
+        if is_blank:
+            raise ExtractError("Blank tar archives are not supported.")
+
+    return manifest
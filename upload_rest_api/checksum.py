@@ -1,7 +1,16 @@
 """Module for calculating checksums for files"""
 import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
 from typing import Iterable
 
+from upload_rest_api.config import CONFIG
+
+# Files are read in 1 MB chunks by default
+DEFAULT_CHECKSUM_CHUNK_SIZE = 1024 * 1024
+# Number of files hashed concurrently by default
+DEFAULT_CHECKSUM_WORKERS = 4
 
 HASH_FUNCTION_ALIASES = {
     "md5": "md5",
@@ -11,43 +20,218 @@ HASH_FUNCTION_ALIASES = {
 }
 
 
-def get_file_checksums(algorithms: Iterable[str], path: str) -> dict:
+def _get_hash_object(algorithm):
+    """
+    Create a new hash object for the given algorithm
+
+    :param str algorithm: Cryptographic hash algorithm
+
+    :raises ValueError: If algorithm is not recognized
+
+    :returns: hashlib hash object
+    """
+    try:
+        hash_func = getattr(
+            hashlib,
+            HASH_FUNCTION_ALIASES[algorithm.lower()]
+        )
+    except KeyError as exc:
+        raise ValueError(
+            f"Hash function '{algorithm}' not recognized"
+        ) from exc
+
+    return hash_func()
+
+
+class MultiHasher:
+    """Calculate checksums of the same data using multiple algorithms."""
+
+    def __init__(self, algorithms: Iterable[str]):
+        """Initialize hasher.
+
+        :param algorithms: Cryptographic hash algorithms used to
+                           calculate the checksums
+
+        :raises ValueError: If any algorithm is not recognized
+        """
+        self.algorithms = list(algorithms)
+        self.hash_objs = [
+            _get_hash_object(algorithm) for algorithm in self.algorithms
+        ]
+
+    def update(self, data):
+        """Feed data to every hash object.
+
+        :param data: Bytes-like object
+        """
+        for hash_obj in self.hash_objs:
+            hash_obj.update(data)
+
+    def hexdigests(self) -> dict:
+        """Return checksums as a {algorithm: checksum} dict."""
+        return {
+            algorithm: hash_obj.hexdigest()
+            for algorithm, hash_obj in zip(self.algorithms, self.hash_objs)
+        }
+
+
+def get_chunk_size(chunk_size=None):
+    """Return the given chunk size or the configured default."""
+    if chunk_size is None:
+        chunk_size = CONFIG.get(
+            "CHECKSUM_CHUNK_SIZE", DEFAULT_CHECKSUM_CHUNK_SIZE
+        )
+
+    return chunk_size
+
+
+class IncrementalHasher(MultiHasher):
+    """Calculate checksums of a file that grows by appending.
+
+    The hash state is advanced with the bytes appended to the file
+    since the previous call to :meth:`advance`, so the file is read
+    only once even if it is written in many parts.
+    """
+
+    def __init__(self, algorithms: Iterable[str]):
+        """Initialize hasher.
+
+        :param algorithms: Cryptographic hash algorithms used to
+                           calculate the checksums
+        """
+        super().__init__(algorithms)
+        # Number of bytes of the file fed to the hash objects
+        self.offset = 0
+        self._lock = threading.Lock()
+
+    def advance(self, path, end, chunk_size=None):
+        """Feed the bytes of the file up to ``end`` to hash objects.
+
+        :param path: Path to the file
+        :param end: Number of bytes of the file that have been written
+        :param chunk_size: Size of the chunks in which the file is read
+        """
+        chunk_size = get_chunk_size(chunk_size)
+
+        with self._lock, open(path, "rb", buffering=0) as file_:
+            file_.seek(self.offset)
+            buffer = memoryview(bytearray(chunk_size))
+            while self.offset < end:
+                size = file_.readinto(
+                    buffer[:min(chunk_size, end - self.offset)]
+                )
+                if not size:
+                    break
+                self.update(buffer[:size])
+                self.offset += size
+
+
+class HashingReader:
+    """Readable stream wrapper that calculates checksums of read data."""
+
+    def __init__(self, stream, algorithms: Iterable[str]):
+        """Initialize reader.
+
+        :param stream: Readable binary stream
+        :param algorithms: Cryptographic hash algorithms used to
+                           calculate the checksums
+        """
+        self._stream = stream
+        self.hasher = MultiHasher(algorithms)
+
+    def read(self, size=-1):
+        """Read and hash at most ``size`` bytes from the stream."""
+        data = self._stream.read(size)
+        self.hasher.update(data)
+        return data
+
+    def drain(self, chunk_size=None):
+        """Read and hash the rest of the stream."""
+        chunk_size = get_chunk_size(chunk_size)
+        while self.read(chunk_size):
+            pass
+
+
+def _hash_file_serial(hasher, file_, chunk_size):
+    """Feed the file to all hash objects in the current thread.
+
+    :param hasher: MultiHasher instance
+    :param file_: Unbuffered binary file object
+    :param chunk_size: Size of the read buffer in bytes
+    """
+    buffer = memoryview(bytearray(chunk_size))
+    while True:
+        size = file_.readinto(buffer)
+        if not size:
+            break
+        hasher.update(buffer[:size])
+
+
+def _hash_file_threaded(hasher, file_, chunk_size):
+    """Feed the file to each hash object in its own worker thread.
+
+    hashlib releases the GIL when hashing large buffers, so the
+    algorithms are run in parallel. The next chunk is read into a
+    second buffer while the workers are hashing the previous one, and
+    the two buffers are reused for the whole file.
+
+    :param hasher: MultiHasher instance
+    :param file_: Unbuffered binary file object
+    :param chunk_size: Size of the read buffers in bytes
+    """
+    buffers = [memoryview(bytearray(chunk_size)) for _ in range(2)]
+    futures = []
+
+    with ThreadPoolExecutor(max_workers=len(hasher.hash_objs)) as executor:
+        for i in count():
+            # The buffer was last used for the chunk before the
+            # previous one, which has already been hashed.
+            buffer = buffers[i % 2]
+            size = file_.readinto(buffer)
+
+            # Each hash object must be fed the chunks in order, so
+            # wait until the previous chunk has been hashed.
+            for future in futures:
+                future.result()
+
+            if not size:
+                break
+
+            chunk = buffer[:size]
+            futures = [
+                executor.submit(hash_obj.update, chunk)
+                for hash_obj in hasher.hash_objs
+            ]
+
+
+def get_file_checksums(
+        algorithms: Iterable[str], path: str, chunk_size: int = None
+) -> dict:
     """
     Calculate the file checksum using given algorithms for a file
 
+    If more than one algorithm is given, each algorithm is run in its
+    own thread.
+
     :param algorithms: Cryptographic hash algorithms used to calculate
                        the checksums
     :param path: Path to the file
+    :param chunk_size: Size of the chunks in which the file is read.
+                       Defaults to ``CHECKSUM_CHUNK_SIZE`` configuration
+                       parameter.
 
     :returns: Checksums as a {algorithm: checksum} dict
     """
-    algorithms = list(algorithms)
-
-    hash_objs = []
-
-    for algorithm in algorithms:
-        try:
-            hash_func = getattr(
-                hashlib,
-                HASH_FUNCTION_ALIASES[algorithm.lower()]
-            )
-            hash_obj = hash_func()
-            hash_objs.append(hash_obj)
-        except KeyError as exc:
-            raise ValueError(
-                f"Hash function '{algorithm}' not recognized"
-            ) from exc
-
-    with open(path, "rb") as file_:
-        # Read the file in 1 MB chunks
-        for chunk in iter(lambda: file_.read(1024 * 1024), b""):
-            for hash_obj in hash_objs:
-                hash_obj.update(chunk)
-
-    return {
-        algorithm: hash_obj.hexdigest()
-        for algorithm, hash_obj in zip(algorithms, hash_objs)
-    }
+    hasher = MultiHasher(algorithms)
+    chunk_size = get_chunk_size(chunk_size)
+
+    with open(path, "rb", buffering=0) as file_:
+        if len(hasher.hash_objs) > 1:
+            _hash_file_threaded(hasher, file_, chunk_size)
+        else:
+            _hash_file_serial(hasher, file_, chunk_size)
+
+    return hasher.hexdigests()
 
 
 def get_file_checksum(algorithm, path):
@@ -63,3 +247,38 @@ def get_file_checksum(algorithm, path):
     :returns: Checksum as a hex string
     """
     return get_file_checksums([algorithm], path)[algorithm]
+
+
+def get_multiple_file_checksums(algorithm, paths, max_workers=None):
+    """
+    Calculate the checksums of multiple files concurrently.
+
+    Hashing many small files is limited by the latency of opening and
+    reading each file, so the files are hashed in a bounded thread
+    pool.
+
+    :param str algorithm: Cryptographic hash algorithm to use to calculate
+                          the checksums
+    :param paths: Paths to the files
+    :param max_workers: Number of files hashed concurrently. Defaults to
+                        ``CHECKSUM_WORKERS`` configuration parameter.
+
+    :raises ValueError: If algorithm is not recognized
+
+    :returns: Checksums as a {path: checksum} dict, where path is the
+              path to the file as a string
+    """
+    paths = [str(path) for path in paths]
+    if not paths:
+        return {}
+
+    if max_workers is None:
+        max_workers = CONFIG.get(
+            "CHECKSUM_WORKERS", DEFAULT_CHECKSUM_WORKERS
+        )
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        checksums = executor.map(
+            lambda path: get_file_checksum(algorithm, path), paths
+        )
+        return dict(zip(paths, checksums))
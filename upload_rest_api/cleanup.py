@@ -4,19 +4,31 @@
 import datetime
 import logging
 import pathlib
+import shutil
+
+from rq.exceptions import NoSuchJobError
+from rq.job import Job
 
 import upload_rest_api.config
 from upload_rest_api.lock import ProjectLockManager
-from upload_rest_api.models.project import Project
+from upload_rest_api.models.project import Project, ProjectEntry
 from upload_rest_api.models.task import Task
+from upload_rest_api.models.trash_entry import TrashEntry
 from upload_rest_api.models.upload import Upload, UploadEntry
-from upload_rest_api.models.resource import get_resource
+from upload_rest_api.models.resource import (delete_trashed_directory,
+                                             get_resource)
+from upload_rest_api.redis import get_redis_connection
 
 # This is the time-to-live for upload database entries *in addition* to the
 # upload lock TTL. This ensures that longer uploads are given time to complete
 # even if they might exceed the lock lifetime.
 NON_TUS_UPLOAD_TTL = datetime.timedelta(days=2)
 
+# Directories in trash are deleted by background jobs that are enqueued
+# right after the directories are moved to trash. If a directory has
+# been in trash this long without a job, the job was never enqueued.
+ORPHANED_TRASH_TTL = datetime.timedelta(hours=1)
+
 
 def clean_disk():
     """Delete all expired files.
@@ -29,6 +41,72 @@ def clean_disk():
         project_directory = get_resource(project.id, '/')
         deleted_count += project_directory.delete_expired_files()
 
+        # Reconcile the incrementally updated used quota with the files
+        # on disk
+        project.update_used_quota()
+
+    return deleted_count
+
+
+def clean_trash():
+    """Delete directories left in trash by failed background jobs.
+
+    Directories in trash whose deletion job has failed, or no longer
+    exists, are deleted. Their files are deleted from disk, database
+    and Metax, and the used quota of their projects is decreased.
+
+    :returns: Count of deleted directories
+    """
+    conf = upload_rest_api.config.CONFIG
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - ORPHANED_TRASH_TTL
+    trash_path = pathlib.Path(conf["UPLOAD_TRASH_PATH"])
+
+    deleted_count = 0
+    for trash_entry in TrashEntry.objects.filter(created_at__lte=cutoff):
+        try:
+            job = Job.fetch(trash_entry.id, connection=get_redis_connection())
+        except NoSuchJobError:
+            job = None
+
+        if job is not None and not (job.is_failed or job.is_finished):
+            # The job is queued, running or scheduled to be retried
+            continue
+
+        logging.warning(
+            "Deleting directory %s of project %s left in trash",
+            trash_entry.path, trash_entry.project
+        )
+        delete_trashed_directory(
+            Project.get(id=trash_entry.project),
+            trash_path / trash_entry.id
+        )
+        deleted_count += 1
+
+    return deleted_count
+
+
+def clean_file_tree_snapshots():
+    """Delete file tree snapshots of projects that no longer exist.
+
+    Snapshots of existing projects are replaced when the file tree of
+    the project changes, but nothing replaces the snapshots of deleted
+    projects.
+
+    :returns: Count of deleted snapshot directories
+    """
+    conf = upload_rest_api.config.CONFIG
+    snapshot_path = pathlib.Path(conf["UPLOAD_TMP_PATH"]) / "file_trees"
+    if not snapshot_path.is_dir():
+        return 0
+
+    project_ids = set(ProjectEntry.objects.scalar("id"))
+
+    deleted_count = 0
+    for project_snapshot_path in snapshot_path.iterdir():
+        if project_snapshot_path.name not in project_ids:
+            shutil.rmtree(project_snapshot_path, ignore_errors=True)
+            deleted_count += 1
+
     return deleted_count
 
 
@@ -73,6 +151,7 @@ def clean_tus_uploads():
         Upload(db_upload=db_upload) for db_upload in uploads_to_delete
     ]
     for upload in uploads_to_delete:
+        upload.project.decrease_used_quota(upload.allocated_size)
         try:
             lock_manager.release(upload.project.id, upload.storage_path)
         except ValueError:
@@ -109,8 +188,16 @@ def clean_other_uploads():
 
     # We don't need to deal with locks here, as they have expired at this
     # point.
-    deleted_count = UploadEntry.objects.filter(
+    uploads_to_delete = UploadEntry.objects.filter(
         is_tus_upload=False, started_at__lte=cutoff
-    ).delete()
+    )
+
+    # Release the quota allocated for the uploads
+    for db_upload in uploads_to_delete.only("project", "allocated_size"):
+        Project(db_upload.project).decrease_used_quota(
+            db_upload.allocated_size
+        )
+
+    deleted_count = uploads_to_delete.delete()
 
     return deleted_count
@@ -1,12 +1,15 @@
 """Backgkround jobs."""
-from .utils import (DEFAULT_FAILED_JOB_TTL, DEFAULT_JOB_TIMEOUT, FILES_QUEUE,
-                    JOB_QUEUE_NAMES, UPLOAD_QUEUE, BackgroundJobQueue,
-                    ClientError, api_background_job, enqueue_background_job,
-                    get_job_queue)
+from .utils import (DEFAULT_FAILED_JOB_TTL, DEFAULT_JOB_RETRIES,
+                    DEFAULT_JOB_RETRY_INTERVAL, DEFAULT_JOB_TIMEOUT,
+                    FILES_QUEUE, JOB_QUEUE_NAMES, UPLOAD_QUEUE,
+                    BackgroundJobQueue, ClientError, api_background_job,
+                    enqueue_background_job, get_job_queue,
+                    job_will_be_retried)
 
 __all__ = (
-    "DEFAULT_FAILED_JOB_TTL", "DEFAULT_JOB_TIMEOUT", "FILES_QUEUE",
+    "DEFAULT_FAILED_JOB_TTL", "DEFAULT_JOB_RETRIES",
+    "DEFAULT_JOB_RETRY_INTERVAL", "DEFAULT_JOB_TIMEOUT", "FILES_QUEUE",
     "JOB_QUEUE_NAMES", "UPLOAD_QUEUE", "BackgroundJobQueue",
     "ClientError", "api_background_job", "enqueue_background_job",
-    "get_job_queue"
+    "get_job_queue", "job_will_be_retried"
 )
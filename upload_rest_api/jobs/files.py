@@ -1,28 +1,54 @@
 """Directory model background jobs."""
+from pathlib import Path
+
+from upload_rest_api.config import CONFIG
 from upload_rest_api.jobs.utils import api_background_job
 from upload_rest_api.lock import ProjectLockManager
-from upload_rest_api.models.resource import Directory
+from upload_rest_api.models.resource import (Directory,
+                                             delete_trashed_directory)
 from upload_rest_api.models.project import Project
 
 
 @api_background_job
-def delete_directory(project_id, path, task):
-    """Delete a directory.
+def delete_directory(project_id, path, task, trash_path=None):
+    """Delete a directory that has been moved to trash.
+
+    The job can be run again if it fails, in which case the remaining
+    files are deleted.
 
     :param str project_id: project identifier
     :param pathlib.Path path: path of the directory
     :param str task: Task instance
+    :param str trash_path: path of the directory in trash
     """
     task.set_fields(
         message=f"Deleting files and metadata: {path}"
     )
     project = Project.get(id=project_id)
-    directory = Directory(project.id, path)
-    directory.delete()
+    directory = Directory(project.id, path, project=project)
+
+    if trash_path is None:
+        # The job was enqueued by an older version, which kept the
+        # directory locked instead of moving it to trash. If the job is
+        # run again, the directory is already in trash.
+        trash_path = Path(CONFIG["UPLOAD_TRASH_PATH"]) / str(task.id)
+        if not trash_path.exists():
+            lock_manager = ProjectLockManager()
+            try:
+                lock_manager.release(project_id, directory.storage_path)
+            except ValueError:
+                # The lock has already expired
+                pass
+            directory.move_to_trash(trash_id=str(task.id))
 
-    # Release the lock we've held from the time this background job was
-    # enqueued
-    lock_manager = ProjectLockManager()
-    lock_manager.release(project_id, project.directory / path.strip('/'))
+    def _report_progress(deleted_count):
+        task.set_fields(
+            message=f"Deleting files and metadata: {path} "
+                    f"({deleted_count} files deleted)"
+        )
+
+    delete_trashed_directory(
+        project, trash_path, progress_callback=_report_progress
+    )
 
     return f"Deleted files and metadata: {path}"
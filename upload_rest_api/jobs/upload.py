@@ -2,7 +2,8 @@
 from flask_tus_io.workspace import Workspace
 
 from upload_rest_api.checksum import get_file_checksums
-from upload_rest_api.jobs.utils import ClientError, api_background_job
+from upload_rest_api.jobs.utils import (ClientError, api_background_job,
+                                        job_will_be_retried)
 from upload_rest_api.lock import ProjectLockManager
 from upload_rest_api.models.upload import Upload, UploadError, UploadType
 
@@ -25,11 +26,18 @@ def calculate_upload_checksum(
                                       provided by uploader
     :param source_checksum: Optional source checksum provided by uploader
     """
+    upload = Upload.get(id=identifier)
+
+    if upload.source_checksum is not None:
+        # The checksum was already calculated and the source was
+        # added by an earlier attempt of this job
+        return _store_files(
+            identifier=identifier, verify_source=False, task=task
+        )
+
     workspace = Workspace(path)
     resource = workspace.get_resource()
 
-    upload = Upload.get(id=identifier)
-
     lock_manager = ProjectLockManager()
 
     algorithms = set(["md5"])
@@ -52,7 +60,11 @@ def calculate_upload_checksum(
         if not checksum_correct:
             # User provided checksum but it didn't match
             raise ClientError("Upload checksum mismatch")
-    except Exception:
+    except Exception as error:
+        if job_will_be_retried() and not isinstance(error, ClientError):
+            # Keep the workspace, so that the checksum can be
+            # calculated again
+            raise
         workspace.remove()
         lock_manager.release(upload.project.id, upload.storage_path)
         raise
@@ -102,7 +114,7 @@ def _store_files(identifier, verify_source, task):
     task.set_fields(message=message)
 
     try:
-        upload.store_files(verify_source)
+        upload.store_files(verify_source, resumable=job_will_be_retried())
     except UploadError as error:
         raise ClientError(str(error), error.files) from error
 
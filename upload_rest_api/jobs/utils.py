@@ -1,7 +1,7 @@
 """Background task utility functions."""
 from functools import wraps
 
-from rq import Queue
+from rq import Queue, Retry, get_current_job
 
 from upload_rest_api.models.task import Task, TaskStatus
 from upload_rest_api.config import CONFIG
@@ -17,6 +17,10 @@ DEFAULT_JOB_TIMEOUT = 12 * 60 * 60  # 12 hours
 # NOTE: This configuration parameter is ignored in RQ versions prior to
 # v1.0
 DEFAULT_FAILED_JOB_TTL = 7 * 24 * 60 * 60  # 7 days
+# How many times a failed job is retried, if the job supports retrying
+DEFAULT_JOB_RETRIES = 3
+# Seconds to wait before a failed job is retried
+DEFAULT_JOB_RETRY_INTERVAL = 5 * 60  # 5 minutes
 
 
 class BackgroundJobQueue(Queue):
@@ -39,7 +43,8 @@ def api_background_job(func):
 
     Sets task status after task has run. If the task fails, the task
     will be marked as having failed unexpectedly in the MongoDB database
-    before exception handling is passed over to the RQ worker
+    before exception handling is passed over to the RQ worker, unless
+    the job will be retried.
     """
     @wraps(func)
     def wrapper(*args, **kwargs):
@@ -65,10 +70,13 @@ def api_background_job(func):
             )
             return str(exception)
         except Exception:
-            task.set_fields(
-                status=TaskStatus.ERROR,
-                message="Internal server error"
-            )
+            if job_will_be_retried():
+                task.set_fields(message="Task failed, retrying")
+            else:
+                task.set_fields(
+                    status=TaskStatus.ERROR,
+                    message="Internal server error"
+                )
             raise
         else:
             task.set_fields(
@@ -80,6 +88,17 @@ def api_background_job(func):
     return wrapper
 
 
+def job_will_be_retried():
+    """Check if the current job will be retried if it fails.
+
+    :returns: ``True`` if called from a job that has retries left
+    """
+    job = get_current_job()
+    # Jobs enqueued without retries, or by RQ versions older than
+    # v1.5, do not have retries left
+    return bool(job and getattr(job, "retries_left", None))
+
+
 def get_job_queue(queue_name):
     """Get a RQ queue instance for the given queue.
 
@@ -94,7 +113,8 @@ def get_job_queue(queue_name):
 
 
 def enqueue_background_job(
-        task_func, queue_name, project_id, job_kwargs, task_id=None):
+        task_func, queue_name, project_id, job_kwargs, task_id=None,
+        retry=False):
     """Create a task ID and enqueue a RQ job.
 
     :param str task_func: Python function to run as a string to import
@@ -105,6 +125,9 @@ def enqueue_background_job(
                             task
     :param str task_id: Optional identifier for the task. Will be
                         generated automatically if not provided.
+    :param bool retry: Retry the job if it fails unexpectedly. Only
+                       jobs that can be safely run again should be
+                       retried.
     """
     queue = get_job_queue(queue_name)
 
@@ -124,12 +147,23 @@ def enqueue_background_job(
 
     job_timeout = CONFIG.get("RQ_JOB_TIMEOUT", DEFAULT_JOB_TIMEOUT)
 
+    enqueue_kwargs = {}
+    retries = CONFIG.get("RQ_JOB_RETRIES", DEFAULT_JOB_RETRIES)
+    if retry and retries:
+        enqueue_kwargs["retry"] = Retry(
+            max=retries,
+            interval=CONFIG.get(
+                "RQ_JOB_RETRY_INTERVAL", DEFAULT_JOB_RETRY_INTERVAL
+            )
+        )
+
     queue.enqueue(
         task_func,
         job_id=str(task_id),
         timeout=job_timeout,  # rq 0.12.0 or older
         job_timeout=job_timeout,  # rq 0.13.0 and newer
         failure_ttl=CONFIG.get("RQ_FAILED_JOB_TTL", DEFAULT_FAILED_JOB_TTL),
-        kwargs=job_kwargs
+        kwargs=job_kwargs,
+        **enqueue_kwargs
     )
     return str(task_id)
@@ -0,0 +1,96 @@
+"""DirectoryEntry class."""
+import os
+import re
+from itertools import islice
+
+from mongoengine import Document, StringField
+from pymongo import UpdateOne
+
+# Number of directories written to database in one request
+DIRECTORY_ENTRY_WRITE_CHUNK_SIZE = 10000
+
+
+class DirectoryEntry(Document):
+    """Directory in a project directory.
+
+    The project directories themselves are not included. Together with
+    the project and parent fields of FileEntry, the directory entries
+    allow listing the contents of directories with indexed queries.
+    """
+    # Absolute file system path of the directory
+    path = StringField(primary_key=True, required=True)
+    # Identifier of the project that contains the directory
+    project = StringField(required=True)
+    # Absolute file system path of the parent directory
+    parent = StringField(required=True)
+
+    meta = {
+        "collection": "directories",
+        # See FileEntry for why indexes are not created automatically
+        "auto_create_index": False,
+        "indexes": [
+            {
+                "name": "project_1_parent_1",
+                "fields": ["project", "parent"]
+            }
+        ]
+    }
+
+    @classmethod
+    def add_directories(cls, project, paths):
+        """Add directories and their parent directories.
+
+        Directories that already exist in the database are left as
+        they are.
+
+        :param project: Project instance
+        :param paths: Iterable of absolute paths of directories in the
+                      project directory
+        """
+        project_directory = str(project.directory)
+
+        directories = set()
+        for path in paths:
+            path = str(path)
+            while path.startswith(f"{project_directory}/") \
+                    and path not in directories:
+                directories.add(path)
+                path = os.path.dirname(path)
+
+        directories = iter(directories)
+        collection = cls._get_collection()
+        while True:
+            chunk = list(islice(directories, DIRECTORY_ENTRY_WRITE_CHUNK_SIZE))
+            if not chunk:
+                break
+
+            collection.bulk_write(
+                [
+                    UpdateOne(
+                        {"_id": path},
+                        {
+                            "$setOnInsert": {
+                                "project": project.id,
+                                "parent": os.path.dirname(path)
+                            }
+                        },
+                        upsert=True
+                    )
+                    for path in chunk
+                ],
+                ordered=False
+            )
+
+    @classmethod
+    def delete_tree(cls, path):
+        """Delete a directory and all its subdirectories.
+
+        :param path: Absolute path of the directory
+        """
+        path = str(path)
+        cls._get_collection().delete_many({
+            "$or": [
+                {"_id": path},
+                {"_id": {"$regex": f"^{re.escape(path)}/"}}
+            ]
+        })
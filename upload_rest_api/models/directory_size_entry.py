@@ -0,0 +1,28 @@
+"""DirectorySizeEntry class."""
+from mongoengine import Document, ListField, LongField, StringField
+
+
+class DirectorySizeEntry(Document):
+    """Cached size of the files directly in a project directory.
+
+    The entry is valid as long as the modification time of the
+    directory has not changed, since adding, removing or renaming
+    entries of a directory updates its modification time.
+    """
+    # Absolute file system path of the directory
+    path = StringField(primary_key=True, required=True)
+    # Identifier of the project that contains the directory
+    project = StringField(required=True)
+    # Modification time of the directory in nanoseconds
+    mtime = LongField(required=True)
+    # Total size of the files directly in the directory in bytes
+    size = LongField(required=True)
+    # Names of the subdirectories of the directory
+    subdirectories = ListField(StringField())
+
+    meta = {
+        "collection": "directory_sizes",
+        # See FileEntry for why indexes are not created automatically
+        "auto_create_index": False,
+        "indexes": ["project"]
+    }
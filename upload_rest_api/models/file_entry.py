@@ -1,9 +1,24 @@
 """FileEntry class."""
+import logging
 import pathlib
-from mongoengine import Document, StringField, ValidationError
+import time
+from itertools import islice
+
+from mongoengine import (DateTimeField, Document, LongField, NotUniqueError,
+                         StringField, ValidationError)
+from pymongo.errors import BulkWriteError
 
 from upload_rest_api.config import CONFIG
 
+LOGGER = logging.getLogger(__name__)
+
+# Number of documents written to database in one request by
+# FileEntry.bulk_insert
+DEFAULT_FILE_ENTRY_INSERT_CHUNK_SIZE = 10000
+
+# Error code of MongoDB for duplicate key errors
+DUPLICATE_KEY_ERROR = 11000
+
 
 def _validate_file_path(path_string):
     """Validate path.
@@ -33,6 +48,14 @@ class FileEntry(Document):
     checksum = StringField(required=True)
     # Metax identifier of the file
     identifier = StringField(required=True, unique=True)
+    # Identifier of the project that contains the file
+    project = StringField()
+    # Absolute file system path of the directory that contains the file
+    parent = StringField()
+    # Size of the file in bytes
+    size = LongField()
+    # Time when the file was stored
+    timestamp = DateTimeField()
 
     meta = {
         "collection": "files",
@@ -51,6 +74,11 @@ class FileEntry(Document):
             {
                 "name": "identifier_1",
                 "fields": ["identifier"]
+            },
+            # Index for listing the files of a directory
+            {
+                "name": "project_1_parent_1",
+                "fields": ["project", "parent"]
             }
         ]
     }
@@ -62,3 +90,70 @@ class FileEntry(Document):
             file_["_id"]: file_["checksum"]
             for file_ in cls.objects.only("path", "checksum").as_pymongo()
         }
+
+    @classmethod
+    def bulk_insert(cls, entries, chunk_size=None):
+        """Insert files to database without validating them.
+
+        The documents are written with unordered ``insert_many``
+        requests of ``FILE_ENTRY_INSERT_CHUNK_SIZE`` documents, which
+        is much faster than saving the documents one by one. The paths
+        are not validated, so this method must only be used for paths
+        that are known to be absolute and normalized subpaths of a
+        project directory.
+
+        :param entries: Iterable of dicts with keys "path", "checksum"
+                        and "identifier", and optionally "project",
+                        "parent", "size" and "timestamp"
+        :param chunk_size: Number of documents written in one request
+        :raises NotUniqueError: If some file already exists in the
+                                database. The other files are inserted.
+        :returns: Number of inserted files
+        """
+        if chunk_size is None:
+            chunk_size = CONFIG.get(
+                "FILE_ENTRY_INSERT_CHUNK_SIZE",
+                DEFAULT_FILE_ENTRY_INSERT_CHUNK_SIZE
+            )
+
+        collection = cls._get_collection()
+        documents = (
+            {
+                ("_id" if key == "path" else key): value
+                for key, value in entry.items()
+            }
+            for entry in entries
+        )
+
+        start_time = time.monotonic()
+        inserted_count = 0
+        duplicate_error = None
+        while True:
+            chunk = list(islice(documents, chunk_size))
+            if not chunk:
+                break
+
+            try:
+                collection.insert_many(chunk, ordered=False)
+                inserted_count += len(chunk)
+            except BulkWriteError as error:
+                inserted_count += error.details["nInserted"]
+                if any(
+                        write_error["code"] != DUPLICATE_KEY_ERROR
+                        for write_error in error.details["writeErrors"]
+                ):
+                    raise
+                duplicate_error = error
+
+        duration = time.monotonic() - start_time
+        LOGGER.info(
+            "Inserted %d files to database in %.2f seconds (%.0f files/s)",
+            inserted_count, duration, inserted_count / max(duration, 0.001)
+        )
+
+        if duplicate_error:
+            raise NotUniqueError(
+                "Some files already exist in the database"
+            ) from duplicate_error
+
+        return inserted_count
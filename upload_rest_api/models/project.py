@@ -1,20 +1,183 @@
 import os
 import pathlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 
+from bson import ObjectId
 from mongoengine import NotUniqueError
+from pymongo import ReplaceOne, UpdateOne
 
+from upload_rest_api.models.directory_entry import DirectoryEntry
+from upload_rest_api.models.directory_size_entry import DirectorySizeEntry
+from upload_rest_api.models.file_entry import (
+    DEFAULT_FILE_ENTRY_INSERT_CHUNK_SIZE, FileEntry)
 from upload_rest_api.models.project_entry import ProjectEntry
-from upload_rest_api.models.upload_entry import UploadEntry
+from upload_rest_api.models.trash_entry import TrashEntry
+from upload_rest_api.models.upload_entry import UploadEntry, UploadStage
 from upload_rest_api.config import CONFIG
 
+# Number of subdirectories of a project directory that are sized at the
+# same time
+DEFAULT_DIR_SIZE_WORKERS = 8
+# Directories modified more recently than this many seconds ago are not
+# cached, since they could change again within the resolution of the
+# modification time
+DIR_SIZE_CACHE_MIN_AGE = 2
 
-def _get_dir_size(fpath):
-    """Return the size of the dir fpath in bytes."""
-    size = 0
-    for dirpath, _, files in os.walk(fpath):
-        for fname in files:
-            _file = os.path.join(dirpath, fname)
-            size += os.path.getsize(_file)
+
+class _DirectorySizeCache:
+    """Cache of the sizes of the files directly in each directory.
+
+    Each cached size is valid as long as the modification time of the
+    directory has not changed. Files are never modified in place in
+    project directories, so adding, removing or renaming files is the
+    only way the size of a directory can change.
+    """
+
+    def __init__(self, project_id):
+        """Load the cached sizes of project directories.
+
+        :param project_id: Project identifier
+        """
+        self.project_id = project_id
+        self._entries = {
+            entry["_id"]: entry for entry in
+            DirectorySizeEntry.objects.filter(project=project_id).as_pymongo()
+        }
+        self._visited = set()
+        self._updated = []
+        self._lock = threading.Lock()
+
+    def get(self, path, mtime):
+        """Return cached size and subdirectories of a directory.
+
+        :param path: Path of the directory
+        :param mtime: Current modification time of the directory in
+                      nanoseconds
+        :returns: Tuple of the size of the files in the directory and
+                  the names of the subdirectories, or None if the
+                  directory has changed since it was cached
+        """
+        with self._lock:
+            self._visited.add(path)
+
+        entry = self._entries.get(path)
+        if entry and entry["mtime"] == mtime:
+            return entry["size"], entry["subdirectories"]
+
+        return None
+
+    def set(self, path, mtime, size, subdirectories):
+        """Cache size and subdirectories of a directory."""
+        # time.time_ns is not available in Python 3.6
+        if time.time() - mtime / 10**9 < DIR_SIZE_CACHE_MIN_AGE:
+            return
+
+        with self._lock:
+            self._updated.append({
+                "_id": path,
+                "project": self.project_id,
+                "mtime": mtime,
+                "size": size,
+                "subdirectories": subdirectories
+            })
+
+    def save(self):
+        """Save new entries and remove entries of removed directories."""
+        collection = DirectorySizeEntry._get_collection()
+        if self._updated:
+            collection.bulk_write(
+                [
+                    ReplaceOne({"_id": entry["_id"]}, entry, upsert=True)
+                    for entry in self._updated
+                ],
+                ordered=False
+            )
+
+        removed = [path for path in self._entries if path not in self._visited]
+        if removed:
+            collection.delete_many({"_id": {"$in": removed}})
+
+
+def _scan_dir(path, cache=None):
+    """Return the size of the files directly in a directory.
+
+    The directory is listed with ``os.scandir``, so the type of each
+    entry is known without a separate ``stat`` call. If the directory
+    has not changed since it was cached, it is not listed at all.
+
+    :param path: Path of the directory
+    :param cache: Optional _DirectorySizeCache
+    :returns: Tuple of the size of the files in bytes and the paths of
+              the subdirectories
+    """
+    try:
+        mtime = os.stat(path).st_mtime_ns if cache else None
+        if cache:
+            cached = cache.get(path, mtime)
+            if cached:
+                size, subdirectories = cached
+                return size, [
+                    os.path.join(path, name) for name in subdirectories
+                ]
+
+        size = 0
+        subdirectories = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirectories.append(entry.name)
+                else:
+                    size += entry.stat().st_size
+    except FileNotFoundError:
+        return 0, []
+
+    if cache:
+        cache.set(path, mtime, size, subdirectories)
+
+    return size, [os.path.join(path, name) for name in subdirectories]
+
+
+def _get_tree_size(path, cache=None):
+    """Return the size of a directory tree without recursion.
+
+    :param path: Path of the directory
+    :param cache: Optional _DirectorySizeCache
+    """
+    total_size = 0
+    directories = [path]
+    while directories:
+        size, subdirectories = _scan_dir(directories.pop(), cache)
+        total_size += size
+        directories.extend(subdirectories)
+
+    return total_size
+
+
+def _get_dir_size(fpath, cache=None, max_workers=None):
+    """Return the size of the dir fpath in bytes.
+
+    The subdirectories of the directory are sized in parallel, which
+    is much faster on network file systems where each ``stat`` call
+    has high latency.
+
+    :param fpath: Path of the directory
+    :param cache: Optional _DirectorySizeCache used to skip
+                  directories that have not changed
+    :param max_workers: Number of subdirectories sized at the same time
+    """
+    if max_workers is None:
+        max_workers = CONFIG.get("DIR_SIZE_WORKERS", DEFAULT_DIR_SIZE_WORKERS)
+
+    size, subdirectories = _scan_dir(str(fpath), cache)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        size += sum(
+            executor.map(
+                lambda path: _get_tree_size(path, cache), subdirectories
+            )
+        )
 
     return size
 
@@ -39,6 +202,10 @@ class Project:
     used_quota = property(lambda x: x._db_project.used_quota)
 
     remaining_quota = property(lambda x: x._db_project.remaining_quota)
+    file_tree_version = property(
+        lambda x: x._db_project.file_tree_version or 0
+    )
+    instance_id = property(lambda x: x._db_project.instance_id)
 
     DoesNotExist = ProjectEntry.DoesNotExist
 
@@ -46,7 +213,9 @@ class Project:
     def create(cls, identifier, quota=5 * 1024**3):
         """Create project and prepare the file storage directory."""
         project = cls(
-            db_project=ProjectEntry(id=identifier, quota=int(quota))
+            db_project=ProjectEntry(
+                id=identifier, quota=int(quota), instance_id=ObjectId()
+            )
         )
 
         if project.directory.parents[0] \
@@ -90,6 +259,8 @@ class Project:
         Delete the project
         """
         self._db_project.delete()
+        DirectorySizeEntry.objects.filter(project=self.id).delete()
+        DirectoryEntry.objects.filter(project=self.id).delete()
 
     @property
     def directory(self):
@@ -98,23 +269,194 @@ class Project:
 
     def set_quota(self, quota):
         """Set the quota for the project"""
+        # Only the quota is updated, so that concurrent changes to used
+        # quota are not overwritten
+        self._db_project.update(set__quota=quota)
         self._db_project.quota = quota
-        self._db_project.save()
 
     def update_used_quota(self):
-        """Update used quota of the project."""
-        stored_size = _get_dir_size(self.directory)
-        allocated_size \
-            = UploadEntry.objects.filter(project=self.id).sum("size")
-        self._db_project.used_quota = stored_size + allocated_size
-        self._db_project.save()
-
-    def increase_used_quota(self, quota):
+        """Recalculate used quota of the project.
+
+        The size of every file in the project directory is read, which
+        is slow for large projects. Used quota is kept up to date
+        incrementally when files are added or removed, so this should
+        only be used to reconcile the used quota in a background job or
+        from the command line.
+
+        Only the difference between the recalculated and the previous
+        used quota is added, so that the changes made by uploads and
+        deletions while the files are read are not overwritten.
+        """
+        previous_used_quota = ProjectEntry.objects.only("used_quota") \
+            .get(id=self.id).used_quota
+
+        # Directories that have not changed since the previous
+        # recalculation are not listed again
+        cache = _DirectorySizeCache(self.id)
+        stored_size = _get_dir_size(self.directory, cache)
+        cache.save()
+
+        # Directories in trash count towards the used quota until their
+        # files have been deleted, because the used quota is decreased
+        # as the files are deleted
+        trash_size = sum(
+            _get_dir_size(pathlib.Path(CONFIG["UPLOAD_TRASH_PATH"], trash_id))
+            for trash_id
+            in TrashEntry.objects.filter(project=self.id).scalar("id")
+        )
+
+        allocated_size = UploadEntry.objects.filter(
+            project=self.id, stage__ne=UploadStage.METADATA_CREATED
+        ).sum("allocated_size")
+
+        # Uploads whose metadata has been created are moving their files
+        # to the project directory, where the moved files were already
+        # counted. Only the files that are still in the temporary
+        # project directory are counted for them.
+        allocated_size += sum(
+            _get_dir_size(
+                pathlib.Path(CONFIG["UPLOAD_TMP_PATH"], upload_id,
+                             "tmp_storage")
+            )
+            for upload_id in UploadEntry.objects.filter(
+                project=self.id, stage=UploadStage.METADATA_CREATED
+            ).scalar("id")
+        )
+
+        used_quota = stored_size + trash_size + allocated_size
+        self.increase_used_quota(used_quota - previous_used_quota)
+
+    def update_file_index(self):
+        """Update the database index of files and directories.
+
+        The project directory is walked, and the directory entries and
+        the project, parent, size and timestamp of each file entry are
+        updated to match the files on disk. This is used to index files
+        stored before the index existed, and to reconcile the index with
+        the files on disk.
+
+        :returns: Tuple of the numbers of indexed directories and files.
+                  Files that do not have a database entry are not
+                  counted.
+        """
+        chunk_size = CONFIG.get(
+            "FILE_ENTRY_INSERT_CHUNK_SIZE",
+            DEFAULT_FILE_ENTRY_INSERT_CHUNK_SIZE
+        )
+        files_collection = FileEntry._get_collection()
+
+        directories = []
+        file_updates = []
+        file_count = 0
+        unvisited = [str(self.directory)]
+        while unvisited:
+            path = unvisited.pop()
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        directories.append(entry.path)
+                        unvisited.append(entry.path)
+                        continue
+
+                    stat = entry.stat(follow_symlinks=False)
+                    # The upload time of old files is not known. The
+                    # modification time is when the file was written
+                    # by the upload, and unlike the change time, it is
+                    # not reset if the file is renamed or its
+                    # permissions are changed.
+                    file_updates.append(UpdateOne(
+                        {"_id": entry.path},
+                        {"$set": {
+                            "project": self.id,
+                            "parent": path,
+                            "size": stat.st_size,
+                            "timestamp": datetime.fromtimestamp(
+                                stat.st_mtime, tz=timezone.utc
+                            )
+                        }}
+                    ))
+                    if len(file_updates) >= chunk_size:
+                        file_count += files_collection.bulk_write(
+                            file_updates, ordered=False
+                        ).matched_count
+                        file_updates = []
+
+        if file_updates:
+            file_count += files_collection.bulk_write(
+                file_updates, ordered=False
+            ).matched_count
+
+        DirectoryEntry.add_directories(self, directories)
+
+        # Remove entries of directories that no longer exist
+        existing_directories = set(directories)
+        removed_directories = [
+            path for path in
+            DirectoryEntry.objects.filter(project=self.id).scalar("path")
+            if path not in existing_directories
+        ]
+        for i in range(0, len(removed_directories), chunk_size):
+            DirectoryEntry.objects.filter(
+                path__in=removed_directories[i:i + chunk_size]
+            ).delete()
+
+        return len(directories), file_count
+
+    def increase_used_quota(self, size):
         """Increase the used quota for this project.
 
-        This is done when an archive extraction is started, and is necessary
-        because we cannot know the final size of the extracted contents
-        in advance.
+        The used quota is increased atomically in the database, so
+        concurrent uploads and deletions do not overwrite each other's
+        changes.
+
+        :param size: Number of bytes to add. Can be negative.
+        """
+        db_project = ProjectEntry.objects(id=self.id).modify(
+            inc__used_quota=size, new=True
+        )
+        self._db_project.used_quota = db_project.used_quota
+
+    def reserve_quota(self, size):
+        """Reserve quota for new data.
+
+        The used quota is increased only if the quota is not exceeded.
+        The condition is checked and the used quota increased in one
+        atomic update, so concurrent reservations can not exceed the
+        quota together.
+
+        :param size: Number of bytes to reserve
+        :returns: True if the quota was reserved, False if there is not
+                  enough quota left
         """
-        self._db_project.used_quota += quota
-        self._db_project.save()
+        db_project = ProjectEntry.objects(
+            id=self.id,
+            __raw__={
+                "$expr": {
+                    "$lte": [{"$add": ["$used_quota", size]}, "$quota"]
+                }
+            }
+        ).modify(inc__used_quota=size, new=True)
+
+        if db_project is None:
+            return False
+
+        self._db_project.used_quota = db_project.used_quota
+        return True
+
+    def decrease_used_quota(self, size):
+        """Decrease the used quota for this project.
+
+        :param size: Number of bytes to subtract
+        """
+        self.increase_used_quota(-size)
+
+    def invalidate_file_tree(self):
+        """Mark the file tree of the project as changed.
+
+        Cached listings of the project directory are identified by the
+        file tree version, so they are not used after this.
+        """
+        db_project = ProjectEntry.objects(id=self.id).modify(
+            inc__file_tree_version=1, new=True
+        )
+        self._db_project.file_tree_version = db_project.file_tree_version
@@ -1,5 +1,5 @@
 """ProjectEntry class."""
-from mongoengine import Document, LongField, StringField
+from mongoengine import Document, LongField, ObjectIdField, StringField
 
 
 class ProjectEntry(Document):
@@ -8,6 +8,13 @@ class ProjectEntry(Document):
 
     used_quota = LongField(default=0)
     quota = LongField(default=0)
+    # Incremented whenever files or directories are added or removed,
+    # so that cached listings of the project can be invalidated
+    file_tree_version = LongField()
+    # Identifies this instance of the project, because the identifier
+    # of a deleted project can be reused. Projects created before this
+    # field was added do not have it.
+    instance_id = ObjectIdField()
 
     meta = {"collection": "projects"}
 
@@ -1,20 +1,28 @@
 """File and Directory models."""
 
 import abc
+import heapq
 import os
 import pathlib
+import re
 import shutil
 import time
+import uuid
 from datetime import datetime, timezone
+from itertools import islice
+from operator import attrgetter
 
 from metax_access import (DS_STATE_ACCEPTED_TO_DIGITAL_PRESERVATION,
                           DS_STATE_REJECTED_IN_DIGITAL_PRESERVATION_SERVICE)
+from pymongo import ReplaceOne
 
 from upload_rest_api.metax import get_metax_client
 from upload_rest_api.config import CONFIG
 from upload_rest_api.lock import ProjectLockManager
+from upload_rest_api.models.directory_entry import DirectoryEntry
 from upload_rest_api.models.file_entry import FileEntry
 from upload_rest_api.models.project import Project
+from upload_rest_api.models.trash_entry import TrashEntry, TrashedFileEntry
 
 
 LANGUAGE_IDENTIFIERS = {
@@ -23,6 +31,17 @@ LANGUAGE_IDENTIFIERS = {
     "http://lexvo.org/id/iso639-3/swe": "sv"
 }
 
+# Maximum number of paths in one database query when the database
+# entries of files are retrieved
+FILE_ENTRY_QUERY_CHUNK_SIZE = 10000
+
+# Number of files deleted at a time. Each batch is deleted from the
+# database and Metax with a few requests.
+DEFAULT_FILE_DELETE_BATCH_SIZE = 1000
+# Seconds to wait between the batches, so that deleting large
+# directories does not saturate the file system, database and Metax
+DEFAULT_TRASH_DELETE_INTERVAL = 0.1
+
 
 class HasPendingDatasetError(Exception):
     """Pending dataset error.
@@ -73,30 +92,326 @@ def get_resource(project_id, path):
     return resource
 
 
+def _preload_file_entries(files):
+    """Retrieve the database entries of files in bulk.
+
+    The entries are attached to the File instances, so that accessing
+    the identifier or checksum of each file does not require a
+    separate query. Files without a database entry are left as they
+    are.
+
+    :param files: Iterable of File instances
+    """
+    files = iter(files)
+    while True:
+        files_by_path = {
+            str(file.storage_path): file
+            for file in islice(files, FILE_ENTRY_QUERY_CHUNK_SIZE)
+        }
+        if not files_by_path:
+            break
+
+        for entry in FileEntry.objects.filter(path__in=list(files_by_path)):
+            files_by_path[entry.path]._db_file_ = entry
+
+
+def _delete_metadata(storage_identifiers):
+    """Delete metadata of files from Metax.
+
+    The metadata of files that are part of a dataset is not removed.
+
+    :param storage_identifiers: Storage identifiers of the files
+    """
+    if not storage_identifiers:
+        return
+
+    # The metadata of preserved files should not be removed (see
+    # TPASPKT-749). Deleting files that have pending
+    # datasets is not possible, so at this point we know that if
+    # a file in "directory_files" has a dataset, it is in
+    # preservation. Therefore, we do not have to check the
+    # preservation state of every dataset (which would be very
+    # inefficient), as we can just remove metadata of all files that
+    # are not inlcuded in any dataset.
+    metax_client = get_metax_client()
+    file2datasets = metax_client.get_file2dataset_dict(storage_identifiers)
+    files_without_datasets = [
+        {
+            "storage_identifier": storage_identifier,
+            "storage_service": "pas",
+        }
+        for storage_identifier in storage_identifiers
+        if not file2datasets.get(storage_identifier)
+    ]
+    if files_without_datasets:
+        metax_client.delete_files(files_without_datasets)
+
+
+def _remove_files(paths):
+    """Remove files from disk.
+
+    :param paths: Absolute paths of the files
+    :returns: Total size of the removed files in bytes
+    """
+    removed_size = 0
+    for path in paths:
+        removed_size += os.stat(path).st_size
+        os.remove(path)
+
+    return removed_size
+
+
+def _delete_files(paths):
+    """Delete files from disk, database and Metax.
+
+    The metadata of files that are part of a dataset is not removed
+    from Metax.
+
+    :param paths: Absolute paths of the files in the project directory
+    :returns: Total size of the deleted files in bytes
+    """
+    paths = [str(path) for path in paths]
+    file_entries = FileEntry.objects.filter(path__in=paths)
+    storage_identifiers = list(file_entries.scalar("identifier"))
+
+    deleted_size = _remove_files(paths)
+    file_entries.delete()
+    _delete_metadata(storage_identifiers)
+
+    return deleted_size
+
+
+def _delete_trashed_files(paths):
+    """Delete files of a directory in trash from disk, database and Metax.
+
+    The files are identified by the TrashedFileEntry documents created
+    when the directory was moved to trash.
+
+    :param paths: Absolute paths of the files in trash
+    :returns: Total size of the deleted files in bytes
+    """
+    trashed_files = TrashedFileEntry.objects.filter(path__in=paths)
+    storage_identifiers = [
+        entry["identifier"] for entry in trashed_files.scalar("entry")
+    ]
+
+    deleted_size = _remove_files(paths)
+    trashed_files.delete()
+    _delete_metadata(storage_identifiers)
+
+    return deleted_size
+
+
+def _move_file_entries_to_trash(path, trash_path, trash_id):
+    """Move the database entries of files in a directory to trash.
+
+    :param path: Original absolute path of the directory
+    :param trash_path: Path of the directory in trash
+    :param trash_id: Identifier of the TrashEntry of the directory
+    """
+    path = str(path)
+    trash_path = str(trash_path)
+    file_collection = FileEntry._get_collection()
+    trash_collection = TrashedFileEntry._get_collection()
+
+    query = {"_id": {"$regex": f"^{re.escape(path)}/"}}
+    while True:
+        entries = list(
+            file_collection.find(query).limit(FILE_ENTRY_QUERY_CHUNK_SIZE)
+        )
+        if not entries:
+            break
+
+        trash_collection.bulk_write(
+            [
+                ReplaceOne(
+                    {"_id": trash_path + entry["_id"][len(path):]},
+                    {"trash": trash_id, "entry": entry},
+                    upsert=True
+                )
+                for entry in entries
+            ],
+            ordered=False
+        )
+        file_collection.delete_many(
+            {"_id": {"$in": [entry["_id"] for entry in entries]}}
+        )
+
+
+def _move_directory_entries_to_trash(trash_entry):
+    """Move the database entries of a directory in trash.
+
+    The entries of the directory and its files are moved after the
+    directory has been moved to trash, so that the request that moved
+    the directory does not have to wait for them. The original path is
+    kept locked until the entries have been moved, and the lock is
+    released after that.
+
+    If the directory was never renamed, because the attempt to move it
+    to trash was interrupted, the TrashEntry is deleted instead.
+
+    :param trash_entry: TrashEntry of the directory
+    :returns: True if the directory is in trash
+    """
+    trash_path = pathlib.Path(CONFIG["UPLOAD_TRASH_PATH"]) / trash_entry.id
+
+    if not trash_entry.entries_moved:
+        if trash_path.exists():
+            DirectoryEntry.delete_tree(trash_entry.path)
+            _move_file_entries_to_trash(
+                trash_entry.path, trash_path, trash_entry.id
+            )
+            trash_entry.update(set__entries_moved=True)
+        else:
+            trash_entry.delete()
+
+        try:
+            ProjectLockManager().release(
+                trash_entry.project, trash_entry.path
+            )
+        except ValueError:
+            # The lock has already expired
+            pass
+
+    return trash_path.exists()
+
+
+def delete_trashed_directory(project, trash_path, progress_callback=None):
+    """Delete a directory that has been moved to trash.
+
+    The database entries of the directory are moved to trash first, if
+    it has not been done yet, and the original path of the directory
+    is unlocked. Then the files are deleted from disk, database and
+    Metax in batches of FILE_DELETE_BATCH_SIZE files, waiting
+    TRASH_DELETE_INTERVAL seconds between the batches. Used quota of
+    the project is decreased after each batch. The files are
+    identified by the database entries in trash, so files that are
+    added to the original path during the deletion are not affected.
+
+    If an earlier attempt was interrupted, calling this function again
+    deletes the remaining files.
+
+    :param project: Project instance
+    :param trash_path: Path of the directory in trash
+    :param progress_callback: Optional function called with the number
+                              of deleted files after each batch
+    :returns: Number of deleted files
+    """
+    batch_size = CONFIG.get(
+        "FILE_DELETE_BATCH_SIZE", DEFAULT_FILE_DELETE_BATCH_SIZE
+    )
+    interval = CONFIG.get(
+        "TRASH_DELETE_INTERVAL", DEFAULT_TRASH_DELETE_INTERVAL
+    )
+    trash_path = pathlib.Path(trash_path)
+    trash_id = trash_path.name
+
+    trash_entry = TrashEntry.objects.filter(id=trash_id).first()
+    if trash_entry and not _move_directory_entries_to_trash(trash_entry):
+        # The directory was not moved to trash
+        return 0
+
+    deleted_count = 0
+    batch = []
+
+    def _delete_batch():
+        nonlocal deleted_count
+        project.decrease_used_quota(_delete_trashed_files(batch))
+        deleted_count += len(batch)
+        batch.clear()
+        if progress_callback:
+            progress_callback(deleted_count)
+
+    for dirpath, _, filenames in os.walk(trash_path):
+        for filename in filenames:
+            batch.append(os.path.join(dirpath, filename))
+            if len(batch) >= batch_size:
+                _delete_batch()
+                time.sleep(interval)
+
+    if batch:
+        _delete_batch()
+
+    # Delete the metadata of files that were already removed from disk
+    # by an interrupted attempt
+    trash_collection = TrashedFileEntry._get_collection()
+    while True:
+        trashed_files = list(
+            trash_collection.find({"trash": trash_id}).limit(batch_size)
+        )
+        if not trashed_files:
+            break
+        _delete_metadata(
+            [file["entry"]["identifier"] for file in trashed_files]
+        )
+        trash_collection.delete_many(
+            {"_id": {"$in": [file["_id"] for file in trashed_files]}}
+        )
+
+    if trash_path.exists():
+        shutil.rmtree(trash_path)
+    TrashEntry.objects.filter(id=trash_id).delete()
+
+    return deleted_count
+
+
 class Resource(abc.ABC):
     """Resource class."""
 
-    def __init__(self, project_id, path):
+    def __init__(self, project_id, path, project=None):
         """Initialize resource.
 
         :param str project_id: The identifier of project that owns the
                                resource.
         :param path: Path of the resource.
+        :param project: Optional Project instance of the project that
+                        owns the resource. If it is not given, the
+                        project is retrieved from the database.
         """
         path = str(path)  # Allow pathlib.Path objects or strings
 
-        # Raise InvalidPathError on attempted path escape
+        # Raise InvalidPathError on attempted path escape. The path is
+        # normalized lexically, so the filesystem is not accessed.
         try:
             relative_path = pathlib.Path(
-                '/root', path.strip('/')
-            ).resolve().relative_to('/root')
+                os.path.normpath(os.path.join('/root', path.strip('/')))
+            ).relative_to('/root')
         except ValueError as error:
             raise InvalidPathError('Invalid path') from error
 
-        self.path = pathlib.Path('/') / relative_path
-        self.project = Project.get(id=project_id)
+        self._init(
+            project=project or Project.get(id=project_id),
+            path=pathlib.Path('/') / relative_path
+        )
+
+    def _init(self, project, path):
+        """Set the attributes of the resource.
+
+        :param project: Project instance
+        :param path: Normalized absolute path of the resource
+        """
+        self.path = path
+        self.project = project
         self._datasets = None
 
+    @classmethod
+    def from_trusted_path(cls, project, path):
+        """Create resource for a path found in the project directory.
+
+        Unlike the constructor, this does not validate the path, query
+        the database or access the filesystem. It is meant for paths
+        found by walking the project directory.
+
+        :param project: Project instance of the project that owns the
+                        resource
+        :param path: Normalized absolute path of the resource, e.g.
+                     ``pathlib.Path("/foo/bar")``
+        :returns: Resource instance
+        """
+        resource = cls.__new__(cls)
+        resource._init(project=project, path=path)
+        return resource
+
     @property
     def storage_path(self):
         """Absolute path of resource."""
@@ -129,8 +444,8 @@ class Resource(abc.ABC):
 class File(Resource):
     """File class."""
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+    def _init(self, project, path):
+        super()._init(project=project, path=path)
 
         self._db_file_ = None
 
@@ -152,11 +467,9 @@ class File(Resource):
         except FileEntry.DoesNotExist as error:
             raise FileNotFoundError from error
 
-        # Extract the project identifier from the file path stored in
-        # database.
-        # TODO: This stupid hack could be avoided if the project
-        # identifier would be stored in the database
-        project_id = pathlib.Path(entry.path)\
+        # Files stored before the project identifier was added to the
+        # database entry are identified by the file path
+        project_id = entry.project or pathlib.Path(entry.path)\
             .relative_to(CONFIG['UPLOAD_PROJECTS_PATH']).parts[0]
 
         project = Project.get(id=project_id)
@@ -215,9 +528,10 @@ class File(Resource):
         """Delete file."""
         lock_manager = ProjectLockManager()
         with lock_manager.lock(self.project.id, self.storage_path):
-            self._get_file_group().delete()
+            deleted_size = self._get_file_group().delete()
 
-            self.project.update_used_quota()
+            self.project.decrease_used_quota(deleted_size)
+            self.project.invalidate_file_tree()
 
             return {'deleted_files_count': 1}
 
@@ -243,60 +557,236 @@ class Directory(Resource):
         lock_manager = ProjectLockManager()
         with lock_manager.lock(directory.project.id, directory.storage_path):
             directory.storage_path.mkdir(parents=True)
+            DirectoryEntry.add_directories(
+                directory.project, [directory.storage_path]
+            )
+        directory.project.invalidate_file_tree()
         return directory
 
     def _get_entries(self):
         return list(os.scandir(self.storage_path))
 
+    def list_entries(self, limit=None, cursor=None, stat=False):
+        """List entries of the directory in order of name.
+
+        The directory is read in one ``os.scandir`` pass. If a limit is
+        given, only the entries of the requested page are kept in
+        memory.
+
+        :param limit: Maximum number of entries to return. By default,
+                      all entries are returned.
+        :param cursor: Name of the last entry of the previous page. Only
+                       entries after it are returned.
+        :param stat: Stat the returned files while the directory is
+                     scanned
+        :returns: Tuple of a list of ``(os.DirEntry, os.stat_result)``
+                  tuples and the cursor of the next page, which is None
+                  if there are no more entries. The stat result is None
+                  for directories, or if ``stat`` is not set.
+        """
+        with os.scandir(self.storage_path) as entries:
+            if cursor is not None:
+                entries = (entry for entry in entries if entry.name > cursor)
+
+            if limit is None:
+                page = sorted(entries, key=attrgetter("name"))
+                next_cursor = None
+            else:
+                page = heapq.nsmallest(
+                    limit + 1, entries, key=attrgetter("name")
+                )
+                next_cursor = None
+                if len(page) > limit:
+                    page = page[:limit]
+                    next_cursor = page[-1].name
+
+            return [
+                (
+                    entry,
+                    entry.stat() if stat and entry.is_file() else None
+                )
+                for entry in page
+            ], next_cursor
+
     def get_files(self):
-        """List of files in directory."""
-        # TODO: Both 'get_files' and 'get_directories' are lazy when it comes
-        # to database access. This means the underlying database entry
-        # is not retrieved until it's accessed for the first time.
-        # This can lead to a "N + 1 query" performance issue if the identifier
-        # is retrieved from each file/directory, for example.
-        # Instead, we should preload any database entries that already exist
-        # in a bulk query and attach them to the instances here
-        return [
-            File(self.project.id, self.path / entry.name)
+        """List of files in directory.
+
+        The database entries of the files are retrieved in one query,
+        and all files share the Project instance of this directory.
+        """
+        files = [
+            File.from_trusted_path(self.project, self.path / entry.name)
             for entry in self._get_entries() if entry.is_file()
         ]
+        _preload_file_entries(files)
+
+        return files
 
     def get_directories(self):
         """List of directories in directory."""
         return [
-            Directory(self.project.id, self.path / entry.name)
+            Directory.from_trusted_path(self.project, self.path / entry.name)
             for entry in self._get_entries() if entry.is_dir()
         ]
 
+    def _iter_files(self):
+        """Iterate over all files in directory and its subdirectories.
+
+        The directory tree is walked with ``os.scandir``, and the files
+        are created without accessing the filesystem or the database
+        again.
+        """
+        directories = [(str(self.storage_path), self.path)]
+        while directories:
+            storage_path, path = directories.pop()
+            try:
+                with os.scandir(storage_path) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            directories.append(
+                                (entry.path, path / entry.name)
+                            )
+                        else:
+                            yield File.from_trusted_path(
+                                self.project, path / entry.name
+                            )
+            except FileNotFoundError:
+                # Directory was removed during the walk
+                continue
+
+    def _iter_file_batches(self):
+        """Iterate over all files in directory in batches.
+
+        The directory tree is walked lazily, and the files are yielded
+        in lists of FILE_DELETE_BATCH_SIZE files with their database
+        entries preloaded, so that memory usage does not depend on the
+        number of files.
+        """
+        batch_size = CONFIG.get(
+            "FILE_DELETE_BATCH_SIZE", DEFAULT_FILE_DELETE_BATCH_SIZE
+        )
+        files = self._iter_files()
+        while True:
+            batch = list(islice(files, batch_size))
+            if not batch:
+                break
+            _preload_file_entries(batch)
+            yield batch
+
     def _get_file_group(self):
         """Group of all files in directory and its subdirectories."""
-        files = []
-        for dirpath, _, filenames in os.walk(self.storage_path):
-            for file in filenames:
-                path = (pathlib.Path(dirpath) / file).relative_to(
-                    self.project.directory
-                )
-                files.append(get_resource(self.project.id, path))
+        files = list(self._iter_files())
+        _preload_file_entries(files)
 
         return FileGroup(files)
 
+    def get_datasets(self):
+        """List all datasets in which the files have been added.
+
+        The datasets are retrieved one batch of files at a time.
+        """
+        datasets = {}
+        for batch in self._iter_file_batches():
+            for dataset in FileGroup(batch).get_datasets():
+                datasets[dataset["identifier"]] = dataset
+
+        return list(datasets.values())
+
+    def has_pending_dataset(self):
+        """Check if any file in the directory has a pending dataset.
+
+        The files are checked one batch at a time, and the check stops
+        at the first batch that has a pending dataset.
+        """
+        return any(
+            FileGroup(batch).has_pending_dataset()
+            for batch in self._iter_file_batches()
+        )
+
     def get_all_files(self):
         """List all files in directory and its subdirectories."""
         return self._get_file_group().files
 
-    def delete(self):
-        """Delete directory."""
-        # Delete all files
-        self._get_file_group().delete()
+    def move_to_trash(self, trash_id=None):
+        """Move directory to trash.
+
+        The directory is renamed to UPLOAD_TRASH_PATH/<trash_id>, so it
+        is removed from the project at once. The trash must be on the
+        same file system as the project directories. If the project
+        directory is moved, a new empty project directory is created.
+
+        The trash directory is recorded as a TrashEntry before it is
+        renamed. The database entries of the directory are moved to
+        trash later by :func:`delete_trashed_directory`, which also
+        deletes the files. The original path is left locked until
+        then, so that files uploaded to the same paths are not mixed up
+        with the files in trash.
+
+        :param trash_id: Identifier of the directory in trash. A random
+                         identifier is used by default.
+        :returns: Path of the directory in trash
+        """
+        if trash_id is None:
+            trash_id = str(uuid.uuid4())
+        trash_path = pathlib.Path(CONFIG["UPLOAD_TRASH_PATH"]) / trash_id
+        trash_path.parent.mkdir(parents=True, exist_ok=True)
+
+        lock_manager = ProjectLockManager()
+        lock_manager.acquire(self.project.id, self.storage_path)
+        try:
+            trash_entry = TrashEntry(
+                id=trash_id,
+                project=self.project.id,
+                path=str(self.storage_path)
+            )
+            trash_entry.save()
+            try:
+                os.rename(self.storage_path, trash_path)
+            except Exception:
+                trash_entry.delete()
+                raise
+        except Exception:
+            lock_manager.release(self.project.id, self.storage_path)
+            raise
 
-        # Remove directory from filesystem. Create new project directory
-        # if the project directory was removed.
-        shutil.rmtree(self.storage_path)
         self.project.directory.mkdir(exist_ok=True)
+        self.project.invalidate_file_tree()
+
+        return trash_path
+
+    def restore_from_trash(self, trash_path):
+        """Move directory back from trash.
+
+        Used if the deletion of a directory that was moved to trash can
+        not be started. The database entries of the directory must not
+        have been moved to trash yet, so the original path is still
+        locked. The lock is released.
+
+        :param trash_path: Path of the directory in trash
+        """
+        trash_path = pathlib.Path(trash_path)
+
+        lock_manager = ProjectLockManager()
+        try:
+            # The directory can replace an empty project directory
+            os.rename(trash_path, self.storage_path)
+            TrashEntry.objects.filter(id=trash_path.name).delete()
+        finally:
+            lock_manager.release(self.project.id, self.storage_path)
+
+        self.project.invalidate_file_tree()
+
+    def delete(self):
+        """Delete directory.
+
+        The directory is moved to trash, and then its files are deleted
+        from disk, database and Metax.
+        """
+        if self.has_pending_dataset():
+            raise HasPendingDatasetError
 
-        # Update used_quota
-        self.project.update_used_quota()
+        trash_path = self.move_to_trash()
+        delete_trashed_directory(self.project, trash_path)
 
     def delete_expired_files(self):
         """Remove expired files.
@@ -310,25 +800,39 @@ class Directory(Resource):
 
         lock_manager = ProjectLockManager()
         with lock_manager.lock(self.project.id, self.storage_path):
+            # The files are checked and deleted one batch at a time
+            deleted_count = 0
+            for batch in self._iter_file_batches():
+                expired_files = [file for file in batch if file.is_expired]
+                if not expired_files:
+                    continue
+
+                file_group = FileGroup(expired_files)
+                expired_files = [
+                    file for file in expired_files
+                    if not file_group.file_has_pending_dataset(file)
+                ]
+                if not expired_files:
+                    continue
+
+                self.project.decrease_used_quota(
+                    _delete_files(file.storage_path for file in expired_files)
+                )
+                deleted_count += len(expired_files)
 
-            expired_files = []
-            file_group = self._get_file_group()
-            for file in file_group.files:
-                if file.is_expired \
-                        and not file_group.file_has_pending_dataset(file):
-                    expired_files.append(file)
-
-            if expired_files:
-                FileGroup(expired_files).delete()
-
-        # Update used_quota
-        self.project.update_used_quota()
+            if deleted_count:
+                self.project.invalidate_file_tree()
 
-        return len(expired_files)
+        return deleted_count
 
 
 class FileGroup():
-    """Class for managing group of files efficiently."""
+    """Class for managing group of files efficiently.
+
+    The files of the group are kept in memory, so the files of a
+    directory tree are handled in groups of FILE_DELETE_BATCH_SIZE
+    files.
+    """
 
     def __init__(self, files):
         """Initialize file group."""
@@ -340,11 +844,19 @@ class FileGroup():
         """Retrieve dataset metadata from Metax."""
         metax_client = get_metax_client()
 
-        # Retrieve file -> dataset(s) associations
-        file_storage_identifiers \
-            = [file.identifier for file in self.files]
-        self._file2dataset \
-            = metax_client.get_file2dataset_dict(file_storage_identifiers)
+        # Retrieve file -> dataset(s) associations in batches, so that
+        # the requests stay small for large groups
+        batch_size = CONFIG.get(
+            "FILE_DELETE_BATCH_SIZE", DEFAULT_FILE_DELETE_BATCH_SIZE
+        )
+        self._file2dataset = {}
+        for i in range(0, len(self.files), batch_size):
+            file_storage_identifiers = [
+                file.identifier for file in self.files[i:i + batch_size]
+            ]
+            self._file2dataset.update(
+                metax_client.get_file2dataset_dict(file_storage_identifiers)
+            )
         # Retrieve metadata of all datasets associated to files
         all_dataset_ids = set()
         for dataset_ids in self._file2dataset.values():
@@ -405,46 +917,39 @@ class FileGroup():
     def delete(self):
         """Delete files of the group.
 
-        Deletes each file from filesystem, database, and Metax.
+        Deletes each file from filesystem, database, and Metax. The
+        files are checked for pending datasets and deleted in batches
+        of FILE_DELETE_BATCH_SIZE files, so that database queries and
+        Metax requests stay small even for very large groups. All
+        batches are checked before any file is deleted.
 
         The metadata of files that are part of a dataset is not removed.
 
-        :param files: List of files to be deleted
+        :returns: Total size of the deleted files in bytes
         """
-        if any(self.file_has_pending_dataset(file) for file in self.files):
+        batch_size = CONFIG.get(
+            "FILE_DELETE_BATCH_SIZE", DEFAULT_FILE_DELETE_BATCH_SIZE
+        )
+        batches = [
+            self.files[i:i + batch_size]
+            for i in range(0, len(self.files), batch_size)
+        ]
+
+        if self._datasets is not None:
+            # The datasets of the whole group have already been
+            # retrieved
+            has_pending_dataset = self.has_pending_dataset()
+        else:
+            has_pending_dataset = any(
+                FileGroup(batch).has_pending_dataset() for batch in batches
+            )
+        if has_pending_dataset:
             raise HasPendingDatasetError
 
-        storage_identifiers = []
-        storage_paths = []  # All storage_paths in one list
-        for file in self.files:
-            # Remove the actual file
-            os.remove(file.storage_path)
-            # add identifiers storage_path to lists for bulk removal
-            # from databases
-            storage_identifiers.append(file.identifier)
-            storage_paths.append(str(file.storage_path))
-
-        # Remove all files from database
-        FileEntry.objects.filter(path__in=storage_paths).delete()
-
-        # Remove metadata from Metax.
-        # The metadata of preserved files should not be removed (see
-        # TPASPKT-749). Deleting files that have pending
-        # datasets is not possible, so at this point we know that if
-        # a file in "directory_files" has a dataset, it is in
-        # preservation. Therefore, we do not have to check the
-        # preservation state of every dataset (which would be very
-        # inefficient), as we can just remove metadata of all files that
-        # are not inlcuded in any dataset.
-        metax_client = get_metax_client()
-        file2datasets = metax_client.get_file2dataset_dict(storage_identifiers)
-        files_without_datasets = [
-            {
-                "storage_identifier": storage_identifier,
-                "storage_service": "pas",
-            }
-            for storage_identifier in storage_identifiers
-            if not file2datasets.get(storage_identifier)
-        ]
-        if files_without_datasets:
-            metax_client.delete_files(files_without_datasets)
+        deleted_size = 0
+        for batch in batches:
+            deleted_size += _delete_files(
+                [file.storage_path for file in batch]
+            )
+
+        return deleted_size
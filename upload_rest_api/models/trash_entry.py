@@ -0,0 +1,56 @@
+"""TrashEntry and TrashedFileEntry classes."""
+from datetime import datetime, timezone
+
+from mongoengine import (BooleanField, DateTimeField, DictField, Document,
+                         StringField)
+
+
+class TrashEntry(Document):
+    """Directory that has been moved to trash to be deleted.
+
+    The directory is in UPLOAD_TRASH_PATH under a directory named after
+    the identifier of the entry. The identifier is also the identifier
+    of the background task that deletes the directory.
+    """
+    # Name of the directory in trash
+    id = StringField(primary_key=True, required=True)
+    # Identifier of the project that contained the directory
+    project = StringField(required=True)
+    # Original absolute file system path of the directory
+    path = StringField(required=True)
+    # Time when the directory was moved to trash
+    created_at = DateTimeField(
+        required=True, default=lambda: datetime.now(timezone.utc)
+    )
+    # True when the database entries of the directory have been moved
+    # to trash. The original path is locked until then.
+    entries_moved = BooleanField(default=False)
+
+    meta = {
+        "collection": "trash",
+        # See FileEntry for why indexes are not created automatically
+        "auto_create_index": False,
+        "indexes": ["project"]
+    }
+
+
+class TrashedFileEntry(Document):
+    """Database entry of a file in a directory that has been moved to trash.
+
+    When a directory is moved to trash, the FileEntry documents of its
+    files are moved here, so that new files can be stored in the
+    original paths without being mixed up with the files in trash.
+    """
+    # Absolute file system path of the file in trash
+    path = StringField(primary_key=True, required=True)
+    # Identifier of the TrashEntry of the directory
+    trash = StringField(required=True)
+    # Original FileEntry document
+    entry = DictField(required=True)
+
+    meta = {
+        "collection": "trashed_files",
+        # See FileEntry for why indexes are not created automatically
+        "auto_create_index": False,
+        "indexes": ["trash"]
+    }
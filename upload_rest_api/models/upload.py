@@ -1,33 +1,69 @@
 """Upload model."""
+import errno
+import json
+import logging
 import os
+import re
 import shutil
-import tarfile
+import time
 import uuid
-import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime, timezone
+from itertools import chain, islice
 from pathlib import Path
 
 import metax_access
 from archive_helpers.extract import (ExtractError, MemberNameError,
-                                     MemberOverwriteError, MemberTypeError,
-                                     extract)
+                                     MemberOverwriteError, MemberTypeError)
 from metax_access.response import MetaxFile
-
-from upload_rest_api.checksum import get_file_checksum
+from mongoengine import NotUniqueError
+
+from upload_rest_api.archive import (ArchiveIndex, ExtractedFile,
+                                     UnsupportedArchiveError,
+                                     extract_tar_stream)
+from upload_rest_api.checksum import (HashingReader, MultiHasher,
+                                      get_file_checksum,
+                                      get_multiple_file_checksums)
 from upload_rest_api.config import CONFIG
 from upload_rest_api.lock import ProjectLockManager
 from upload_rest_api.metax import get_metax_client
+from upload_rest_api.models.directory_entry import DirectoryEntry
 from upload_rest_api.models.file_entry import FileEntry
 from upload_rest_api.models.project import Project, ProjectEntry
 from upload_rest_api.models.resource import Directory, File
-from upload_rest_api.models.upload_entry import UploadEntry, UploadType
+from upload_rest_api.models.upload_entry import (UploadEntry, UploadStage,
+                                                 UploadType)
+
+LOGGER = logging.getLogger(__name__)
+
+# Number of files posted to Metax in the first request. Larger amount
+# would cause performance issues.
+DEFAULT_METAX_POST_BATCH_SIZE = 5000
+# Limits for the adaptive batch size
+DEFAULT_METAX_POST_MIN_BATCH_SIZE = 500
+DEFAULT_METAX_POST_MAX_BATCH_SIZE = 20000
+# Batch size is adjusted so that one request takes about this long
+DEFAULT_METAX_POST_TARGET_SECONDS = 30
+# Upper limit for the estimated size of one request
+DEFAULT_METAX_POST_MAX_PAYLOAD_BYTES = 32 * 1024**2
+# Number of batches posted to Metax at the same time
+DEFAULT_METAX_POST_WORKERS = 2
+# Uploads with at most this many files are checked for conflicts by
+# querying the path of each file from Metax
+DEFAULT_METAX_PATH_QUERY_LIMIT = 100
+# Number of path queries sent to Metax at the same time
+DEFAULT_METAX_QUERY_WORKERS = 4
+# Number of files whose missing checksums are calculated at a time
+# while their metadata is generated
+CHECKSUM_BATCH_SIZE = 1000
 
 
 def _release_lock_on_exception(method):
     """Add file storage lock release functionality to method.
 
     Returns a decorated method of Upload object. The decorated method
-    will release the file storage lock if it fails for any reason.
+    will release the file storage lock and the quota reserved for the
+    upload if it fails for any reason.
     """
 
     def wrapper(self, *args, **kwargs):
@@ -35,6 +71,7 @@ def _release_lock_on_exception(method):
             return method(self, *args, **kwargs)
 
         except Exception:
+            self._release_quota()
             lock_manager = ProjectLockManager()
             lock_manager.release(self.project.id,
                                  self.storage_path)
@@ -68,6 +105,163 @@ class InsufficientQuotaError(UploadError):
     """Exception raised when upload would exceed remaining quota."""
 
 
+class _DirectoryListings:
+    """Listings of directories under a base directory.
+
+    Each directory is listed with a single ``os.scandir`` call the first
+    time a path in it is looked up, so checking many archive members
+    against existing files does not require a stat call per member.
+    """
+
+    def __init__(self, base_path):
+        """Initialize listings.
+
+        :param base_path: Directory under which paths are looked up
+        """
+        self._base_path = str(base_path)
+        self._listings = {}
+
+    def _get_listing(self, directory):
+        """Return {name: is_dir} dict of entries in directory."""
+        if directory not in self._listings:
+            listing = {}
+            try:
+                with os.scandir(
+                    os.path.join(self._base_path, directory)
+                ) as entries:
+                    for entry in entries:
+                        listing[entry.name] = entry.is_dir()
+            except (FileNotFoundError, NotADirectoryError):
+                pass
+            self._listings[directory] = listing
+
+        return self._listings[directory]
+
+    def is_dir(self, path):
+        """Return True if path exists and is a directory, False if it
+        exists and is not a directory, and None if it does not exist.
+
+        :param path: Path relative to the base directory
+        """
+        path = os.path.normpath(path)
+        directory, name = os.path.split(path)
+        return self._get_listing(directory).get(name, None)
+
+
+class _StagedFile:
+    """File in the temporary project directory of an upload.
+
+    Instances are created for every file of an upload, so the
+    attributes are stored in slots to keep the memory footprint small.
+    """
+
+    __slots__ = ("relative_path", "size", "atime", "checksum")
+
+    def __init__(self, relative_path, size, atime, checksum=None):
+        """Initialize staged file.
+
+        :param relative_path: Path relative to the project directory
+        :param size: Size of the file in bytes
+        :param atime: Last access time as a POSIX timestamp
+        :param checksum: MD5 checksum of the file, if already known
+        """
+        self.relative_path = relative_path
+        self.size = size
+        self.atime = atime
+        self.checksum = checksum
+
+    @property
+    def name(self):
+        """Name of the file."""
+        return self.relative_path.rpartition("/")[2]
+
+
+def _scan_staged_files(base_path, prefix="", empty_directories=None):
+    """Yield the files under a directory in the order of their paths.
+
+    The directory tree is walked with ``os.scandir``, and the relative
+    path of each file is built from the names of the directory entries.
+    The size and access time come from the same ``stat`` call. The
+    entries of each directory are sorted, so that the files are yielded
+    in the order of their relative paths without keeping the whole tree
+    in memory.
+
+    :param base_path: Directory to scan
+    :param prefix: Relative path of ``base_path``
+    :param empty_directories: Optional list to which the relative paths
+                              of directories that do not contain any
+                              files are appended. Subdirectories are
+                              appended before their parents.
+    :returns: Iterator of _StagedFile instances
+    """
+    with os.scandir(base_path) as entries:
+        # The descendants of a directory are ordered by the path of the
+        # directory followed by a slash
+        entries = sorted(
+            (
+                (
+                    f"{entry.name}/"
+                    if entry.is_dir(follow_symlinks=False)
+                    else entry.name
+                ),
+                entry
+            )
+            for entry in entries
+        )
+
+    has_files = False
+    for key, entry in entries:
+        relative_path = f"{prefix}{entry.name}"
+        if key.endswith("/"):
+            subdirectory_has_files = yield from _scan_staged_files(
+                entry.path, f"{relative_path}/", empty_directories
+            )
+            if subdirectory_has_files:
+                has_files = True
+            elif empty_directories is not None:
+                empty_directories.append(relative_path)
+        else:
+            has_files = True
+            stat_result = entry.stat(follow_symlinks=False)
+            yield _StagedFile(
+                relative_path, stat_result.st_size, stat_result.st_atime
+            )
+
+    return has_files
+
+
+def _merge_directory(source_directory, target_directory):
+    """Move the contents of a directory into another directory.
+
+    Entries that do not exist in the target directory are renamed
+    whole, so a new directory tree is moved with a single ``rename``.
+    Only directories that already exist in the target directory are
+    merged entry by entry. A directory created by a concurrent upload
+    between the check and the rename is merged as well.
+
+    :param source_directory: Directory whose contents are moved
+    :param target_directory: Existing directory into which the contents
+                             are moved
+    """
+    with os.scandir(source_directory) as entries:
+        for entry in entries:
+            target_path = os.path.join(target_directory, entry.name)
+            is_dir = entry.is_dir(follow_symlinks=False)
+            if is_dir and os.path.isdir(target_path):
+                _merge_directory(entry.path, target_path)
+                continue
+
+            try:
+                os.rename(entry.path, target_path)
+            except OSError as error:
+                if not is_dir \
+                        or error.errno not in (errno.ENOTEMPTY, errno.EEXIST):
+                    raise
+                # Another upload created the directory after it was
+                # checked
+                _merge_directory(entry.path, target_path)
+
+
 class Upload:
     """Class for handling uploads."""
 
@@ -80,8 +274,14 @@ class Upload:
     path = property(lambda x: x._db_upload.path)
     type_ = property(lambda x: x._db_upload.type_)
     source_checksum = property(lambda x: x._db_upload.source_checksum)
+    calculated_checksum = property(
+        lambda x: x._db_upload.calculated_checksum
+    )
     size = property(lambda x: x._db_upload.size)
     is_tus_upload = property(lambda x: x._db_upload.is_tus_upload)
+    is_extracted = property(lambda x: x._db_upload.is_extracted)
+    allocated_size = property(lambda x: x._db_upload.allocated_size)
+    stage = property(lambda x: x._db_upload.stage)
     started_at = property(lambda x: x._db_upload.started_at)
     project = property(lambda x: Project(x._db_upload.project))
 
@@ -146,6 +346,11 @@ class Upload:
         """Path to the source file/archive."""
         return self._tmp_path / "source"
 
+    @property
+    def _manifest_path(self):
+        """Path to the manifest of extracted files."""
+        return self._tmp_path / "manifest.json"
+
     @classmethod
     def create(cls, resource, size, identifier=None, is_tus_upload=None):
         """Create new upload.
@@ -178,59 +383,96 @@ class Upload:
             db_upload.is_tus_upload = is_tus_upload
         upload = cls(db_upload=db_upload)
 
-        # Check that project has enough quota. Update used quota
-        # first, since multiple users might be using the same
-        # project
-        upload.project.update_used_quota()
-
-        if upload.project.remaining_quota - size < 0:
+        # Reserve quota for the upload
+        if not upload.project.reserve_quota(size):
             raise InsufficientQuotaError("Quota exceeded")
 
-        # Check for conflicts
-        if upload.storage_path.is_file():
-            raise UploadConflictError(
-                f"File '{upload.resource.path}' already exists",
-                [str(upload.resource.path)]
-            )
-
-        dir_already_exists = (
-            upload.type_ == UploadType.FILE
-            and upload.storage_path.is_dir()
-        )
+        try:
+            # Check for conflicts
+            if upload.storage_path.is_file():
+                raise UploadConflictError(
+                    f"File '{upload.resource.path}' already exists",
+                    [str(upload.resource.path)]
+                )
 
-        if dir_already_exists:
-            raise UploadConflictError(
-                f"Directory '{upload.resource.path}' already exists",
-                [str(upload.resource.path)]
+            dir_already_exists = (
+                upload.type_ == UploadType.FILE
+                and upload.storage_path.is_dir()
             )
 
-        # Lock the storage path
-        lock_manager = ProjectLockManager()
-        lock_manager.acquire(upload.project.id, upload.storage_path)
+            if dir_already_exists:
+                raise UploadConflictError(
+                    f"Directory '{upload.resource.path}' already exists",
+                    [str(upload.resource.path)]
+                )
+
+            # Lock the storage path
+            lock_manager = ProjectLockManager()
+            lock_manager.acquire(upload.project.id, upload.storage_path)
+        except Exception:
+            upload.project.decrease_used_quota(size)
+            raise
 
         # Create temporary path
         upload._tmp_path.mkdir(exist_ok=True, parents=True)
 
+        db_upload.allocated_size = size
         db_upload.save(force_insert=True)
 
         return upload
 
+    def _reserve_quota(self, size):
+        """Reserve more quota for the upload.
+
+        :param size: Number of bytes to reserve
+        :raises InsufficientQuotaError: If there is not enough quota
+        """
+        if not self.project.reserve_quota(size):
+            raise InsufficientQuotaError("Quota exceeded")
+
+        self._db_upload.update(inc__allocated_size=size)
+        self._db_upload.allocated_size += size
+
+    def _release_quota(self):
+        """Release all quota reserved for the upload."""
+        self._allocate_quota(-self.allocated_size)
+
+    def _allocate_quota(self, size):
+        """Add bytes to the used quota of the project.
+
+        The allocated bytes are recorded, so that they can be released
+        if the upload is cleaned up before it is finished.
+
+        :param size: Number of bytes to allocate. Can be negative.
+        """
+        self.project.increase_used_quota(size)
+        self._db_upload.update(inc__allocated_size=size)
+        self._db_upload.allocated_size += size
+
     @_release_lock_on_exception
     def add_source(self, file, checksum):
         """Save file to source path.
 
+        If the file is a stream, its MD5 checksum is calculated while it
+        is written, so that the source file does not have to be read
+        again to verify or store it.
+
         :param file: File stream or path to file
         :param checksum: MD5 checksum of file, or ``None`` if unknown
         :returns: ``None``
         """
         if 'read' in dir(file):
             # 'file' is a stream. Write it to source path in 1MB chunks
+            hasher = MultiHasher(["md5"])
             with open(self._source_path, "wb") as source_file:
                 while True:
                     chunk = file.read(1024*1024)
                     if chunk == b'':
                         break
                     source_file.write(chunk)
+                    hasher.update(chunk)
+
+            self._db_upload.calculated_checksum = hasher.hexdigests()["md5"]
         else:
             # 'file' is path to a file. Move it to source path.
             Path(file).rename(self._source_path)
@@ -238,89 +480,268 @@ class Upload:
         self._db_upload.source_checksum = checksum
         self._db_upload.save()
 
+    @_release_lock_on_exception
+    def extract_stream(self, stream, checksum):
+        """Extract tar archive from stream to temporary project directory.
+
+        The archive is checked and extracted while the stream is read,
+        so the archive itself is never written to disk. The members
+        are checked for conflicts and quota in the same way as in
+        :meth:`store_files`, which then only has to create metadata
+        for the extracted files.
+
+        :param stream: Stream of optionally compressed tar archive
+        :param checksum: MD5 checksum of the archive, or ``None`` if
+                         unknown
+        :returns: ``None``
+        """
+        if self.type_ != UploadType.ARCHIVE:
+            raise ValueError("Only archives can be extracted")
+
+        reader = HashingReader(stream, ["md5"])
+        remaining_quota = self.project.remaining_quota
+        listings = _DirectoryListings(self.storage_path)
+        conflicts = []
+        extracted_size = 0
+
+        def _check_member(member):
+            """Check conflicts and quota before member is extracted."""
+            nonlocal extracted_size
+
+            if _is_conflict(member, listings):
+                conflicts.append(f'{self.path}/{member.name}')
+
+            extracted_size += member.size
+            # The quota is reserved when the archive has been extracted,
+            # but extraction is stopped early if the quota would clearly
+            # be exceeded
+            if remaining_quota - extracted_size < 0:
+                raise InsufficientQuotaError("Quota exceeded")
+
+        self._tmp_storage_path.mkdir(parents=True, exist_ok=True)
+        try:
+            try:
+                manifest = extract_tar_stream(
+                    reader, self._tmp_storage_path, _check_member
+                )
+            except UnsupportedArchiveError as error:
+                raise UploadError(
+                    "Uploaded file is not a supported tar archive"
+                ) from error
+            except (MemberNameError, MemberTypeError, MemberOverwriteError,
+                    ExtractError) as error:
+                raise InvalidArchiveError(str(error)) from error
+
+            # Read the end-of-archive blocks to get the checksum of the
+            # whole archive
+            reader.drain()
+
+            if conflicts:
+                raise UploadConflictError('Some files already exist',
+                                          files=conflicts)
+
+            calculated_checksum = reader.hasher.hexdigests()["md5"]
+            if checksum and checksum != calculated_checksum:
+                raise UploadError(
+                    'Checksum of uploaded file does not match provided '
+                    'checksum.'
+                )
+
+            # Reserve quota for the total size of the archive contents
+            self._reserve_quota(extracted_size)
+        except Exception:
+            shutil.rmtree(self._tmp_path)
+            raise
+
+        # Save the manifest, so that the files do not have to be hashed
+        # again when they are stored
+        self._write_manifest(manifest)
+
+        self._db_upload.source_checksum = checksum
+        self._db_upload.calculated_checksum = calculated_checksum
+        self._db_upload.is_extracted = True
+        self._db_upload.save()
+
+    def _write_manifest(self, manifest):
+        """Save the manifest of extracted files.
+
+        The files are written one per line in the order of their paths
+        relative to the temporary project directory, so that the
+        manifest can be read in the same order as the staged files are
+        scanned.
+
+        :param manifest: Manifest of extracted files as a
+                         {path: ExtractedFile} dict
+        """
+        prefix_length = len(str(self._tmp_project_directory)) + 1
+        with open(self._manifest_path, "w", encoding="utf-8") as file_:
+            for path in sorted(manifest):
+                file_.write(
+                    json.dumps([path[prefix_length:], *manifest[path]])
+                )
+                file_.write("\n")
+
+    def _read_manifest(self):
+        """Read the manifest of extracted files.
+
+        :returns: Iterator of (relative_path, ExtractedFile) tuples in
+                  the order of the relative paths
+        """
+        with open(self._manifest_path, encoding="utf-8") as file_:
+            first_line = file_.readline()
+            if first_line.startswith("{"):
+                # Manifest written by an older version as one
+                # {path: ExtractedFile} dict
+                prefix_length = len(str(self._tmp_project_directory)) + 1
+                manifest = json.loads(first_line + file_.read())
+                for path in sorted(manifest):
+                    yield (
+                        path[prefix_length:],
+                        ExtractedFile(*manifest[path])
+                    )
+                return
+
+            for line in chain([first_line], file_):
+                if line.strip():
+                    relative_path, *extracted_file = json.loads(line)
+                    yield relative_path, ExtractedFile(*extracted_file)
+
+    def _get_source_md5(self):
+        """Return MD5 checksum of the source file.
+
+        The checksum calculated in :meth:`add_source` is used if
+        available. Otherwise the checksum is calculated from the source
+        file.
+        """
+        if self.calculated_checksum:
+            return self.calculated_checksum
+
+        return get_file_checksum("md5", self._source_path)
+
     def _extract_archive(self):
-        """Extract archive to temporary project directory."""
+        """Extract archive to temporary project directory.
+
+        The archive is indexed once, and the index is used for checking
+        conflicts and quota as well as for extraction.
+
+        :returns: Manifest of extracted files as a
+                  {path: ExtractedFile} dict
+        """
         # Ensure that arhive is supported format
-        if not (zipfile.is_zipfile(self._source_path)
-                or tarfile.is_tarfile(self._source_path)):
+        try:
+            index = ArchiveIndex.open(self._source_path)
+        except UnsupportedArchiveError as error:
             self._source_path.unlink()
             raise UploadError(
                 "Uploaded file is not a supported archive"
-            )
-
-        # Read the content of the archive, and compute the total size of
-        # files.
-        if tarfile.is_tarfile(self._source_path):
-            with tarfile.open(self._source_path) as archive:
-                extracted_size = sum(member.size for member in archive)
-                files = [member.name for member in archive if member.isfile()]
-                directories = [member.name for member in archive
-                               if member.isdir()]
-        else:
-            with zipfile.ZipFile(self._source_path) as archive:
-                extracted_size = sum(member.file_size
-                                     for member in archive.filelist)
-                files = [member.filename for member
-                         in archive.infolist() if not member.is_dir()]
-                directories = [member.filename for member in
-                               archive.infolist() if member.is_dir()]
-
-        # Check that files in archive does not overwrite existing
-        # files or directories, and that directories in archive do
-        # not overwrite files.
-        conflicts = []
-        for file in files:
-            extract_path = self.storage_path / file
-            if extract_path.exists():
-                conflicts.append(f'{self.path}/{file}')
-        for directory in directories:
-            extract_path = self.storage_path / directory
-            if extract_path.is_file():
-                conflicts.append(f'{self.path}/{directory}')
-        if conflicts:
+            ) from error
+        except ExtractError as error:
             self._source_path.unlink()
-            raise UploadConflictError('Some files already exist',
-                                      files=conflicts)
+            raise InvalidArchiveError(str(error)) from error
 
-        # Ensure that the project has enough quota available
-        if self.project.remaining_quota - extracted_size < 0:
-            # Remove the archive and raise an exception
-            self._source_path.unlink()
-            raise InsufficientQuotaError("Quota exceeded")
+        with index:
+            # Check that files in archive does not overwrite existing
+            # files or directories, and that directories in archive do
+            # not overwrite files. Each directory is listed only once.
+            listings = _DirectoryListings(self.storage_path)
+            conflicts = [
+                f'{self.path}/{member.name}' for member in index.members
+                if _is_conflict(member, listings)
+            ]
+            if conflicts:
+                self._source_path.unlink()
+                raise UploadConflictError('Some files already exist',
+                                          files=conflicts)
 
-        # Update used quota to account for the total size of the archive
-        # contents.
-        self.project.increase_used_quota(extracted_size)
+            # Ensure that the project has enough quota available
+            # Reserve quota for the total size of the archive contents
+            try:
+                self._reserve_quota(index.size)
+            except InsufficientQuotaError:
+                # Remove the archive
+                self._source_path.unlink()
+                raise
 
-        # Extract files to temporary project directory
-        self._tmp_storage_path.parent.mkdir(parents=True, exist_ok=True)
-        try:
-            extract(self._source_path, self._tmp_storage_path)
-        except (MemberNameError, MemberTypeError, MemberOverwriteError,
-                ExtractError) as error:
-            # Remove the archive and set task's state
-            self._source_path.unlink()
-            raise InvalidArchiveError(str(error)) from error
+            # Extract files to temporary project directory
+            self._tmp_storage_path.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                manifest = index.extract(self._tmp_storage_path)
+            except (MemberNameError, MemberTypeError, MemberOverwriteError,
+                    ExtractError) as error:
+                # Remove the archive and set task's state
+                self._source_path.unlink()
+                raise InvalidArchiveError(str(error)) from error
 
         # Remove archive
         self._source_path.unlink()
 
-    @_release_lock_on_exception
-    def store_files(self, verify_source):
+        return manifest
+
+    def store_files(self, verify_source, resumable=False):
         """Store files.
 
         Moves/extracts source files to temporary project directory,
         creates file metadata, and then moves the files to project
         directory.
 
+        The completed stages and the posted metadata batches are saved
+        to the database, and calling this method again resumes storing
+        from the last completed stage. If storing the files fails, the
+        quota reserved for the upload, the file storage lock and the
+        temporary files are released, unless ``resumable`` is set and
+        the failure was unexpected and occurred after the files were
+        staged.
+
+        If Metax fails to create the metadata of some files, the other
+        files are stored, and the failed files are removed.
+
+        :param verify_source: verify integrity of source file
+        :param resumable: Keep the staged files and the lock if storing
+                          fails unexpectedly, because storing will be
+                          resumed by calling this method again
+        :raises UploadError: if Metax failed to create the metadata of
+                             some files. The other files have been
+                             stored.
+        """
+        try:
+            failed_files = self._store_files(verify_source)
+        except Exception as error:
+            if resumable and self.stage \
+                    and not isinstance(error, UploadError):
+                # Keep the lock and the reserved quota, so that storing
+                # can be resumed
+                raise
+
+            self._release_quota()
+            if self.stage:
+                # The staged files can not be used anymore
+                shutil.rmtree(self._tmp_path, ignore_errors=True)
+            lock_manager = ProjectLockManager()
+            lock_manager.release(self.project.id, self.storage_path)
+            raise
+
+        if failed_files:
+            raise UploadError(
+                "Metadata could not be created for some files",
+                files=failed_files
+            )
+
+    def _set_stage(self, stage):
+        """Save the last completed stage of storing the files."""
+        self._db_upload.stage = stage
+        self._db_upload.save()
+
+    def _stage_files(self, verify_source):
+        """Move or extract the source to temporary project directory.
+
         :param verify_source: verify integrity of source file
         """
         # Verify integrity of source file if checksum was provided
         # TODO: Can source file verfication be removed from this
         # function when TPASPKT-952 is done?
         if verify_source \
-                and self.source_checksum \
-                != get_file_checksum("md5", self._source_path):
+                and not self.is_extracted \
+                and self.source_checksum != self._get_source_md5():
             self._source_path.unlink()
             raise UploadError(
                 'Checksum of uploaded file does not match provided '
@@ -330,22 +751,141 @@ class Upload:
         if self.type_ == UploadType.FILE:
             self._tmp_storage_path.parent.mkdir(parents=True, exist_ok=True)
             self._source_path.rename(self._tmp_storage_path)
-        else:
-            self._extract_archive()
-
-        # Refuse to store files if Metax has conflicting files. See
-        # https://jira.ci.csc.fi/browse/TPASPKT-749 for more
-        # information.
-        new_files = []
-        for dirpath, _, files in os.walk(self._tmp_project_directory):
-            for fname in files:
-                new_files.append(
-                    Path(dirpath, fname).relative_to(
-                        self._tmp_project_directory
-                    )
-                )
+        elif not self.is_extracted:
+            # Checksums of extracted files are calculated during
+            # extraction. They are saved, so that they are available
+            # if storing is resumed.
+            self._write_manifest(self._extract_archive())
+
+    def _scan_tmp_project_directory(self, empty_directories=None):
+        """Scan the files in the temporary project directory.
+
+        The files are yielded in the order of their relative paths, so
+        that posted batches can be identified if storing is resumed.
+        Each step of storing the files scans the directory again
+        instead of keeping a list of all files in memory.
+
+        :param empty_directories: Optional list to which the relative
+                                  paths of directories that do not
+                                  contain files are appended
+        :returns: Iterator of _StagedFile instances
+        """
+        return _scan_staged_files(
+            self._tmp_project_directory,
+            empty_directories=empty_directories
+        )
+
+    def _remove_failed_files(self):
+        """Remove the staged files whose metadata could not be created."""
+        tmp_directory = str(self._tmp_project_directory)
+        for path in self._db_upload.failed_files:
+            try:
+                os.remove(f"{tmp_directory}{path}")
+            except FileNotFoundError:
+                # Removed by an earlier attempt
+                pass
+
+    def _store_files(self, verify_source):
+        """Store files starting from the last completed stage.
+
+        :param verify_source: verify integrity of source file
+        :returns: Paths of the files whose metadata could not be
+                  created
+        """
+        failed_files = list(self._db_upload.failed_files)
+        is_resumed = self.stage is not None
+        if not self.stage:
+            self._stage_files(verify_source)
+            self._set_stage(UploadStage.STAGED)
+
+        if self.stage == UploadStage.METADATA_CREATED \
+                and not self._tmp_path.exists():
+            # An earlier attempt moved the files to the project
+            # directory and removed the temporary directory, but was
+            # interrupted before it finished. The directories are
+            # indexed again in case the attempt was interrupted
+            # before they were indexed.
+            DirectoryEntry.add_directories(
+                self.project, self._get_stored_directories()
+            )
+            self.project.invalidate_file_tree()
+            self._finish_storing()
+            return failed_files
+
+        if self.stage == UploadStage.STAGED:
+            self._check_metax_conflicts()
+            self._set_stage(UploadStage.CHECKED)
+
+        if self.stage == UploadStage.CHECKED:
+            self._create_metadata(allow_existing=is_resumed)
+
+            failed_files = list(self._db_upload.failed_files)
+            if failed_files:
+                # Only the files that have metadata are stored
+                self._remove_failed_files()
+
+            # From now on the upload has allocated exactly the size of
+            # the stored files. The allocation is not released when
+            # the upload is finished, because the files remain in the
+            # project.
+            stored_size = sum(
+                file.size for file in self._scan_tmp_project_directory()
+            )
+            self._allocate_quota(stored_size - self.allocated_size)
+            self._set_stage(UploadStage.METADATA_CREATED)
+
+        # Move files to project directory
+        directories = self._move_files_to_project_directory()
+        DirectoryEntry.add_directories(self.project, directories)
+        self.project.invalidate_file_tree()
+
+        # Remove temporary directory. The directory might contain
+        # empty directories, it must be removed recursively.
+        shutil.rmtree(self._tmp_path)
+
+        self._finish_storing()
+
+        return failed_files
+
+    def _get_stored_directories(self):
+        """Get the directories that contain the stored files.
+
+        The stored files are found in the database, so this can be used
+        after the temporary project directory has been removed.
+
+        :returns: Iterator of absolute paths of the directories
+        """
+        storage_path = str(self.storage_path)
+        if self.type_ == UploadType.FILE:
+            return iter([os.path.dirname(storage_path)])
+
+        return FileEntry.objects.filter(
+            __raw__={"_id": {"$regex": f"^{re.escape(storage_path)}/"}}
+        ).scalar("parent")
+
+    def _finish_storing(self):
+        """Delete the finished upload and release the lock."""
+        # The stored files have already been added to the used quota
+        self._db_upload.delete()
+
+        # Release file storage lock
+        lock_manager = ProjectLockManager()
+        lock_manager.release(self.project.id, self.storage_path)
+
+    def _check_metax_conflicts(self):
+        """Refuse to store files if Metax has conflicting files.
+
+        See https://jira.ci.csc.fi/browse/TPASPKT-749 for more
+        information.
+
+        :raises UploadConflictError: If some file already has metadata
+        """
         metax_client = get_metax_client()
-        if len(new_files) == 1:
+        new_files = (
+            file.relative_path for file in self._scan_tmp_project_directory()
+        )
+        first_files = list(islice(new_files, 2))
+        if len(first_files) == 1:
             # Creating metadata for only one file, so it is probably
             # more efficient to retrieve information about single file
             try:
@@ -363,13 +903,10 @@ class Upload:
                 # No conflicts
                 pass
         else:
-            # Retrieve list of all files as one request to avoid sending
-            # too many requests to Metax.
-            conflicts = []  # Uploaded files that already exist in Metax
-            old_files = metax_client.get_files_dict(self.project.id).keys()
-            for file in new_files:
-                if f"/{file}" in old_files:
-                    conflicts.append(str(file))
+            # Uploaded files that already exist in Metax
+            conflicts = self._find_metax_conflicts(
+                chain(first_files, new_files)
+            )
             if conflicts:
                 shutil.rmtree(self._tmp_path)
                 raise UploadConflictError(
@@ -377,105 +914,422 @@ class Upload:
                     'already have metadata', files=conflicts
                 )
 
-        # Generate metadata
-        metadata_dicts = []  # File metadata for Metax
-        file_documents = []  # Basic file information to database
-        for dirpath, _, files in os.walk(self._tmp_project_directory):
-            for fname in files:
-                file = Path(dirpath, fname)
-                relative_path = file.relative_to(self._tmp_project_directory)
-
-                # Create file information for database
-                identifier = str(uuid.uuid4().urn)
-                file_checksum_provided = (
-                    self.type_ == UploadType.FILE
-                    and self.source_checksum
+    def _create_metadata(self, allow_existing=False):
+        """Post metadata to Metax and save files to database.
+
+        Metadata is generated, posted to Metax and saved to the
+        database one batch at a time while the temporary project
+        directory is scanned, so that memory usage depends on the batch
+        size instead of the number of files. The index ranges of saved
+        batches are recorded, and files in the ranges recorded by an
+        earlier interrupted attempt are skipped.
+
+        :param allow_existing: Ignore files that were already saved to
+                               database by an earlier attempt, and do
+                               not post metadata that was already
+                               created in Metax by an earlier attempt
+        """
+        def _staged_files():
+            """Scan the staged files with their known checksums."""
+            staged_files = self._scan_tmp_project_directory()
+
+            # The checksum of a single file is already known if it was
+            # calculated when the source was written, or if it was
+            # provided by the user. Checksums of extracted files are
+            # found in the manifest of the archive. The remaining
+            # checksums are calculated while the metadata is generated.
+            if self.type_ == UploadType.FILE:
+                return _with_checksum(
+                    staged_files,
+                    self.calculated_checksum or self.source_checksum
                 )
-                if file_checksum_provided:
-                    checksum = self.source_checksum
-                else:
-                    checksum = get_file_checksum("md5", file)
-
-                file_documents.append(
-                    FileEntry(
-                        path=str(self.project.directory / relative_path),
-                        checksum=checksum,
-                        identifier=identifier
-                    )
+            return _with_manifest_checksums(
+                staged_files, self._read_manifest()
+            )
+
+        def _unposted_files():
+            """Yield indexes of files that have not been posted yet."""
+            posted_batches = iter(sorted(self._db_upload.posted_batches))
+            posted_batch = next(posted_batches, None)
+            for index, file in enumerate(_staged_files()):
+                while posted_batch and posted_batch[1] <= index:
+                    posted_batch = next(posted_batches, None)
+                if posted_batch and posted_batch[0] <= index:
+                    continue
+
+                yield index, file
+
+        # Indexes of the files whose metadata is being posted
+        pending_indexes = {}
+
+        def _files_to_post(files):
+            """Yield files and remember their indexes."""
+            for index, file in files:
+                pending_indexes[f"/{file.relative_path}"] = index
+                yield file
+
+        project_directory = str(self.project.directory)
+
+        def _save_file_entries(batch, response):
+            """Save the files of a posted batch to the database.
+
+            The files whose metadata Metax failed to create are not
+            saved, but recorded as failed.
+            """
+            failed_files = [
+                failed["object"]["pathname"] for failed in response["failed"]
+            ]
+            if failed_files:
+                LOGGER.warning(
+                    "Metax failed to create metadata of %d files of "
+                    "upload %s", len(failed_files), self.id
                 )
+            failed_paths = set(failed_files)
+
+            # The paths were built from the project directory and the
+            # scanned relative paths, so they do not have to be
+            # validated again.
+            timestamp = datetime.now(timezone.utc)
+            try:
+                FileEntry.bulk_insert(
+                    {
+                        "path": f"{project_directory}{metadata['pathname']}",
+                        "checksum": metadata["checksum"][len("md5:"):],
+                        "identifier": metadata["storage_identifier"],
+                        "project": self.project.id,
+                        "parent": os.path.dirname(
+                            f"{project_directory}{metadata['pathname']}"
+                        ),
+                        "size": metadata["size"],
+                        "timestamp": timestamp
+                    }
+                    for metadata in batch
+                    if metadata["pathname"] not in failed_paths
+                )
+            except NotUniqueError:
+                if not allow_existing:
+                    raise
+
+            # The ranges are pushed with a raw query, because
+            # mongoengine can not convert nested lists in push_all
+            posted_batches = _index_ranges(
+                pending_indexes.pop(metadata["pathname"])
+                for metadata in batch
+            )
+            self._db_upload.update(__raw__={
+                "$push": {
+                    "posted_batches": {"$each": posted_batches},
+                    "failed_files": {"$each": failed_files}
+                }
+            })
+            self._db_upload.posted_batches.extend(posted_batches)
+            self._db_upload.failed_files.extend(failed_files)
+
+        posted_files = set()
+        if allow_existing:
+            posted_files = self._find_posted_files(
+                file for _, file in _unposted_files()
+            )
+        if posted_files:
+            # Save the files that were already posted as if they had
+            # been posted now
+            LOGGER.info(
+                "Metadata of %d files of upload %s was already created",
+                len(posted_files), self.id
+            )
+            metadata_dicts = self._generate_metadata(_files_to_post(
+                (index, file) for index, file in _unposted_files()
+                if f"/{file.relative_path}" in posted_files
+            ))
+            batch_size = CONFIG.get(
+                "METAX_POST_BATCH_SIZE", DEFAULT_METAX_POST_BATCH_SIZE
+            )
+            while True:
+                batch = list(islice(metadata_dicts, batch_size))
+                if not batch:
+                    break
+                _save_file_entries(batch, {"success": batch, "failed": []})
+
+        _post_metadata(
+            self._generate_metadata(_files_to_post(_unposted_files())),
+            callback=_save_file_entries
+        )
 
-                # Create metadata
-                timestamp = _iso8601_timestamp(file)
+    def _generate_metadata(self, staged_files):
+        """Generate Metax metadata of staged files.
+
+        Missing checksums are calculated concurrently for
+        ``CHECKSUM_BATCH_SIZE`` files at a time, just before the
+        metadata of the files is needed.
+
+        :param staged_files: Files in the temporary project directory
+        :returns: Iterator of file metadata dictionaries
+        """
+        tmp_directory = str(self._tmp_project_directory)
+        staged_files = iter(staged_files)
+        while True:
+            files = list(islice(staged_files, CHECKSUM_BATCH_SIZE))
+            if not files:
+                break
+
+            unknown_checksums = {
+                os.path.join(tmp_directory, file.relative_path): file
+                for file in files if not file.checksum
+            }
+            if unknown_checksums:
+                checksums = get_multiple_file_checksums(
+                    "md5", list(unknown_checksums)
+                )
+                for path, file in unknown_checksums.items():
+                    file.checksum = checksums[path]
+
+            for file in files:
+                timestamp = _format_timestamp(file.atime)
                 metadata: MetaxFile = {
-                    "storage_identifier": identifier,
+                    "storage_identifier": self._get_storage_identifier(
+                        file.relative_path
+                    ),
                     "filename": file.name,
-                    "size": file.stat().st_size,
+                    "size": file.size,
                     "storage_service": "pas",
-                    "pathname": f"/{relative_path}",
+                    "pathname": f"/{file.relative_path}",
                     "csc_project": self.project.id,
                     "modified": timestamp,
                     "frozen": timestamp,
-                    "checksum": f"md5:{checksum}"
+                    "checksum": f"md5:{file.checksum}"
                     # File format deliberately left out.
-                    # Metax V3 enforces complete file technical metadata
-                    # (format and version) from the get-go, which can't be
-                    # provided at this stage.
+                    # Metax V3 enforces complete file technical
+                    # metadata (format and version) from the get-go,
+                    # which can't be provided at this stage.
                 }
-                metadata_dicts.append(metadata)
+                yield metadata
 
-        # Post all metadata to Metax in one go
-        _post_metadata(metadata_dicts)
+    def _get_storage_identifier(self, relative_path):
+        """Get the storage identifier of a staged file.
 
-        # Insert information of all files to database in one go
-        FileEntry.objects.insert(file_documents)
+        The identifier is derived from the upload and the path, so that
+        the same identifier is used if storing the files is resumed.
 
-        # Move files to project directory
-        self._move_files_to_project_directory()
+        :param relative_path: Path relative to project directory
+        :returns: Storage identifier as URN
+        """
+        return uuid.uuid5(
+            uuid.NAMESPACE_URL, f"{self.id}/{relative_path}"
+        ).urn
 
-        # Remove temporary directory. The directory might contain
-        # empty directories, it must be removed recursively.
-        shutil.rmtree(self._tmp_path)
+    def _find_posted_files(self, staged_files):
+        """Find staged files whose metadata already exists in Metax.
 
-        # Update quota. Delete the upload first so that this upload
-        # is not counted in the quota twice.
-        self._db_upload.delete()
-        self.project.update_used_quota()
+        Metax may have created the metadata of batches that were not
+        recorded as posted, if an earlier attempt was interrupted
+        while the batches were being posted. Metadata is identical if
+        it has the storage identifier generated for the file by this
+        upload.
 
-        # Release file storage lock
-        lock_manager = ProjectLockManager()
-        lock_manager.release(self.project.id, self.storage_path)
+        If there are more than ``METAX_PATH_QUERY_LIMIT`` files, the
+        list of all files of the project is retrieved first, and only
+        the files found in it are queried.
+
+        :param staged_files: Iterable of staged files
+        :returns: Set of paths of the files that were already posted
+        """
+        metax_client = get_metax_client()
+        path_query_limit = CONFIG.get(
+            "METAX_PATH_QUERY_LIMIT", DEFAULT_METAX_PATH_QUERY_LIMIT
+        )
+
+        staged_files = iter(staged_files)
+        queried_files = list(islice(staged_files, path_query_limit + 1))
+        if len(queried_files) > path_query_limit:
+            # The conflicts were checked before posting, so the
+            # existing files can only have been posted by this upload
+            old_files = metax_client.get_files_dict(self.project.id).keys()
+            queried_files = [
+                file for file in chain(queried_files, staged_files)
+                if f"/{file.relative_path}" in old_files
+            ]
+
+        def _is_posted(file):
+            """Check if identical metadata exists in Metax."""
+            try:
+                old_file = metax_client.get_project_file(
+                    self.project.id, f"/{file.relative_path}"
+                )
+            except metax_access.metax.FileNotAvailableError:
+                return False
+            return old_file.get("storage_identifier") \
+                == self._get_storage_identifier(file.relative_path)
+
+        max_workers = CONFIG.get(
+            "METAX_QUERY_WORKERS", DEFAULT_METAX_QUERY_WORKERS
+        )
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            is_posted = list(executor.map(_is_posted, queried_files))
+
+        return {
+            f"/{file.relative_path}"
+            for file, posted in zip(queried_files, is_posted)
+            if posted
+        }
+
+    def _find_metax_conflicts(self, new_files):
+        """Find uploaded files that already have metadata in Metax.
+
+        If there are at most ``METAX_PATH_QUERY_LIMIT`` files, only
+        the paths of the uploaded files are queried from Metax, a few
+        requests at a time. Otherwise the list of all files of the
+        project is retrieved in one request to avoid sending too many
+        requests to Metax.
+
+        :param new_files: Iterable of paths of uploaded files relative
+                          to project directory
+        :returns: List of conflicting paths
+        """
+        metax_client = get_metax_client()
+        path_query_limit = CONFIG.get(
+            "METAX_PATH_QUERY_LIMIT", DEFAULT_METAX_PATH_QUERY_LIMIT
+        )
+
+        new_files = iter(new_files)
+        queried_files = list(islice(new_files, path_query_limit + 1))
+        if len(queried_files) > path_query_limit:
+            old_files = metax_client.get_files_dict(self.project.id).keys()
+            return [
+                str(file) for file in chain(queried_files, new_files)
+                if f"/{file}" in old_files
+            ]
+        new_files = queried_files
+
+        def _has_metadata(file):
+            """Check if file has metadata in Metax."""
+            try:
+                metax_client.get_project_file(self.project.id, f"/{file}")
+            except metax_access.metax.FileNotAvailableError:
+                return False
+            return True
+
+        max_workers = CONFIG.get(
+            "METAX_QUERY_WORKERS", DEFAULT_METAX_QUERY_WORKERS
+        )
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            has_metadata = list(executor.map(_has_metadata, new_files))
+
+        return [
+            str(file) for file, conflict in zip(new_files, has_metadata)
+            if conflict
+        ]
 
     def _move_files_to_project_directory(self):
-        """Move files to project directory."""
-        for dirpath, _, files in os.walk(self._tmp_project_directory):
-            for fname in files:
-                _file = os.path.join(dirpath, fname)
-                relative_path = Path(_file).relative_to(
-                    self._tmp_project_directory
+        """Move files to project directory.
+
+        Permissions of the files are set before they are moved. Empty
+        directories are removed, so that only directories that contain
+        files are created in the project directory. Then directory
+        trees that do not exist in the project directory are moved
+        with one rename, and existing directories are merged.
+
+        :returns: Set of absolute paths of the directories that contain
+                  the moved files
+        """
+        tmp_directory = str(self._tmp_project_directory)
+        project_directory = str(self.project.directory)
+
+        empty_directories = []
+        directories = set()
+        for file in self._scan_tmp_project_directory(empty_directories):
+            # TODO: Write permission for group is required by
+            # packaging service
+            # (see https://jira.ci.csc.fi/browse/TPASPKT-516)
+            os.chmod(os.path.join(tmp_directory, file.relative_path), 0o664)
+            directories.add(
+                os.path.dirname(
+                    os.path.join(project_directory, file.relative_path)
                 )
-                source_path = self._tmp_project_directory / relative_path
-                target_path = self.project.directory / relative_path
-                try:
-                    source_path.rename(target_path)
-                except FileNotFoundError:
-                    target_path.parent.mkdir(exist_ok=True, parents=True)
-                    source_path.rename(target_path)
+            )
+
+        for relative_path in empty_directories:
+            os.rmdir(os.path.join(tmp_directory, relative_path))
+
+        os.makedirs(project_directory, exist_ok=True)
+        _merge_directory(tmp_directory, project_directory)
+
+        return directories
+
+
+def _with_checksum(staged_files, checksum):
+    """Set the same checksum to staged files.
+
+    :param staged_files: Iterable of _StagedFile instances
+    :param checksum: MD5 checksum
+    :returns: Iterator of _StagedFile instances
+    """
+    for file in staged_files:
+        file.checksum = checksum
+        yield file
+
+
+def _with_manifest_checksums(staged_files, manifest):
+    """Set the checksums of staged files from the manifest of an archive.
+
+    Both the files and the manifest are read in the order of relative
+    paths, so they are merged without keeping either in memory.
 
-                # TODO: Write permission for group is required by
-                # packaging service
-                # (see https://jira.ci.csc.fi/browse/TPASPKT-516)
-                os.chmod(target_path, 0o664)
+    :param staged_files: Iterable of _StagedFile instances in the
+                         order of their relative paths
+    :param manifest: Iterable of (relative_path, ExtractedFile) tuples
+                     in the order of the relative paths
+    :returns: Iterator of _StagedFile instances
+    """
+    manifest = iter(manifest)
+    entry = next(manifest, None)
+    for file in staged_files:
+        while entry and entry[0] < file.relative_path:
+            entry = next(manifest, None)
+        if entry and entry[0] == file.relative_path:
+            file.checksum = entry[1].checksum
+        yield file
+
+
+def _is_conflict(member, listings):
+    """Check if archive member would overwrite existing file.
+
+    Files in archive must not overwrite existing files or directories,
+    and directories in archive must not overwrite files.
+
+    :param member: ArchiveMember
+    :param listings: _DirectoryListings of the extraction directory
+    """
+    if member.is_file:
+        return listings.is_dir(member.name) is not None
+    if member.is_dir:
+        return listings.is_dir(member.name) is False
+
+    return False
+
+
+def _index_ranges(indexes):
+    """Return list of [start, end) ranges that cover the indexes.
 
+    :param indexes: Iterable of indexes
+    """
+    ranges = []
+    for index in sorted(indexes):
+        if ranges and ranges[-1][1] == index:
+            ranges[-1][1] = index + 1
+        else:
+            ranges.append([index, index + 1])
+
+    return ranges
 
-def _iso8601_timestamp(fpath):
-    """Return last access time in ISO 8601 format.
 
-    :param fpath: File path
+def _format_timestamp(timestamp):
+    """Return POSIX timestamp in ISO 8601 format.
+
+    :param timestamp: POSIX timestamp
     """
-    timestamp = datetime.fromtimestamp(
-        fpath.stat().st_atime, tz=timezone.utc
-    ).replace(microsecond=0)
-    return timestamp.replace(microsecond=0).isoformat()
+    return datetime.fromtimestamp(
+        timestamp, tz=timezone.utc
+    ).replace(microsecond=0).isoformat()
 
 
 def _strip_metax_response(metax_response):
@@ -504,10 +1358,78 @@ def _strip_metax_response(metax_response):
     return response
 
 
-def _post_metadata(metadata_dicts):
+class _AdaptiveBatchSize:
+    """Size of the metadata batches posted to Metax.
+
+    The batch size is adjusted so that posting one batch takes about
+    ``METAX_POST_TARGET_SECONDS``, and the estimated size of one
+    request does not exceed ``METAX_POST_MAX_PAYLOAD_BYTES``.
+    """
+
+    def __init__(self):
+        """Initialize batch size from configuration."""
+        self._size = CONFIG.get(
+            "METAX_POST_BATCH_SIZE", DEFAULT_METAX_POST_BATCH_SIZE
+        )
+        self._min_size = CONFIG.get(
+            "METAX_POST_MIN_BATCH_SIZE", DEFAULT_METAX_POST_MIN_BATCH_SIZE
+        )
+        self._max_size = CONFIG.get(
+            "METAX_POST_MAX_BATCH_SIZE", DEFAULT_METAX_POST_MAX_BATCH_SIZE
+        )
+        self._target_seconds = CONFIG.get(
+            "METAX_POST_TARGET_SECONDS", DEFAULT_METAX_POST_TARGET_SECONDS
+        )
+        self._max_payload_bytes = CONFIG.get(
+            "METAX_POST_MAX_PAYLOAD_BYTES",
+            DEFAULT_METAX_POST_MAX_PAYLOAD_BYTES
+        )
+        self._item_bytes = None
+
+    @property
+    def size(self):
+        """Number of files to post in the next batch."""
+        size = self._size
+        if self._item_bytes:
+            size = min(size, self._max_payload_bytes // self._item_bytes)
+
+        return max(size, self._min_size)
+
+    def record(self, batch, duration):
+        """Adjust batch size based on a posted batch.
+
+        :param batch: List of posted metadata dicts
+        :param duration: Time it took to post the batch in seconds
+        """
+        # Estimate the size of one file metadata in the request
+        self._item_bytes = len(json.dumps(batch[0]))
+
+        # Scale the batch size towards the target duration, but do not
+        # grow it more than twofold at once
+        scaled_size = int(
+            len(batch) * self._target_seconds / max(duration, 0.001)
+        )
+        self._size = max(
+            self._min_size,
+            min(scaled_size, 2 * len(batch), self._max_size)
+        )
+
+
+def _post_metadata(metadata_dicts, callback=None):
     """Post multiple file metadata dictionaries to Metax.
 
-    :param metadata_dicts: List of file metadata dictionaries
+    The metadata is posted in batches, and at most
+    ``METAX_POST_WORKERS`` batches are posted at the same time. The
+    batch size adapts to the response times of Metax. The metadata
+    dictionaries are read from the iterable only when the next batch
+    is posted, so a generator can be used to avoid keeping all
+    metadata in memory.
+
+    :param metadata_dicts: Iterable of file metadata dictionaries
+    :param callback: Optional function called with each posted batch
+                     and its stripped response. If the callback is
+                     given, the responses are not merged, and None is
+                     returned.
     :returns: Stripped HTTP response returned by Metax.
               Success list contains succesfully generated file
               metadata in format:
@@ -528,32 +1450,46 @@ def _post_metadata(metadata_dicts):
               ]
     """
     metax_client = get_metax_client()
-    metadata = []
-    responses = []
-
-    # Post file metadata to Metax, 5000 files at time. Larger amount
-    # would cause performance issues.
-    i = 0
-    for metadata_dict in metadata_dicts:
-        metadata.append(metadata_dict)
-
-        i += 1
-        if i % 5000 == 0:
-            response = metax_client.post_files(metadata)
-            responses.append(_strip_metax_response(response))
-            metadata = []
-
-    # POST remaining metadata
-    if metadata:
-        response = metax_client.post_files(metadata)
-        responses.append(_strip_metax_response(response))
+    max_workers = CONFIG.get(
+        "METAX_POST_WORKERS", DEFAULT_METAX_POST_WORKERS
+    )
+    batch_size = _AdaptiveBatchSize()
+    metadata_dicts = iter(metadata_dicts)
+
+    def _post_batch(batch):
+        """Post one batch and measure how long it took."""
+        start_time = time.monotonic()
+        response = metax_client.post_files(batch)
+        duration = time.monotonic() - start_time
+        LOGGER.info(
+            "Posted metadata of %d files to Metax in %.2f seconds",
+            len(batch), duration
+        )
+        return batch, duration, _strip_metax_response(response)
 
     # Merge all responses into one response
     response = {"success": [], "failed": []}
-    for metax_response in responses:
-        if "success" in metax_response:
-            response["success"].extend(metax_response["success"])
-        if "failed" in metax_response:
-            response["failed"].extend(metax_response["failed"])
-
-    return response
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+        while True:
+            # Keep the maximum number of batches in flight
+            while len(pending) < max_workers:
+                batch = list(islice(metadata_dicts, batch_size.size))
+                if not batch:
+                    break
+                pending.add(executor.submit(_post_batch, batch))
+
+            if not pending:
+                break
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch, duration, metax_response = future.result()
+                batch_size.record(batch, duration)
+                if callback:
+                    callback(batch, metax_response)
+                    continue
+                response["success"].extend(metax_response["success"])
+                response["failed"].extend(metax_response["failed"])
+
+    return None if callback else response
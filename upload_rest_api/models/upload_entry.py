@@ -3,7 +3,8 @@ from datetime import datetime, timezone
 from enum import Enum
 
 from mongoengine import (BooleanField, DateTimeField, Document, EnumField,
-                         LongField, ReferenceField, StringField)
+                         IntField, ListField, LongField, ReferenceField,
+                         StringField)
 
 
 from upload_rest_api.models.project_entry import ProjectEntry
@@ -15,6 +16,18 @@ class UploadType(Enum):
     ARCHIVE = "archive"
 
 
+class UploadStage(Enum):
+    """Last completed stage of storing the files of an upload."""
+    # Files have been moved or extracted to the temporary project
+    # directory
+    STAGED = "staged"
+    # Files have been checked for conflicts with existing metadata
+    CHECKED = "checked"
+    # Metadata has been posted to Metax and saved to database for all
+    # files
+    METADATA_CREATED = "metadata_created"
+
+
 class UploadEntry(Document):
     """Document of an active upload in the MongoDB database
 
@@ -30,13 +43,32 @@ class UploadEntry(Document):
     type_ = EnumField(UploadType, db_field="type")
     project = ReferenceField(ProjectEntry, required=True)
     source_checksum = StringField()
+    # MD5 checksum calculated while the source file was written, or
+    # None if the source file was not written from a stream
+    calculated_checksum = StringField()
 
     is_tus_upload = BooleanField(default=False)
+    # True if the archive was extracted while it was uploaded
+    is_extracted = BooleanField(default=False)
+
+    # Stage of storing the files, or None if storing has not started.
+    # Storing is resumed from this stage if it is interrupted.
+    stage = EnumField(UploadStage)
+    # [start, end) index ranges of files, in the order of their
+    # relative paths, whose metadata has been posted to Metax and
+    # saved to database
+    posted_batches = ListField(ListField(IntField()))
+    # Paths of files, relative to the project directory, whose metadata
+    # Metax failed to create. The files are not stored.
+    failed_files = ListField(StringField())
 
     started_at = DateTimeField(default=lambda: datetime.now(timezone.utc))
 
     # Size of the file to upload in bytes
     size = LongField(required=True)
+    # Number of bytes this upload has added to the used quota of the
+    # project
+    allocated_size = LongField(default=0)
 
     meta = {
         "collection": "uploads"